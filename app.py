@@ -1,6 +1,8 @@
 from fastapi import FastAPI, Depends
 
-from flash.config.config import initiate_database
+from flash.config.config import initiate_database, start_http_client, stop_http_client, open_database, \
+    close_database, start_cache_listener, stop_cache_listener, start_background_queue, stop_background_queue, \
+    start_insights_writer, stop_insights_writer, start_health_checks, stop_health_checks
 
 app = FastAPI()
 
@@ -8,7 +10,31 @@ app = FastAPI()
 @app.on_event("startup")
 async def start_database():
     # await initiate_database()
-    pass
+    await open_database(app)
+    await start_cache_listener(app)
+    await start_background_queue()
+    await start_insights_writer(app)
+    await start_health_checks(app)
+
+
+@app.on_event("startup")
+async def start_upstream_client():
+    await start_http_client()
+
+
+@app.on_event("shutdown")
+async def stop_upstream_client():
+    await stop_http_client()
+
+
+@app.on_event("shutdown")
+async def stop_database():
+    # uvicorn only runs shutdown handlers once in flight requests are done
+    await stop_health_checks(app)
+    await stop_background_queue()
+    await stop_insights_writer(app)
+    await stop_cache_listener(app)
+    await close_database(app)
 
 
 @app.get("/", tags=["Root"])
@@ -18,6 +44,22 @@ async def read_root():
 
 from flash.ping.controller import router as ping_router
 from flash.service.controller import router as service_router
+from flash.rate_limiter.controller import router as rate_limiter_router
+from flash.circuit_breaker.controller import router as circuit_breaker_router
+from flash.request_validator.controller import router as request_validator_router
+from flash.endpoint_cacher.controller import router as endpoint_cacher_router
+from flash.event.controller import router as event_router
+from flash.insights.controller import router as insights_router
+
+# the proxy middleware hands every path under /gateway to these routes
+app.include_router(ping_router, prefix="/gateway", tags=["Ping"])
+app.include_router(service_router, prefix="/gateway", tags=["Service"])
+app.include_router(rate_limiter_router, prefix="/gateway", tags=["Rate Limiter"])
+app.include_router(circuit_breaker_router, prefix="/gateway", tags=["Circuit Breaker"])
+app.include_router(request_validator_router, prefix="/gateway", tags=["Request Validator"])
+app.include_router(endpoint_cacher_router, prefix="/gateway", tags=["Endpoint Cache"])
+app.include_router(event_router, prefix="/gateway", tags=["Event"])
+app.include_router(insights_router, prefix="/gateway", tags=["Insights"])
 
-app.include_router(ping_router, tags=["Ping"])
-app.include_router(service_router, tags=["Service"])
+# registers the proxy middleware on app
+import flash.proxy.middleware
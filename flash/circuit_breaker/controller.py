@@ -9,6 +9,7 @@ from flash.circuit_breaker.schema import circuit_breaker_validator
 from flash.common.error_code import ERROR_SERVER
 from flash.common.resp import resp_error_json, resp_success_json
 from flash.models.circuit_breaker import CircuitBreaker
+from flash.proxy.policy import Policy
 from flash.service import controller as service_controller
 from flash.util import DB, Bson
 from flash.util.validate import Validate
@@ -23,6 +24,7 @@ async def post_handler(request: Request):
         ctx = json.loads(await request.json())
         Validate.validate_schema(ctx, circuit_breaker_validator)
         await CircuitBreaker.create(circuit_breaker_validator.normalized(ctx), DB.get(request, table), DB.get(request, service_controller.table))
+        Policy.invalidate(ctx.get('service_id'))
         return resp_success_json(msg='Circuit breaker created')
     except Exception as err:
         return resp_error_json(ERROR_SERVER, msg=str(err))
@@ -64,6 +66,7 @@ async def patch_handler(request: Request):
         Validate.validate_schema(ctx, circuit_breaker_validator)
         Validate.validate_object_id(circuit_breaker_id)
         await CircuitBreaker.update(circuit_breaker_id, pydash.omit(ctx, 'id'), DB.get(request, table))
+        Policy.invalidate()
         return resp_success_json(msg='Circuit breaker updated')
     except Exception as err:
         return resp_error_json(ERROR_SERVER, msg=str(err))
@@ -73,6 +76,7 @@ async def delete_handler(request: Request):
     try:
         Validate.validate_object_id(request.query_params.get('id'))
         await CircuitBreaker.remove(request.query_params.get('id'), DB.get(request, table))
+        Policy.invalidate()
         return resp_success_json(msg='Circuit breaker deleted')
     except Exception as err:
         return resp_error_json(ERROR_SERVER, msg=str(err))
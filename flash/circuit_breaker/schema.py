@@ -41,6 +41,16 @@ circuit_breaker_schema = {
         'min': 0,
         'default': 60
     },
+    'min_requests': {
+        'type': 'integer',
+        'min': 1,
+        'default': 10
+    },
+    'half_open_probes': {
+        'type': 'integer',
+        'min': 1,
+        'default': 1
+    },
     'tripped_count': {
         'type': 'integer',
         'default': 0
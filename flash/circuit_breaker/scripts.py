@@ -0,0 +1,82 @@
+# redis lua script moving the shared state of a circuit breaker in one atomic
+# step. the state is only written when it is not closed, so a healthy service
+# has no key at all.
+#
+# KEYS[1]: state key
+# ARGV[1]: action, one of sync, trip, probe, success, failure or release
+# ARGV[2]: cooldown in milliseconds
+# ARGV[3]: max concurrent half open probes, also the successes closing the breaker
+#
+# an open breaker turns half open once its cooldown is over. in half open
+# `until` is the deadline of the probes in flight, so probes of a worker that
+# died are given back after one cooldown.
+#
+# returns {state, ms left of the cooldown or probe deadline, changed (0|1)}
+# where changed tells if the action was applied: the breaker tripped, a probe
+# was granted or the probe outcome closed or reopened it
+
+transition = """
+if redis.replicate_commands then redis.replicate_commands() end
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local action = ARGV[1]
+local cooldown = tonumber(ARGV[2])
+local max_probes = tonumber(ARGV[3])
+
+local breaker = redis.call('HMGET', KEYS[1], 'state', 'until', 'probes', 'successes')
+local state = breaker[1] or 'closed'
+local open_until = tonumber(breaker[2] or '0')
+local probes = tonumber(breaker[3] or '0')
+local successes = tonumber(breaker[4] or '0')
+local changed = 0
+
+if state == 'open' and now >= open_until then
+    state = 'half_open'
+    probes = 0
+    successes = 0
+elseif state == 'half_open' and now >= open_until then
+    probes = 0
+end
+
+if action == 'trip' then
+    if state == 'closed' then
+        state = 'open'
+        open_until = now + cooldown
+        changed = 1
+    end
+elseif action == 'probe' then
+    if state == 'half_open' and probes < max_probes then
+        probes = probes + 1
+        open_until = now + cooldown
+        changed = 1
+    end
+elseif action == 'success' then
+    if state == 'half_open' then
+        probes = math.max(probes - 1, 0)
+        successes = successes + 1
+        if successes >= max_probes then
+            state = 'closed'
+            changed = 1
+        end
+    end
+elseif action == 'failure' then
+    if state == 'half_open' then
+        state = 'open'
+        open_until = now + cooldown
+        changed = 1
+    end
+elseif action == 'release' then
+    if state == 'half_open' then
+        probes = math.max(probes - 1, 0)
+    end
+end
+
+if state == 'closed' then
+    redis.call('DEL', KEYS[1])
+    return {state, 0, changed}
+end
+redis.call('HSET', KEYS[1], 'state', state, 'until', open_until, 'probes', probes, 'successes', successes)
+-- an idle half open breaker is forgotten, which closes it
+redis.call('PEXPIRE', KEYS[1], cooldown * 2 + 60000)
+return {state, math.max(open_until - now, 0), changed}
+"""
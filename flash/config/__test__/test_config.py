@@ -0,0 +1,56 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from flash.config.config import check_database, close_database
+from flash.util import DB
+
+fakeredis = pytest.importorskip('fakeredis.aioredis')
+
+
+class Mongo:
+    """
+    mongo database answering ping
+    """
+
+    def __init__(self, up: bool):
+        self.up = up
+        self.collections = {}
+
+    async def command(self, name: str):
+        if not self.up:
+            raise ConnectionError('mongo is down')
+        return {'ok': 1}
+
+    def __getitem__(self, name: str):
+        return self.collections.setdefault(name, SimpleNamespace(name=name))
+
+
+def build_app(mongo_up: bool = True) -> SimpleNamespace:
+    return SimpleNamespace(state=SimpleNamespace(
+        mongo=Mongo(mongo_up),
+        redis=fakeredis.FakeRedis(decode_responses=True),
+        redis_bytes=fakeredis.FakeRedis(),
+    ))
+
+
+def test_clients_are_read_from_the_app_state():
+    app = build_app()
+    request = SimpleNamespace(app=app)
+    assert DB.get(request, 'service') is app.state.mongo['service']
+    assert DB.get_redis(request) is app.state.redis
+    assert DB.get_redis_bytes(request) is app.state.redis_bytes
+
+
+def test_check_database_reports_each_database():
+    assert asyncio.run(check_database(build_app())) == {'mongo': True, 'redis': True}
+    assert asyncio.run(check_database(build_app(mongo_up=False))) == {'mongo': False, 'redis': True}
+
+
+def test_close_database_closes_the_pooled_clients():
+    closed = []
+    app = build_app()
+    app.state.mongo_client = SimpleNamespace(close=lambda: closed.append('mongo'))
+    asyncio.run(close_database(app))
+    assert closed == ['mongo']
@@ -1,20 +1,63 @@
+import asyncio
 from typing import Optional
 
+import aioredis
 from beanie import init_beanie
 from motor.motor_asyncio import AsyncIOMotorClient
 # from pydantic import BaseSettings
 from pydantic_settings import BaseSettings
 import flash.models as models
+from flash.models.endpoint_cacher import EndpointCacher
+from flash.models.insights import Insights, collection_name as insights_collection
+from flash.models.insights_rollup import InsightsRollup, collection_name as insights_rollup_collection
+from flash.util.env import REDIS
+from flash.util.http import Http
+from flash.util.queue import Background
+from flash.proxy.health import TargetHealth
+from flash.proxy.insights_writer import InsightsWriter
 
 
 class Settings(BaseSettings):
     # database configurations
     DATABASE_URL: Optional[str] = None
+    DATABASE_NAME: str = "raven"
+    MONGO_POOL_SIZE: int = 100
+    MONGO_MIN_POOL_SIZE: int = 0
+    MONGO_TIMEOUT_MS: int = 5000
+    REDIS_URL: Optional[str] = None
+    REDIS_POOL_SIZE: int = 100
+    REDIS_TIMEOUT: float = 5
+    REDIS_BYTES_POOL_SIZE: int = 50
 
     # JWT
     secret_key: str = "secret"
     algorithm: str = "HS256"
 
+    # upstream http client
+    HTTP_POOL_SIZE: int = 100
+    HTTP_POOL_SIZE_PER_HOST: int = 0
+    HTTP_DNS_CACHE_TTL: int = 300
+    HTTP_KEEPALIVE_TIMEOUT: float = 15
+    HTTP_TIMEOUT: float = 30
+
+    # in-process background queue
+    BACKGROUND_QUEUE_SIZE: int = 10000
+    BACKGROUND_QUEUE_WORKERS: int = 4
+    BACKGROUND_QUEUE_PUT_TIMEOUT: float = 0.05
+    BACKGROUND_QUEUE_DRAIN_TIMEOUT: float = 5
+
+    # insights write behind
+    INSIGHTS_BATCH_SIZE: int = 500
+    INSIGHTS_FLUSH_INTERVAL: float = 1
+    INSIGHTS_BUFFER_SIZE: int = 50000
+    # plain, ttl or timeseries
+    INSIGHTS_STORAGE: str = 'ttl'
+    INSIGHTS_RETENTION_DAYS: int = 30
+    INSIGHTS_ROLLUP_RETENTION_DAYS: int = 400
+
+    # active health checks of service targets
+    HEALTH_CHECK_TICK: float = 1
+
     class Config:
         env_file = ".env.dev"
 
@@ -24,3 +67,147 @@ async def initiate_database():
     await init_beanie(
         database=client.get_default_database(), document_models=models.__all__
     )
+
+
+async def start_http_client():
+    settings = Settings()
+    await Http.start(
+        limit=settings.HTTP_POOL_SIZE,
+        limit_per_host=settings.HTTP_POOL_SIZE_PER_HOST,
+        dns_cache_ttl=settings.HTTP_DNS_CACHE_TTL,
+        keepalive_timeout=settings.HTTP_KEEPALIVE_TIMEOUT,
+        timeout=settings.HTTP_TIMEOUT,
+    )
+
+
+async def stop_http_client():
+    await Http.close()
+
+
+async def start_background_queue():
+    settings = Settings()
+    Background.start(
+        size=settings.BACKGROUND_QUEUE_SIZE,
+        workers=settings.BACKGROUND_QUEUE_WORKERS,
+        put_timeout=settings.BACKGROUND_QUEUE_PUT_TIMEOUT,
+    )
+
+
+async def stop_background_queue():
+    """
+    runs what is left in the queue while the databases are still open
+    """
+    await Background.stop(Settings().BACKGROUND_QUEUE_DRAIN_TIMEOUT)
+
+
+async def start_insights_writer(app):
+    settings = Settings()
+    await Insights.create_collection(app.state.mongo, settings.INSIGHTS_STORAGE, settings.INSIGHTS_RETENTION_DAYS)
+    await InsightsRollup.create_indexes(app.state.mongo[insights_rollup_collection],
+                                        settings.INSIGHTS_ROLLUP_RETENTION_DAYS)
+    InsightsWriter.start(
+        app.state.mongo[insights_collection],
+        app.state.mongo[insights_rollup_collection],
+        batch_size=settings.INSIGHTS_BATCH_SIZE,
+        flush_interval=settings.INSIGHTS_FLUSH_INTERVAL,
+        buffer_size=settings.INSIGHTS_BUFFER_SIZE,
+        storage=settings.INSIGHTS_STORAGE,
+        retention=settings.INSIGHTS_RETENTION_DAYS,
+    )
+
+
+async def stop_insights_writer(app):
+    await InsightsWriter.stop()
+
+
+async def start_health_checks(app):
+    """
+    starts the active health checks of services with a health_check_path
+    """
+    TargetHealth.start(app.state.mongo['service'], Settings().HEALTH_CHECK_TICK)
+
+
+async def stop_health_checks(app):
+    await TargetHealth.stop()
+
+
+async def open_database(app):
+    """
+    creates the pooled mongo and redis clients of a worker
+    """
+    settings = Settings()
+    app.state.mongo_client = AsyncIOMotorClient(
+        settings.DATABASE_URL,
+        maxPoolSize=settings.MONGO_POOL_SIZE,
+        minPoolSize=settings.MONGO_MIN_POOL_SIZE,
+        serverSelectionTimeoutMS=settings.MONGO_TIMEOUT_MS,
+    )
+    app.state.mongo = app.state.mongo_client.get_default_database(settings.DATABASE_NAME)
+    app.state.redis = aioredis.from_url(
+        settings.REDIS_URL or REDIS,
+        max_connections=settings.REDIS_POOL_SIZE,
+        socket_timeout=settings.REDIS_TIMEOUT,
+        socket_connect_timeout=settings.REDIS_TIMEOUT,
+        health_check_interval=30,
+        decode_responses=True,
+    )
+    # endpoint cache entries are binary and are read without decoding
+    app.state.redis_bytes = aioredis.from_url(
+        settings.REDIS_URL or REDIS,
+        max_connections=settings.REDIS_BYTES_POOL_SIZE,
+        socket_timeout=settings.REDIS_TIMEOUT,
+        socket_connect_timeout=settings.REDIS_TIMEOUT,
+        health_check_interval=30,
+    )
+    health = await check_database(app)
+    if not all(health.values()):
+        raise Exception({
+            'message': f'Unable to connect to {", ".join(key for key, up in health.items() if not up)}',
+            'status_code': 503
+        })
+
+
+async def check_database(app) -> dict:
+    """
+    pings mongo and redis
+
+    @returns: reachability of each database
+    """
+    health = {}
+    try:
+        await app.state.mongo.command('ping')
+        health['mongo'] = True
+    except Exception:
+        health['mongo'] = False
+    try:
+        health['redis'] = bool(await app.state.redis.ping())
+    except Exception:
+        health['redis'] = False
+    return health
+
+
+async def close_database(app):
+    """
+    closes the pooled clients once the server stopped handing out requests
+    """
+    for name in ['redis', 'redis_bytes']:
+        redis = getattr(app.state, name, None)
+        if redis is not None:
+            await redis.close()
+    mongo_client = getattr(app.state, 'mongo_client', None)
+    if mongo_client is not None:
+        mongo_client.close()
+
+
+async def start_cache_listener(app):
+    """
+    starts dropping local endpoint cache copies invalidated by other workers
+    """
+    app.state.cache_listener = asyncio.ensure_future(EndpointCacher.listen_invalidations(app.state.redis))
+
+
+async def stop_cache_listener(app):
+    listener = getattr(app.state, 'cache_listener', None)
+    if listener is not None:
+        listener.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
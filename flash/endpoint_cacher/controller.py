@@ -7,6 +7,9 @@ from flash.common.error_code import ERROR_SERVER, ERROR_PARAMETER_ERROR
 from flash.common.resp import resp_error_json, resp_success_json
 from flash.endpoint_cacher.schema import endpoint_cache_validator
 from flash.models.endpoint_cacher import EndpointCacher
+from flash.models.service import Service
+from flash.proxy.policy import Policy
+from flash.proxy.warmup import Warmup
 from flash.util import DB, Bson
 from flash.util.validate import Validate
 from flash.service import controller as service_controller
@@ -36,6 +39,16 @@ async def get_handler(request: Request):
         return resp_error_json(ERROR_SERVER, msg=str(err))
 
 
+@router.get('/endpoint_cache/stats')
+async def get_handler_stats(request: Request):
+    try:
+        _id = request.query_params.get('id')
+        Validate.validate_object_id(_id)
+        return resp_success_json(data=await EndpointCacher.get_stats(_id, DB.get_redis(request)))
+    except Exception as err:
+        return resp_error_json(ERROR_SERVER, msg=str(err))
+
+
 @router.patch('/endpoint_cache')
 async def patch_handler(request: Request):
     try:
@@ -44,6 +57,7 @@ async def patch_handler(request: Request):
         Validate.validate_schema(ctx, endpoint_cache_validator)
         Validate.validate_object_id(_id)
         await EndpointCacher.update(_id, pydash.omit(ctx, 'service_id', 'response_codes'), DB.get_redis(request))
+        Policy.invalidate()
 
         return resp_success_json(msg='Endpoint cache updated')
     except Exception as err:
@@ -64,6 +78,7 @@ async def patch_handler_response_codes(request: Request):
             await EndpointCacher.remove_status_codes(ctx['response_codes'], _id, DB.get_redis(request))
         else:
             return resp_error_json(ERROR_PARAMETER_ERROR, msg='Invalid action provided')
+        Policy.invalidate()
         return resp_success_json(msg='Endpoint cache response codes updated')
     except Exception as err:
         return resp_error_json(ERROR_SERVER, msg=str(err))
@@ -75,17 +90,61 @@ async def delete_handler(request: Request):
         _id = request.query_params.get('id')
         Validate.validate_object_id(_id)
         await EndpointCacher.delete(_id, DB.get_redis(request))
+        Policy.invalidate()
         return resp_success_json(msg='Endpoint cache deleted')
     except Exception as err:
         return resp_error_json(ERROR_SERVER, msg=str(err))
 
 
+@router.delete('/endpoint_cache/entries')
+async def delete_handler_entries(request: Request):
+    try:
+        if 'tag' in request.query_params:
+            purged = await EndpointCacher.purge_tag(request.query_params.get('tag'), DB.get_redis(request))
+        elif 'service_id' in request.query_params:
+            service_id = request.query_params.get('service_id')
+            Validate.validate_object_id(service_id)
+            purged = await EndpointCacher.purge_tag(f'service:{service_id}', DB.get_redis(request))
+        elif 'id' in request.query_params:
+            _id = request.query_params.get('id')
+            Validate.validate_object_id(_id)
+            purged = await EndpointCacher.purge_tag(f'cacher:{_id}', DB.get_redis(request))
+        elif 'path' in request.query_params:
+            purged = await EndpointCacher.purge_tag(f"path:{request.query_params.get('path')}", DB.get_redis(request))
+        elif 'pattern' in request.query_params:
+            purged = await EndpointCacher.purge_pattern(request.query_params.get('pattern'), DB.get_redis(request))
+        else:
+            return resp_error_json(ERROR_PARAMETER_ERROR, msg='No tag, service_id, id, path or pattern provided')
+        return resp_success_json(data={'purged': purged}, msg='Endpoint cache entries purged')
+    except Exception as err:
+        return resp_error_json(ERROR_SERVER, msg=str(err))
+
+
+@router.post('/endpoint_cache/warmup')
+async def post_handler_warmup(request: Request):
+    try:
+        _id = request.query_params.get('id')
+        Validate.validate_object_id(_id)
+        endpoint_cacher = await EndpointCacher.get_by_id(_id, DB.get_redis(request))
+        if pydash.is_empty(endpoint_cacher) or pydash.is_empty(endpoint_cacher.get('service_id')):
+            return resp_error_json(ERROR_PARAMETER_ERROR, msg=f'Endpoint cache {_id} has no service')
+        service = await Service.get_by_id(endpoint_cacher['service_id'], DB.get(request, service_controller.table))
+        if pydash.is_empty(service):
+            return resp_error_json(ERROR_PARAMETER_ERROR, msg=f"Service {endpoint_cacher['service_id']} not found")
+        limit = request.query_params.get('limit')
+        stats = await Warmup.run(endpoint_cacher, service, DB.get_redis(request), int(limit) if limit else None)
+        return resp_success_json(data=stats, msg='Endpoint cache warmed up')
+    except Exception as err:
+        return resp_error_json(ERROR_SERVER, msg=str(err))
+
+
 @router.post('/endpoint_cache')
 async def post_handler(request: Request):
     try:
         ctx = json.loads(await request.json())
         Validate.validate_schema(ctx, endpoint_cache_validator)
         await EndpointCacher.create(ctx, DB.get_redis(request), DB.get(request, service_controller.table))
+        Policy.invalidate(ctx.get('service_id'))
         return resp_success_json(msg='Endpoint cache created')
     except Exception as err:
         return resp_error_json(ERROR_SERVER, msg=str(err))
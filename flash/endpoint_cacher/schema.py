@@ -16,6 +16,26 @@ endpoint_cache_schema = {
     },
     'response_codes': {
         'type': 'list'
+    },
+    'stale_while_revalidate': {
+        'type': 'integer',
+        'min': 0
+    },
+    'stale_if_error': {
+        'type': 'integer',
+        'min': 0
+    },
+    'key_headers': {
+        'type': 'list',
+        'schema': {'type': 'string'}
+    },
+    'key_query': {
+        'type': 'list',
+        'schema': {'type': 'string'}
+    },
+    'fill_lock': {
+        'type': 'integer',
+        'min': 0
     }
 }
 
@@ -2,16 +2,21 @@ import json
 import pydash
 from fastapi import APIRouter
 from fastapi import Request
+from fastapi.responses import StreamingResponse
 from .schema import insights_validator
-from ..common.error_code import ERROR_SERVER
+from ..common.error_code import ERROR_SERVER, ERROR_PARAMETER_ERROR
 from ..common.resp import resp_error_json, resp_success_json
-from ..models.insights import Insights
-from ..util import DB, Bson
+from ..models.insights import Insights, filter_fields
+from ..models.insights_rollup import InsightsRollup, steps
+from ..models.insights_rollup import collection_name as rollup_table
+from ..proxy.insights_writer import InsightsWriter
+from ..util import DB
 from ..util.validate import Validate
 from flash.service import controller as service_controller
 
 router = APIRouter()
 table = 'insights'
+max_page_size = 1000
 
 
 @router.post('/insights')
@@ -25,33 +30,72 @@ async def post_handler(request: Request):
         return resp_error_json(ERROR_SERVER, msg=str(err))
 
 
+@router.get('/insights/writer')
+async def get_handler_writer(request: Request):
+    try:
+        return resp_success_json(data=InsightsWriter.stats())
+    except Exception as err:
+        return resp_error_json(ERROR_SERVER, msg=str(err))
+
+
+@router.get('/insights/rollups')
+async def get_handler_rollups(request: Request):
+    try:
+        service_id = request.query_params.get('service_id')
+        Validate.validate_object_id(service_id)
+        step = request.query_params.get('step') or 'minute'
+        if step not in steps and step != 'total':
+            return resp_error_json(ERROR_PARAMETER_ERROR, msg=f'Invalid step {step}')
+        start, end = InsightsRollup.default_range()
+        start = InsightsRollup.parse_time(request.query_params.get('from'), start)
+        end = InsightsRollup.parse_time(request.query_params.get('to'), end)
+        rollups = await InsightsRollup.query(service_id, start, end, DB.get(request, rollup_table),
+                                             request.query_params.get('route'), step)
+        return resp_success_json(data=rollups)
+    except Exception as err:
+        return resp_error_json(ERROR_SERVER, msg=str(err))
+
+
+def get_filters(request: Request) -> dict:
+    filters = {field: request.query_params.get(field) for field in filter_fields}
+    if filters['status_code'] is not None:
+        filters['status_code'] = int(filters['status_code'])
+    if filters['cache'] is not None:
+        filters['cache'] = filters['cache'].lower() == 'true'
+    return filters
+
+
+def get_time_range(request: Request) -> tuple:
+    return (InsightsRollup.parse_time(request.query_params.get('from'), None),
+            InsightsRollup.parse_time(request.query_params.get('to'), None))
+
+
 @router.get('/insights')
 async def get_handler(request: Request):
     try:
-        if len(request.keys()) == 0:
-            insights = await Insights.get_all(DB.get(request, table))
-        else:
-            insights = []
-            if 'id' in request.query_params:
-                insight = await Insights.get_by_id(request.query_params.get('id'), DB.get(request, table))
-                if insight is not None:
-                    insights.append(insight)
-            elif 'remote_ip' in request.query_params:
-                insights = await Insights.get_by_remote_ip(request.query_params.get('remote_ip'),
-                                                           DB.get(request, table))
-            elif 'status_code' in request.query_params:
-                insights = await Insights.get_by_status_code(request.query_params.get('status_code', 0),
-                                                             DB.get(request, table))
-            elif 'path' in request.query_params:
-                insights = await Insights.get_by_path(request.query_params.get('path'), DB.get(request, table))
-            elif 'method' in request.query_params:
-                insights = await Insights.get_by_method(request.query_params.get('method'), DB.get(request, table))
-            elif 'service_id' in request.query_params:
-                insights = await Insights.get_by_service_id(request.query_params.get('service_id'),
-                                                            DB.get(request, table))
-            elif 'scheme' in request.query_params:
-                insights = await Insights.get_by_scheme(request.query_params.get('scheme'), DB.get(request, table))
-        return resp_success_json(msg='service created', data=DB.format_documents(Bson.to_json(insights)))
+        if 'id' in request.query_params:
+            _id = request.query_params.get('id')
+            Validate.validate_object_id(_id)
+            insight = await Insights.get_by_id(_id, DB.get(request, table))
+            return resp_success_json(data={
+                'items': [Insights.serialize(insight)] if insight is not None else [],
+                'cursor': None
+            })
+        start, end = get_time_range(request)
+        limit = min(int(request.query_params.get('limit') or 100), max_page_size)
+        items, cursor = await Insights.query(get_filters(request), DB.get(request, table), start, end,
+                                             request.query_params.get('cursor'), limit)
+        return resp_success_json(data={'items': items, 'cursor': cursor})
+    except Exception as err:
+        return resp_error_json(ERROR_SERVER, msg=str(err))
+
+
+@router.get('/insights/export')
+async def get_handler_export(request: Request):
+    try:
+        start, end = get_time_range(request)
+        lines = Insights.export(get_filters(request), DB.get(request, table), start, end)
+        return StreamingResponse(lines, media_type='application/x-ndjson')
     except Exception as err:
         return resp_error_json(ERROR_SERVER, msg=str(err))
 
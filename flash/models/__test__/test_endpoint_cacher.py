@@ -0,0 +1,151 @@
+import asyncio
+import time
+
+import pytest
+
+from flash.models import endpoint_cacher
+from flash.models.endpoint_cacher import EndpointCacher
+
+fakeredis = pytest.importorskip('fakeredis.aioredis')
+
+
+def response(body: bytes) -> dict:
+    return {
+        'status': 200,
+        'content_type': 'application/json',
+        'headers': [['Content-Type', 'application/json'], ['Set-Cookie', 'session=1'], ['ETag', '"v1"']],
+        'body': body,
+        'expires_at': 1700000000.5,
+    }
+
+
+@pytest.mark.parametrize('body', [b'', b'{"ok":true}', b'a' * 10000])
+def test_entry_round_trip(body):
+    entry = EndpointCacher.decode_entry(EndpointCacher.encode_entry(response(body)))
+    assert entry['status'] == 200
+    assert entry['content_type'] == 'application/json'
+    assert entry['body'] == body
+    assert entry['expires_at'] == 1700000000.5
+    # headers of one particular response are not stored
+    assert entry['headers'] == [['Content-Type', 'application/json'], ['ETag', '"v1"']]
+
+
+def test_large_bodies_are_compressed():
+    raw = EndpointCacher.encode_entry(response(b'a' * 10000))
+    assert len(raw) < 1000
+    assert raw[3] & endpoint_cacher.entry_gzip
+
+
+def test_unknown_entry_version_is_refused():
+    raw = bytearray(EndpointCacher.encode_entry(response(b'x')))
+    raw[2] = 99
+    with pytest.raises(Exception):
+        EndpointCacher.decode_entry(bytes(raw))
+
+
+def test_purge_tag_drops_entries_and_prunes_expired_members():
+    async def run():
+        db = fakeredis.FakeRedis()
+        EndpointCacher.invalidate_local()
+        await EndpointCacher.write('endpoint_cache:c:short', response(b'x'), 1, db, 0, ['service:s'])
+        await EndpointCacher.write('endpoint_cache:c:long', response(b'x'), 100, db, 0, ['service:s'])
+        await asyncio.sleep(1.1)
+        await EndpointCacher.write('endpoint_cache:c:other', response(b'x'), 100, db, 0, ['service:s'])
+        members = await db.zrange(EndpointCacher.tag_key('service:s'), 0, -1)
+        purged = await EndpointCacher.purge_tag('service:s', db)
+        return members, purged, await db.exists('endpoint_cache:c:long', 'endpoint_cache:c:other')
+
+    members, purged, left = asyncio.run(run())
+    assert sorted(members) == [b'endpoint_cache:c:long', b'endpoint_cache:c:other']
+    assert purged == 2
+    assert left == 0
+
+
+def test_purge_pattern_drops_matching_entries_and_local_copies(monkeypatch):
+    monkeypatch.setattr(endpoint_cacher, 'ENDPOINT_CACHE_PURGE_BATCH', 1)
+
+    async def run():
+        db = fakeredis.FakeRedis()
+        EndpointCacher.invalidate_local()
+        for key in ['endpoint_cache:c1:a', 'endpoint_cache:c1:b', 'endpoint_cache:c2:a']:
+            await EndpointCacher.write(key, response(b'x'), 100, db)
+        purged = await EndpointCacher.purge_pattern('c1:*', db)
+        return purged, await EndpointCacher.read('endpoint_cache:c1:a', db), \
+            await EndpointCacher.read('endpoint_cache:c2:a', db)
+
+    purged, dropped, kept = asyncio.run(run())
+    assert purged == 2
+    assert dropped is None
+    assert kept is not None
+
+
+def test_tags_of_a_response():
+    tags = EndpointCacher.tags({'_id': 'c1', 'service_id': 's1'}, '/items',
+                               [('Content-Type', 'text/plain'), ('Surrogate-Key', 'items item-1')])
+    assert tags == ['service:s1', 'cacher:c1', 'path:/items', 'key:items', 'key:item-1']
+
+
+def test_read_serves_the_local_copy_written_by_this_worker():
+    async def run():
+        db = fakeredis.FakeRedis()
+        EndpointCacher.invalidate_local()
+        await EndpointCacher.write('endpoint_cache:c:local', response(b'x'), 100, db)
+        await db.delete('endpoint_cache:c:local')
+        return await EndpointCacher.read('endpoint_cache:c:local', db)
+
+    entry = asyncio.run(run())
+    assert entry is not None and entry['body'] == b'x'
+    assert entry['expires_at'] > time.time()
+
+
+def test_count_flushes_are_referenced_until_done(monkeypatch):
+    monkeypatch.setattr(endpoint_cacher, 'ENDPOINT_CACHE_STATS_SYNC', 0)
+    monkeypatch.setattr(EndpointCacher, '_counts', {})
+
+    async def run():
+        db = fakeredis.FakeRedis(decode_responses=True)
+        EndpointCacher.count('c1', 'hit', db)
+        flushes = set(endpoint_cacher.endpoint_cache_flushes)
+        await asyncio.gather(*flushes)
+        return flushes, await EndpointCacher.get_stats('c1', db)
+
+    flushes, stats = asyncio.run(run())
+    assert len(flushes) == 1
+    assert not endpoint_cacher.endpoint_cache_flushes
+    assert stats['hit'] == 1
+
+
+def test_other_workers_invalidations_drop_the_local_copy():
+    async def run():
+        db = fakeredis.FakeRedis()
+        EndpointCacher.invalidate_local()
+        listener = asyncio.ensure_future(EndpointCacher.listen_invalidations(db))
+        await asyncio.sleep(0.1)
+        await EndpointCacher.write('endpoint_cache:c:own', response(b'x'), 100, db)
+        await EndpointCacher.write('endpoint_cache:c:other', response(b'x'), 100, db)
+        await db.publish(endpoint_cacher.endpoint_cache_invalidate_channel, 'other-worker|endpoint_cache:c:other')
+        await asyncio.sleep(0.1)
+        listener.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
+        return EndpointCacher._local.get('endpoint_cache:c:own'), EndpointCacher._local.get('endpoint_cache:c:other')
+
+    own, other = asyncio.run(run())
+    # the message published by write itself is skipped
+    assert own is not None
+    assert other is None
+
+
+def test_stats_have_the_hit_ratio(monkeypatch):
+    monkeypatch.setattr(EndpointCacher, '_counts', {})
+
+    async def run():
+        db = fakeredis.FakeRedis(decode_responses=True)
+        for field in ['hit', 'hit', 'stale', 'miss', 'bypass']:
+            EndpointCacher.count('c1', field, db)
+        await EndpointCacher.flush_counts(db)
+        return await EndpointCacher.get_stats('c1', db)
+
+    stats = asyncio.run(run())
+    assert (stats['hit'], stats['stale'], stats['miss'], stats['bypass']) == (2, 1, 1, 1)
+    # bypassed requests never looked the cache up
+    assert stats['hit_ratio'] == 0.75
@@ -0,0 +1,187 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+import bson
+import pytest
+
+from flash.models.insights import Insights, fields
+from flash.proxy.insights_writer import InsightsWriter
+
+
+def matches(document: dict, query: dict) -> bool:
+    # the mongo operators insight queries use
+    for field, condition in query.items():
+        if field == '$and':
+            if not all(matches(document, part) for part in condition):
+                return False
+        elif field == '$or':
+            if not any(matches(document, part) for part in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = document.get(field)
+            if '$lt' in condition and not value < condition['$lt']:
+                return False
+            if '$gte' in condition and not value >= condition['$gte']:
+                return False
+        elif document.get(field) != condition:
+            return False
+    return True
+
+
+class Cursor:
+    def __init__(self, documents: list):
+        self.documents = documents
+
+    def sort(self, keys: list):
+        for field, direction in reversed(keys):
+            self.documents.sort(key=lambda document: document[field], reverse=direction < 0)
+        return self
+
+    def limit(self, length: int):
+        self.documents = self.documents[:length]
+        return self
+
+    def batch_size(self, size: int):
+        return self
+
+    async def to_list(self, length: int):
+        return self.documents[:length]
+
+    async def __aiter__(self):
+        for document in self.documents:
+            yield document
+
+
+class Collection:
+    def __init__(self, documents: list):
+        self.documents = documents
+
+    def find(self, query: dict):
+        return Cursor([document for document in self.documents if matches(document, query)])
+
+
+start = datetime(2024, 1, 1)
+
+
+def stored(minutes: int, status_code: int = 200) -> dict:
+    return Insights.compact({
+        '_id': bson.ObjectId(),
+        'service_id': 's1',
+        'path': '/users/1',
+        'status_code': status_code,
+        'created_at': start + timedelta(minutes=minutes // 2),
+    })
+
+
+def test_build_query_uses_stored_field_names():
+    query = Insights.build_query({'service_id': 's1', 'status_code': 500, 'route': '/ignored'}, start)
+    assert query == {fields['service_id']: 's1', fields['status_code']: 500, fields['created_at']: {'$gte': start}}
+
+
+def test_cursor_round_trip():
+    document = stored(0)
+    query = Insights.decode_cursor(Insights.encode_cursor(document))
+    assert query['$or'][1] == {fields['created_at']: document[fields['created_at']],
+                                '_id': {'$lt': document['_id']}}
+
+
+def test_invalid_cursor_is_a_bad_request():
+    with pytest.raises(Exception) as err:
+        Insights.decode_cursor('not a cursor')
+    assert err.value.args[0]['status_code'] == 400
+
+
+def test_pages_cover_every_insight_once_newest_first():
+    # two insights share every created_at, so pages are told apart by _id too
+    documents = [stored(minutes) for minutes in range(7)]
+    db = Collection(documents)
+
+    async def run():
+        pages, cursor = [], None
+        while True:
+            page, cursor = await Insights.query({'service_id': 's1'}, db, cursor=cursor, limit=3)
+            pages.append(page)
+            if cursor is None:
+                return pages
+
+    pages = asyncio.run(run())
+    assert [len(page) for page in pages] == [3, 3, 1]
+    ids = [insight['_id'] for page in pages for insight in page]
+    assert sorted(ids) == sorted(str(document['_id']) for document in documents)
+    times = [insight['created_at'] for page in pages for insight in page]
+    assert times == sorted(times, reverse=True)
+
+
+def test_export_streams_ndjson_lines():
+    db = Collection([stored(minutes, 500 if minutes % 2 else 200) for minutes in range(5)])
+
+    async def run():
+        return [chunk async for chunk in Insights.export({'status_code': 500}, db, batch_size=1)]
+
+    chunks = asyncio.run(run())
+    assert len(chunks) == 2
+    assert all(json.loads(chunk)['status_code'] == 500 for chunk in chunks)
+
+
+def test_compact_and_expand_are_inverse():
+    ctx = {'service_id': 's1', 'status_code': 200, 'elapsed_time': 10, 'created_at': start, 'extra': 1}
+    document = Insights.compact(ctx)
+    assert document == {'s': 's1', 'st': 200, 't': 10, 'ts': start, 'extra': 1}
+    assert Insights.expand(document) == ctx
+
+
+def test_ttl_storage_expires_insights_after_the_service_retention(monkeypatch):
+    monkeypatch.setattr(InsightsWriter, '_buffer', [])
+    monkeypatch.setattr(InsightsWriter, '_rollups', {})
+    monkeypatch.setattr(InsightsWriter, '_options', dict(InsightsWriter._options, storage='ttl', retention=30))
+    ctx = {'service_id': 's1', 'status_code': 200, 'elapsed_time': 10, 'created_at': start}
+    InsightsWriter.record(dict(ctx), 7)
+    InsightsWriter.record(dict(ctx))
+    assert [document[fields['expire_at']] for document in InsightsWriter._buffer] == [
+        start + timedelta(days=7), start + timedelta(days=30)]
+
+
+class Database(dict):
+    def __init__(self):
+        super().__init__()
+        self.created = []
+
+    def __missing__(self, name: str):
+        collection = self[name] = IndexedCollection()
+        return collection
+
+    async def list_collection_names(self):
+        return [name for name, _ in self.created]
+
+    async def create_collection(self, name: str, **options):
+        self.created.append((name, options))
+
+
+class IndexedCollection:
+    def __init__(self):
+        self.indexes = []
+
+    async def create_index(self, keys, **options):
+        self.indexes.append((keys, options))
+
+
+def test_storage_modes_create_their_collection():
+    async def run(storage: str):
+        db = Database()
+        await Insights.create_collection(db, storage, 30)
+        return db
+
+    ttl = asyncio.run(run('ttl'))
+    assert (fields['expire_at'], {'expireAfterSeconds': 0}) in ttl['insights'].indexes
+    timeseries = asyncio.run(run('timeseries'))
+    (name, options), = timeseries.created
+    assert options['timeseries']['timeField'] == fields['created_at']
+    assert options['expireAfterSeconds'] == 30 * 86400
+    assert not asyncio.run(run('plain')).created
+
+
+def test_unknown_storage_is_refused():
+    with pytest.raises(Exception) as err:
+        asyncio.run(Insights.create_collection(Database(), 'capped', 30))
+    assert err.value.args[0]['status_code'] == 500
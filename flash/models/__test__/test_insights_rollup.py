@@ -0,0 +1,125 @@
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from flash.models.insights_rollup import InsightsRollup, latency_accuracy
+
+
+class Cursor:
+    def __init__(self, documents: list):
+        self.documents = documents
+
+    async def __aiter__(self):
+        for document in self.documents:
+            yield document
+
+
+class Collection:
+    """
+    mongo collection applying the $setOnInsert and $inc upserts of a bulk write
+    """
+
+    def __init__(self):
+        self.documents = {}
+
+    async def bulk_write(self, operations: list, ordered: bool = True):
+        for operation in operations:
+            _id = operation._filter['_id']
+            document = self.documents.get(_id)
+            if document is None:
+                document = self.documents[_id] = dict(operation._doc['$setOnInsert'], _id=_id)
+            for field, value in operation._doc['$inc'].items():
+                parent = document
+                *path, name = field.split('.')
+                for part in path:
+                    parent = parent.setdefault(part, {})
+                parent[name] = parent.get(name, 0) + value
+
+    def find(self, query: dict):
+        def matches(document):
+            minute = query['minute']
+            return document['service_id'] == query['service_id'] and \
+                minute['$gte'] <= document['minute'] < minute['$lt'] and \
+                query.get('route', document['route']) == document['route']
+
+        return Cursor([document for document in self.documents.values() if matches(document)])
+
+
+minute = datetime(2024, 1, 1, 12, 0)
+
+
+def insight(elapsed_time: int, status_code: int = 200, cache: bool = False, seconds: int = 0,
+            route: str = '/users') -> dict:
+    return {
+        'service_id': 's1',
+        'route': route,
+        'status_code': status_code,
+        'elapsed_time': elapsed_time,
+        'cache': cache,
+        'created_at': minute + timedelta(seconds=seconds),
+    }
+
+
+@pytest.mark.parametrize('latency', [2, 150, 12345, 9876543])
+def test_bucket_value_is_within_the_accuracy(latency):
+    value = InsightsRollup.bucket_value(InsightsRollup.bucket(latency))
+    assert abs(value - latency) / latency <= latency_accuracy
+
+
+def test_quantiles_of_a_histogram():
+    latencies = list(range(1, 10001))
+    random.Random(1).shuffle(latencies)
+    rollup = {}
+    for latency in latencies:
+        InsightsRollup.add(rollup, insight(latency))
+    for quantile in [0.5, 0.95, 0.99]:
+        expected = quantile * 10000
+        assert abs(InsightsRollup.quantile(rollup['latency'], quantile) - expected) / expected <= 0.03
+    assert InsightsRollup.quantile({}, 0.5) is None
+
+
+def test_merged_rollups_equal_one_rollup_of_every_insight():
+    insights = [insight(100, 200, True), insight(2000, 503), insight(300, 200), insight(40000, 500, True)]
+    whole, first, second = {}, {}, {}
+    for ctx in insights:
+        InsightsRollup.add(whole, ctx)
+    for ctx in insights[:2]:
+        InsightsRollup.add(first, ctx)
+    for ctx in insights[2:]:
+        InsightsRollup.add(second, ctx)
+    assert InsightsRollup.merge(first, second) == whole
+    assert (whole['count'], whole['cache_hits'], whole['errors']) == (4, 2, 2)
+
+
+def test_key_groups_by_minute_and_status_class():
+    assert InsightsRollup.key(insight(1, 404, seconds=59)) == ('s1', '/users', '4xx', minute)
+    assert InsightsRollup.key(insight(1, 200, seconds=60))[3] == minute + timedelta(minutes=1)
+
+
+def test_upserts_add_up_and_query_merges_steps():
+    db = Collection()
+
+    def rollups(ctxs: list) -> dict:
+        grouped = {}
+        for ctx in ctxs:
+            InsightsRollup.add(grouped.setdefault(InsightsRollup.key(ctx), {}), ctx)
+        return grouped
+
+    async def run():
+        # two workers flushing the same minute
+        await InsightsRollup.upsert_many(rollups([insight(100), insight(300, 500)]), db)
+        await InsightsRollup.upsert_many(rollups([insight(200), insight(400, seconds=90)]), db)
+        end = minute + timedelta(hours=1)
+        return await InsightsRollup.query('s1', minute, end, db), \
+            await InsightsRollup.query('s1', minute, end, db, step='hour')
+
+    by_minute, by_hour = asyncio.run(run())
+    assert [(group['time'], group['status'], group['count']) for group in by_minute] == [
+        (minute.isoformat(), '2xx', 2),
+        (minute.isoformat(), '5xx', 1),
+        ((minute + timedelta(minutes=1)).isoformat(), '2xx', 1),
+    ]
+    assert by_minute[0]['latency_avg'] == 150
+    assert [(group['status'], group['count'], group['errors']) for group in by_hour] == [('2xx', 3, 0), ('5xx', 1, 1)]
@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+from flash.models.rate_limiter import RateLimiter
+
+fakeredis = pytest.importorskip('fakeredis.aioredis')
+
+
+def test_entries_are_found_by_rule_and_host_until_they_expire():
+    async def run():
+        db = fakeredis.FakeRedis(decode_responses=True)
+        ctx = {'rule_id': 'r1', 'host': '10.0.0.1', 'count': 0, 'timeout': 60}
+        await RateLimiter.create_entry(ctx, db)
+        found = await RateLimiter.get_entry_by_rule_id_and_host('r1', '10.0.0.1', db)
+        by_rule = await RateLimiter.get_entry_by_rule_id('r1', db)
+        by_host = await RateLimiter.get_entry_by_host('10.0.0.1', db)
+        return ctx['_id'], found, by_rule, by_host
+
+    _id, found, by_rule, by_host = asyncio.run(run())
+    assert found['_id'] == _id
+    assert [entry['_id'] for entry in by_rule] == [_id]
+    assert [entry['_id'] for entry in by_host] == [_id]
+
+
+def test_rule_host_index_expires_with_its_entry():
+    async def run():
+        db = fakeredis.FakeRedis(decode_responses=True)
+        ctx = {'rule_id': 'r1', 'host': '10.0.0.1', 'count': 0, 'timeout': 60}
+        await RateLimiter.create_entry(ctx, db)
+        created = await db.ttl('entry_rule_host_index:r1:10.0.0.1')
+        # moving the entry to another host points the new key at it with the same ttl
+        await RateLimiter.update_entry(ctx['_id'], {'host': '10.0.0.2'}, db)
+        return created, await db.ttl('entry_rule_host_index:r1:10.0.0.2'), \
+            await db.exists('entry_rule_host_index:r1:10.0.0.1')
+
+    created, updated, old = asyncio.run(run())
+    assert 0 < created <= 60
+    assert 0 < updated <= 60
+    assert not old
+
+
+def test_deleted_entries_leave_no_index():
+    async def run():
+        db = fakeredis.FakeRedis(decode_responses=True)
+        ctx = {'rule_id': 'r1', 'host': '10.0.0.1', 'count': 0, 'timeout': 60}
+        await RateLimiter.create_entry(ctx, db)
+        await RateLimiter.delete_entry(ctx['_id'], db)
+        return await RateLimiter.get_entry_by_rule_id_and_host('r1', '10.0.0.1', db), \
+            await RateLimiter.get_entry_by_rule_id('r1', db)
+
+    assert asyncio.run(run()) == ({}, [])
+
+
+def test_rules_move_between_service_indexes():
+    async def run():
+        db = fakeredis.FakeRedis(decode_responses=True)
+        ctx = {'service_id': 's1', 'status_code': 429, 'max_requests': 5, 'timeout': 60}
+        await RateLimiter.create_rule(ctx, db)
+        await RateLimiter.update_rule(ctx['_id'], {'_id': ctx['_id'], 'service_id': 's2'}, db)
+        return await RateLimiter.get_rule_by_service_id('s1', db), \
+            await RateLimiter.get_rule_by_service_id('s2', db), \
+            await RateLimiter.get_rule_by_status_code(429, db)
+
+    old, new, by_status = asyncio.run(run())
+    assert old == []
+    assert [rule['service_id'] for rule in new] == ['s2']
+    assert len(by_status) == 1
+
+
+def hits(algorithm: str, count: int, max_requests: int = 3, timeout: int = 60) -> list:
+    # the scripts run on the lua runtime of fakeredis
+    pytest.importorskip('lupa')
+
+    async def run():
+        db = fakeredis.FakeRedis(decode_responses=True)
+        rule = {'_id': f'rule-{algorithm}', 'algorithm': algorithm, 'max_requests': max_requests, 'timeout': timeout}
+        return [await RateLimiter.hit(rule, '10.0.0.1', db) for _ in range(count)]
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize('algorithm', ['fixed_window', 'sliding_window_log', 'sliding_window_counter', 'token_bucket'])
+def test_allows_up_to_max_requests(algorithm):
+    results = hits(algorithm, 4)
+    assert [allowed for allowed, _, _ in results] == [True, True, True, False]
+    assert [remaining for _, remaining, _ in results[:3]] == [2, 1, 0]
+    assert results[3][2] > 0
+
+
+def test_retry_after_is_the_time_left_in_the_window():
+    results = hits('fixed_window', 2, max_requests=1, timeout=60)
+    assert 59000 <= results[1][2] <= 60000
+
+
+def test_keys_are_counted_apart():
+    pytest.importorskip('lupa')
+
+    async def run():
+        db = fakeredis.FakeRedis(decode_responses=True)
+        rule = {'_id': 'rule-keys', 'max_requests': 1, 'timeout': 60}
+        return [await RateLimiter.hit(rule, key, db) for key in ['a', 'b', 'a']]
+
+    assert [allowed for allowed, _, _ in asyncio.run(run())] == [True, True, False]
+
+
+def test_counters_expire_with_their_window():
+    pytest.importorskip('lupa')
+
+    async def run():
+        db = fakeredis.FakeRedis(decode_responses=True)
+        rule = {'_id': 'rule-ttl', 'max_requests': 5, 'timeout': 60}
+        await RateLimiter.hit(rule, 'a', db)
+        return await db.ttl(RateLimiter.counter_key('rule-ttl', 'a'))
+
+    assert 0 < asyncio.run(run()) <= 60
+
+
+def test_lease_grants_what_is_left_of_the_window():
+    pytest.importorskip('lupa')
+
+    async def run():
+        db = fakeredis.FakeRedis(decode_responses=True)
+        rule = {'_id': 'rule-lease', 'max_requests': 10, 'timeout': 60}
+        first = await RateLimiter.lease(rule, None, 6, 0, db)
+        second = await RateLimiter.lease(rule, None, 6, 0, db)
+        # giving back 2 unused requests of the first lease
+        third = await RateLimiter.lease(rule, None, 6, 2, db)
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    assert first[0] == 6 and first[1] > 0
+    assert second[0] == 4
+    assert third[0] == 2
@@ -4,6 +4,7 @@ from enum import Enum
 from aioredis import Redis as AioRedis
 from motor.motor_asyncio import AsyncIOMotorCollection
 
+from flash.circuit_breaker.scripts import transition
 from flash.models.service import Service
 
 
@@ -13,6 +14,8 @@ class CircuitBreakerStatus(Enum):
 
 
 class CircuitBreaker:
+    _script = None
+
     @staticmethod
     async def create(ctx: object, circuit_breaker_db: AsyncIOMotorCollection, service_db: AsyncIOMotorCollection):
         """
@@ -204,3 +207,30 @@ class CircuitBreaker:
         @param db: redis instance
         """
         return await db.get(CircuitBreaker.queued_key(_id))
+
+    @staticmethod
+    def state_key(_id):
+        """
+        returns shared state key
+        """
+        return f'{_id}.state'
+
+    @staticmethod
+    async def transition(breaker: object, action: str, db: AioRedis) -> tuple:
+        """
+        atomically applies an action to the shared state of a circuit breaker
+
+        @param breaker: (dict) circuit breaker
+        @param action: (str) sync, trip, probe, success, failure or release
+        @param db: redis instance
+        @returns: (state, ms left of the cooldown or probe deadline, if the action changed the state)
+        """
+        if CircuitBreaker._script is None:
+            CircuitBreaker._script = db.register_script(transition)
+        state, remaining, changed = await CircuitBreaker._script(
+            keys=[CircuitBreaker.state_key(str(breaker['_id']))],
+            args=[action, int(breaker.get('cooldown') or 0) * 1000, int(breaker.get('half_open_probes') or 1)],
+            client=db)
+        if isinstance(state, bytes):
+            state = state.decode('utf-8')
+        return state, int(remaining), bool(changed)
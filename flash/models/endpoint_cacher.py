@@ -1,17 +1,64 @@
 import bson
 import pydash
 import asyncio
+import gzip
 import json
+import os
+import struct
+import time
 from aioredis import Redis as AioRedis
 
 from flash.models.service import Service
 from flash.util import Async, DB
+from flash.util.cache import LRUCache
+from flash.util.env import ENDPOINT_CACHE_L1_SIZE, ENDPOINT_CACHE_L1_BYTES, ENDPOINT_CACHE_L1_TTL, \
+    ENDPOINT_CACHE_STATS_SYNC, ENDPOINT_CACHE_COMPRESSION, ENDPOINT_CACHE_COMPRESS_MIN, ENDPOINT_CACHE_PURGE_BATCH
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 endpoint_cache_set = 'endpoint_cache_set'
 endpoint_cache_service_id_index = 'endpoint_cache_service_id'
+endpoint_cache_invalidate_channel = 'endpoint_cache_invalidate'
+endpoint_cache_stats = 'endpoint_cache_stats'
+# sorted set per tag, members are entry keys scored by the unix time they expire at
+endpoint_cache_tag = 'endpoint_cache_tags'
+endpoint_cache_prefix = 'endpoint_cache:'
+# invalidations are published as `{worker id}|{comma separated hashes}`, a worker skips its own.
+# the pid tells apart workers forked after this module was imported
+endpoint_cache_host_id = str(bson.ObjectId())
+# list fields are kept in the config hash as comma separated strings
+endpoint_cache_list_fields = ['key_headers', 'key_query']
+endpoint_cache_stat_fields = ['hit', 'stale', 'miss', 'bypass', 'uncacheable']
+# counter flushes in flight, referenced until done so they are not garbage collected mid-run
+endpoint_cache_flushes = set()
+
+# binary cache entry: magic, version, flags, status, expires at, content type size, header count
+entry_header = struct.Struct('>2sBBHdHH')
+entry_header_size = struct.Struct('>HH')
+entry_magic = b'FC'
+entry_version = 1
+entry_gzip = 1
+entry_zstd = 2
+# headers describing one particular response, rebuilt when a cached copy is sent
+entry_skip_headers = {'date', 'age', 'set-cookie', 'content-length', 'transfer-encoding'}
 
 
 class EndpointCacher:
+    # in process cache of decoded responses in front of redis
+    _local = LRUCache(ENDPOINT_CACHE_L1_SIZE, ENDPOINT_CACHE_L1_BYTES)
+    _counts = {}
+    _counted_at = 0
+
+    @staticmethod
+    def _join_lists(ctx: dict) -> dict:
+        for field in endpoint_cache_list_fields:
+            if field in ctx:
+                ctx[field] = ','.join(ctx[field])
+        return ctx
+
     @staticmethod
     async def _set_indexes(ctx: object, db: AioRedis):
         """
@@ -23,7 +70,7 @@ class EndpointCacher:
         coroutines = []
         for index in [('service_id', endpoint_cache_service_id_index)]:
             if index[0] in ctx:
-                coroutines.append(db.hset(index[1], ctx['_id'], ctx[index[0]]))
+                coroutines.append(DB.set_index(ctx['_id'], ctx[index[0]], index[1], db))
         await Async.all(coroutines)
 
     @staticmethod
@@ -36,7 +83,7 @@ class EndpointCacher:
         """
         coroutines = []
         for index in [endpoint_cache_service_id_index]:
-            coroutines.append(db.hdel(index, _id))
+            coroutines.append(DB.clear_index(_id, index, db))
         await Async.all(coroutines)
 
     @staticmethod
@@ -48,14 +95,17 @@ class EndpointCacher:
         @param serach: (str) serach value
         @param db: redis instance
         """
-        keys = []
-        cur = b'0'
-        while cur:
-            cur, vals = await db.hscan(index, cur)
-            for key in vals:
-                if key[1].decode('utf-8') == search:
-                    keys.append(key[0].decode('utf-8'))
-        return keys
+        return await DB.search_index(index, search, db)
+
+    @staticmethod
+    async def rebuild_indexes(db: AioRedis):
+        """
+        builds the reverse indexes from the existing index hashes
+
+        @param db: redis instance
+        """
+        for index in [endpoint_cache_service_id_index]:
+            await DB.rebuild_index(index, db)
 
     @staticmethod
     async def create(ctx: dict, endpoint_cacher_db: AioRedis, service_db):
@@ -75,6 +125,7 @@ class EndpointCacher:
             for response_code in response_codes:
                 await endpoint_cacher_db.sadd(response_codes_id, response_code)
             ctx['response_codes'] = response_codes_id
+        EndpointCacher._join_lists(ctx)
         await asyncio.gather(
             EndpointCacher._set_indexes(ctx, endpoint_cacher_db),
             endpoint_cacher_db.hset(ctx['_id'], mapping=ctx),
@@ -90,6 +141,7 @@ class EndpointCacher:
         @param ctx: (object) data to use for update
         @param db: (object) db connection
         """
+        EndpointCacher._join_lists(ctx)
         await EndpointCacher._set_indexes(pydash.merge(ctx, {'_id': _id}), db)
         await db.hset(_id, mapping=ctx)
 
@@ -103,9 +155,11 @@ class EndpointCacher:
         """
         await asyncio.gather(
             db.delete(_id),
+            db.delete(EndpointCacher.stats_key(_id)),
             EndpointCacher._clear_indexes(_id, db),
             db.srem(endpoint_cache_set, _id),
         )
+        await EndpointCacher.purge_tag(f'cacher:{_id}', db)
 
     @staticmethod
     async def get_by_id(_id: str, db: AioRedis) -> object:
@@ -222,3 +276,414 @@ class EndpointCacher:
         @param db: redis instance
         """
         return await db.get(_hash)
+
+    @staticmethod
+    def _compress(body: bytes) -> tuple:
+        if len(body) < ENDPOINT_CACHE_COMPRESS_MIN or ENDPOINT_CACHE_COMPRESSION == 'none':
+            return body, 0
+        if ENDPOINT_CACHE_COMPRESSION == 'zstd' and zstandard is not None:
+            compressed, flag = zstandard.ZstdCompressor().compress(body), entry_zstd
+        else:
+            compressed, flag = gzip.compress(body, compresslevel=6, mtime=0), entry_gzip
+        # incompressible bodies are stored as they are
+        return (compressed, flag) if len(compressed) < len(body) else (body, 0)
+
+    @staticmethod
+    def entry_headers(headers) -> list:
+        """
+        gets the headers of a response worth caching
+
+        @param headers: (list|dict) response headers
+        @returns: header name and value pairs
+        """
+        if isinstance(headers, dict):
+            headers = headers.items()
+        return [[key, value] for key, value in headers or [] if key.lower() not in entry_skip_headers]
+
+    @staticmethod
+    def encode_entry(ctx: object) -> bytes:
+        """
+        encodes a response to be stored in redis
+
+        the entry is a fixed header (magic, version, flags, status, expiry, sizes)
+        followed by the content type, the stored headers and the raw body, which
+        is compressed above ENDPOINT_CACHE_COMPRESS_MIN bytes
+
+        @param ctx: (dict) response with raw body bytes
+        """
+        headers = [(key.encode('utf-8', 'surrogateescape'), value.encode('utf-8', 'surrogateescape'))
+                   for key, value in EndpointCacher.entry_headers(ctx.get('headers'))]
+        headers = [(key, value) for key, value in headers if len(key) <= 0xffff and len(value) <= 0xffff]
+        content_type = (ctx.get('content_type') or '').encode('utf-8')
+        body, flags = EndpointCacher._compress(ctx['body'])
+        parts = [entry_header.pack(entry_magic, entry_version, flags, int(ctx['status']),
+                                   float(ctx.get('expires_at') or 0), len(content_type), len(headers)),
+                 content_type]
+        for key, value in headers:
+            parts.append(entry_header_size.pack(len(key), len(value)))
+            parts.append(key)
+            parts.append(value)
+        parts.append(body)
+        return b''.join(parts)
+
+    @staticmethod
+    def decode_entry(raw: bytes) -> object:
+        """
+        decodes a response stored in redis
+
+        @param raw: (bytes) stored response
+        @returns: response with raw body bytes
+        """
+        magic, version, flags, status, expires_at, content_type_size, header_count = \
+            entry_header.unpack_from(raw)
+        if magic != entry_magic or version != entry_version:
+            raise Exception({
+                'message': f'Unknown cache entry version {version}',
+                'status_code': 500
+            })
+        view = memoryview(raw)
+        offset = entry_header.size
+        content_type = bytes(view[offset:offset + content_type_size]).decode('utf-8')
+        offset += content_type_size
+        headers = []
+        for _ in range(header_count):
+            key_size, value_size = entry_header_size.unpack_from(raw, offset)
+            offset += entry_header_size.size
+            key = bytes(view[offset:offset + key_size]).decode('utf-8', 'surrogateescape')
+            offset += key_size
+            headers.append([key, bytes(view[offset:offset + value_size]).decode('utf-8', 'surrogateescape')])
+            offset += value_size
+        body = bytes(view[offset:])
+        if flags & entry_gzip:
+            body = gzip.decompress(body)
+        elif flags & entry_zstd:
+            body = zstandard.ZstdDecompressor().decompress(body)
+        entry = {
+            'status': status,
+            'content_type': content_type,
+            'headers': headers,
+            'body': body,
+        }
+        if expires_at:
+            entry['expires_at'] = expires_at
+        return entry
+
+    @staticmethod
+    async def read(_hash: str, db: AioRedis) -> object:
+        """
+        reads a cached response, from the local cache when possible
+
+        local copies live at most ENDPOINT_CACHE_L1_TTL seconds and never longer
+        than the redis entry had left when it was read
+
+        @param _hash: (str) hash of request
+        @param db: redis instance
+        @returns: response with raw body bytes or None
+        """
+        entry = EndpointCacher._local.get(_hash)
+        if entry is not None:
+            return entry
+        async with db.pipeline(transaction=False) as pipe:
+            pipe.get(_hash)
+            pipe.pttl(_hash)
+            raw, ttl = await pipe.execute()
+        if raw is None:
+            return None
+        entry = EndpointCacher.decode_entry(raw)
+        if ttl > 0:
+            EndpointCacher._local.set(_hash, entry, min(ttl / 1000, ENDPOINT_CACHE_L1_TTL), len(entry['body']))
+        return entry
+
+    @staticmethod
+    def staleness(entry: object) -> float:
+        """
+        gets how long a cached response is past its expiry
+
+        @param entry: (dict) cached response
+        @returns: seconds past expiry, not positive while the response is fresh
+        """
+        if 'expires_at' not in entry:
+            return 0
+        return time.time() - entry['expires_at']
+
+    @staticmethod
+    def stale_window(endpoint_cacher: object) -> int:
+        """
+        gets how long responses are kept after they expire
+
+        @param endpoint_cacher: (dict) endpoint cache config
+        @returns: seconds a stale response may still be served
+        """
+        return max(int(endpoint_cacher.get('stale_while_revalidate') or 0),
+                   int(endpoint_cacher.get('stale_if_error') or 0))
+
+    @staticmethod
+    def tag_key(tag: str) -> str:
+        """
+        returns key of the sorted set holding the entries of a tag
+        """
+        return f'{endpoint_cache_tag}:{tag}'
+
+    @staticmethod
+    def tags(endpoint_cacher: object, path: str, headers) -> list:
+        """
+        gets the tags of a cached response
+
+        @param endpoint_cacher: (dict) endpoint cache config
+        @param path: (str) request path
+        @param headers: (list) response header name and value pairs, Surrogate-Key adds tags
+        @returns: service, cacher, path and surrogate key tags
+        """
+        tags = [f"service:{endpoint_cacher.get('service_id')}", f"cacher:{endpoint_cacher['_id']}", f'path:{path}']
+        for key, value in headers or []:
+            if key.lower() == 'surrogate-key':
+                tags.extend(f'key:{tag}' for tag in value.split())
+        return tags
+
+    @staticmethod
+    async def write(_hash: str, ctx: object, timeout: int, db: AioRedis, stale: int = 0, tags: list = None,
+                    tag_timeout: int = None):
+        """
+        caches a response in redis and locally, dropping stale local copies of
+        other workers
+
+        @param _hash: (str) hash of request
+        @param ctx: (dict) response with raw body bytes
+        @param timeout: (int) seconds the response is fresh
+        @param db: redis instance
+        @param stale: (int) seconds the response is kept after it expires
+        @param tags: (list) tags the response can be purged by
+        @param tag_timeout: (int) seconds the tag sets are kept, the longest any entry of them lives
+        """
+        ctx = pydash.assign({}, ctx, {
+            'headers': EndpointCacher.entry_headers(ctx.get('headers')),
+            'expires_at': time.time() + timeout
+        })
+        now = time.time()
+        async with db.pipeline(transaction=False) as pipe:
+            pipe.set(_hash, EndpointCacher.encode_entry(ctx), ex=timeout + stale)
+            for tag in tags or []:
+                tag_key = EndpointCacher.tag_key(tag)
+                pipe.zadd(tag_key, {_hash: now + timeout + stale})
+                # entries that expired on their own leave the tag, so a busy tag stays as big as its live entries
+                pipe.zremrangebyscore(tag_key, '-inf', now)
+                pipe.expire(tag_key, max(tag_timeout or 0, timeout + stale))
+            pipe.publish(endpoint_cache_invalidate_channel, f'{EndpointCacher.worker_id()}|{_hash}')
+            await pipe.execute()
+        EndpointCacher._local.set(_hash, ctx, min(timeout + stale, ENDPOINT_CACHE_L1_TTL), len(ctx['body']))
+
+    @staticmethod
+    async def _purge_keys(keys: list, db: AioRedis) -> int:
+        if not keys:
+            return 0
+        keys = [DB.decode(key) for key in keys]
+        async with db.pipeline(transaction=False) as pipe:
+            pipe.unlink(*keys)
+            # one message drops the local copies of the whole batch in every worker
+            pipe.publish(endpoint_cache_invalidate_channel, f"{EndpointCacher.worker_id()}|{','.join(keys)}")
+            deleted, _ = await pipe.execute()
+        EndpointCacher.invalidate_local(keys)
+        return deleted
+
+    @staticmethod
+    async def purge_tag(tag: str, db: AioRedis) -> int:
+        """
+        drops every cached response of a tag in batches of ENDPOINT_CACHE_PURGE_BATCH
+
+        @param tag: (str) tag such as service:{id}, cacher:{id}, path:{path} or key:{surrogate key}
+        @param db: redis instance
+        @returns: number of responses dropped
+        """
+        tag_key = EndpointCacher.tag_key(tag)
+        await db.zremrangebyscore(tag_key, '-inf', time.time())
+        purged = 0
+        cursor = 0
+        while True:
+            cursor, members = await db.zscan(tag_key, cursor, count=ENDPOINT_CACHE_PURGE_BATCH)
+            purged += await EndpointCacher._purge_keys([key for key, _ in members], db)
+            if not cursor:
+                break
+            await asyncio.sleep(0)
+        await db.unlink(tag_key)
+        return purged
+
+    @staticmethod
+    async def purge_pattern(pattern: str, db: AioRedis) -> int:
+        """
+        drops every cached response whose key matches a glob pattern in batches
+        of ENDPOINT_CACHE_PURGE_BATCH, using SCAN instead of KEYS
+
+        @param pattern: (str) glob pattern, matched below endpoint_cache:
+        @param db: redis instance
+        @returns: number of responses dropped
+        """
+        if not pattern.startswith(endpoint_cache_prefix):
+            pattern = endpoint_cache_prefix + pattern
+        purged = 0
+        cursor = 0
+        while True:
+            cursor, keys = await db.scan(cursor, match=pattern, count=ENDPOINT_CACHE_PURGE_BATCH)
+            purged += await EndpointCacher._purge_keys(keys, db)
+            if not cursor:
+                break
+            await asyncio.sleep(0)
+        return purged
+
+    @staticmethod
+    def fill_lock_key(_hash: str) -> str:
+        """
+        returns fill lock key
+        """
+        return f'{_hash}.fill'
+
+    @staticmethod
+    async def lock_fill(_hash: str, timeout: int, db: AioRedis) -> bool:
+        """
+        takes the lock allowing one worker to fill a cache entry
+
+        @param _hash: (str) hash of request
+        @param timeout: (int) milliseconds to hold the lock at most
+        @param db: redis instance
+        @returns: if the lock was taken
+        """
+        return bool(await db.set(EndpointCacher.fill_lock_key(_hash), 1, nx=True, px=timeout))
+
+    @staticmethod
+    async def unlock_fill(_hash: str, db: AioRedis):
+        """
+        releases the fill lock of a cache entry
+
+        @param _hash: (str) hash of request
+        @param db: redis instance
+        """
+        await db.delete(EndpointCacher.fill_lock_key(_hash))
+
+    @staticmethod
+    async def wait_fill(_hash: str, timeout: int, db: AioRedis) -> object:
+        """
+        waits for the worker holding the fill lock to cache an entry
+
+        @param _hash: (str) hash of request
+        @param timeout: (int) milliseconds to wait at most
+        @param db: redis instance
+        @returns: response with raw body bytes or None when it was not filled in time
+        """
+        interval = min(timeout / 10, 50) / 1000
+        deadline = asyncio.get_event_loop().time() + timeout / 1000
+        while asyncio.get_event_loop().time() < deadline:
+            await asyncio.sleep(interval)
+            entry = await EndpointCacher.read(_hash, db)
+            if entry is not None:
+                return entry
+            if not await db.exists(EndpointCacher.fill_lock_key(_hash)):
+                return None
+        return None
+
+    @staticmethod
+    def stats_key(_id: str) -> str:
+        """
+        returns hit ratio counters key
+        """
+        return f'{endpoint_cache_stats}:{_id}'
+
+    @staticmethod
+    def count(_id: str, field: str, db: AioRedis):
+        """
+        counts a cache lookup, counters are summed locally and added to redis
+        every ENDPOINT_CACHE_STATS_SYNC seconds
+
+        @param _id: (str) id of endpoint cache
+        @param field: (str) one of hit, stale, miss, bypass or uncacheable
+        @param db: redis instance
+        """
+        counts = EndpointCacher._counts.setdefault(_id, {})
+        counts[field] = counts.get(field, 0) + 1
+        now = time.monotonic()
+        if now - EndpointCacher._counted_at >= ENDPOINT_CACHE_STATS_SYNC:
+            EndpointCacher._counted_at = now
+            flush = asyncio.ensure_future(EndpointCacher.flush_counts(db))
+            endpoint_cache_flushes.add(flush)
+            flush.add_done_callback(endpoint_cache_flushes.discard)
+
+    @staticmethod
+    async def flush_counts(db: AioRedis):
+        """
+        adds the locally summed counters to redis
+
+        @param db: redis instance
+        """
+        counts, EndpointCacher._counts = EndpointCacher._counts, {}
+        if not counts:
+            return
+        try:
+            async with db.pipeline(transaction=False) as pipe:
+                for _id, fields in counts.items():
+                    for field, count in fields.items():
+                        pipe.hincrby(EndpointCacher.stats_key(_id), field, count)
+                await pipe.execute()
+        except Exception:
+            # counters are best effort, keep them for the next flush
+            for _id, fields in counts.items():
+                for field, count in fields.items():
+                    current = EndpointCacher._counts.setdefault(_id, {})
+                    current[field] = current.get(field, 0) + count
+
+    @staticmethod
+    async def get_stats(_id: str, db: AioRedis) -> object:
+        """
+        gets hit ratio counters of an endpoint cache
+
+        @param _id: (str) id of endpoint cache
+        @param db: redis instance
+        """
+        stats = await db.hgetall(EndpointCacher.stats_key(_id))
+        stats = {field: int(stats.get(field) or 0) for field in endpoint_cache_stat_fields}
+        lookups = stats['hit'] + stats['stale'] + stats['miss']
+        stats['hit_ratio'] = (stats['hit'] + stats['stale']) / lookups if lookups else 0
+        return stats
+
+    @staticmethod
+    def worker_id() -> str:
+        """
+        returns id of this worker process in invalidation messages
+        """
+        return f'{endpoint_cache_host_id}.{os.getpid()}'
+
+    @staticmethod
+    def invalidate_local(_hash=None):
+        """
+        drops local copies of cached responses
+
+        @param _hash: (str|list) hash of request or list of hashes, every copy when omitted
+        """
+        if _hash is None:
+            EndpointCacher._local.clear()
+            return
+        for key in [_hash] if isinstance(_hash, str) else _hash:
+            EndpointCacher._local.delete(key)
+
+    @staticmethod
+    async def listen_invalidations(db: AioRedis):
+        """
+        drops local copies invalidated by other workers until cancelled
+
+        @param db: redis instance
+        """
+        while True:
+            pubsub = db.pubsub()
+            try:
+                await pubsub.subscribe(endpoint_cache_invalidate_channel)
+                # anything published while not subscribed is lost
+                EndpointCacher.invalidate_local()
+                async for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        worker_id, _, keys = DB.decode(message['data']).rpartition('|')
+                        # the publishing worker already holds the copy it wrote or dropped
+                        if worker_id != EndpointCacher.worker_id():
+                            EndpointCacher.invalidate_local(keys.split(','))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
@@ -1,12 +1,216 @@
+import base64
+import json
+from datetime import datetime, timedelta
+
 import bson
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError
 from motor.motor_asyncio import AsyncIOMotorCollection
 
 from flash.models.service import Service
 
 collection_name = 'insights'
+# insights are stored with short field names, the api uses the long ones
+fields = {
+    'service_id': 's',
+    'route': 'r',
+    'path': 'p',
+    'method': 'm',
+    'remote_ip': 'ip',
+    'scheme': 'sc',
+    'status_code': 'st',
+    'content_type': 'ct',
+    'elapsed_time': 't',
+    'cache': 'c',
+    'created_at': 'ts',
+    'expire_at': 'x',
+}
+long_fields = {short: name for name, short in fields.items()}
+# fields insights can be filtered by, each index ends with the keyset sort
+filter_fields = ['service_id', 'status_code', 'remote_ip', 'path', 'method', 'scheme', 'cache']
+indexed_fields = ['service_id', 'status_code', 'remote_ip', 'path']
+keyset_sort = [(fields['created_at'], DESCENDING), ('_id', DESCENDING)]
+storage_modes = ['plain', 'ttl', 'timeseries']
 
 
 class Insights:
+    @staticmethod
+    async def create_collection(db, storage: str, retention: int):
+        """
+        creates the insights collection for a storage mode
+
+        plain keeps insights forever. ttl expires every insight at its expire_at,
+        so the retention of each service applies. timeseries stores insights in
+        a mongo time series collection expiring after retention days, services
+        keeping them shorter are trimmed by enforce_retention
+
+        @param db: mongo database instance
+        @param storage: (str) plain, ttl or timeseries
+        @param retention: (int) days insights are kept by default
+        """
+        if storage not in storage_modes:
+            raise Exception({
+                'message': f'Unknown insights storage {storage}',
+                'status_code': 500
+            })
+        collection = db[collection_name]
+        if storage == 'timeseries' and collection_name not in await db.list_collection_names():
+            await db.create_collection(collection_name, timeseries={
+                'timeField': fields['created_at'],
+                'metaField': fields['service_id'],
+                'granularity': 'seconds',
+            }, expireAfterSeconds=retention * 86400)
+        if storage == 'ttl':
+            await collection.create_index(fields['expire_at'], expireAfterSeconds=0)
+        await Insights.create_indexes(collection)
+
+    @staticmethod
+    async def create_indexes(db: AsyncIOMotorCollection):
+        """
+        creates the indexes insight queries use
+
+        @param db: mongo collection instance
+        """
+        await db.create_index(keyset_sort)
+        for field in indexed_fields:
+            await db.create_index([(fields[field], ASCENDING)] + keyset_sort)
+
+    @staticmethod
+    def compact(ctx: object) -> object:
+        """
+        renames the fields of an insight to their stored names
+
+        @param ctx: (dict) insight with api field names
+        """
+        return {fields.get(field, field): value for field, value in ctx.items()}
+
+    @staticmethod
+    def expand(document: object) -> object:
+        """
+        renames the fields of a stored insight to their api names
+
+        @param document: (dict) stored insight
+        """
+        return {long_fields.get(field, field): value for field, value in document.items()}
+
+    @staticmethod
+    def expire_at(created_at: datetime, retention: int) -> datetime:
+        """
+        gets when an insight expires
+
+        @param created_at: (datetime) time of insight
+        @param retention: (int) days the insight is kept
+        """
+        return created_at + timedelta(days=retention)
+
+    @staticmethod
+    def serialize(document: object) -> object:
+        """
+        converts a stored insight to json values with api field names
+
+        @param document: (dict) insight document
+        """
+        document = Insights.expand(document)
+        document['_id'] = str(document['_id'])
+        for field in ['created_at', 'expire_at']:
+            if isinstance(document.get(field), datetime):
+                document[field] = document[field].isoformat()
+        return document
+
+    @staticmethod
+    def encode_cursor(document: object) -> str:
+        """
+        encodes the position after an insight as an opaque page cursor
+
+        @param document: (dict) last insight of a page
+        """
+        created_at = document.get(fields['created_at'])
+        position = [created_at.isoformat() if isinstance(created_at, datetime) else None, str(document['_id'])]
+        return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('utf-8')
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> dict:
+        """
+        decodes a page cursor to the filter of the insights after it
+
+        @param cursor: (str) page cursor
+        """
+        try:
+            created_at, _id = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+            _id = bson.ObjectId(_id)
+            created_at = datetime.fromisoformat(created_at) if created_at else None
+        except Exception:
+            raise Exception({
+                'message': 'Invalid cursor',
+                'status_code': 400
+            })
+        return {'$or': [
+            {fields['created_at']: {'$lt': created_at}},
+            {fields['created_at']: created_at, '_id': {'$lt': _id}},
+        ]}
+
+    @staticmethod
+    def build_query(filters: object, start: datetime = None, end: datetime = None, cursor: str = None) -> dict:
+        """
+        builds the query of insights matching every filter
+
+        @param filters: (dict) field to value, see filter_fields
+        @param start: (datetime) first time, included
+        @param end: (datetime) last time, excluded
+        @param cursor: (str) page cursor to continue from
+        """
+        query = {fields[field]: filters[field] for field in filter_fields if filters.get(field) is not None}
+        if start is not None or end is not None:
+            created_at = query[fields['created_at']] = {}
+            if start is not None:
+                created_at['$gte'] = start
+            if end is not None:
+                created_at['$lt'] = end
+        if cursor:
+            query = {'$and': [query, Insights.decode_cursor(cursor)]}
+        return query
+
+    @staticmethod
+    async def query(filters: object, db: AsyncIOMotorCollection, start: datetime = None, end: datetime = None,
+                    cursor: str = None, limit: int = 100) -> tuple:
+        """
+        gets one page of insights, newest first
+
+        @param filters: (dict) field to value, see filter_fields
+        @param db: mongo collection instance
+        @param start: (datetime) first time, included
+        @param end: (datetime) last time, excluded
+        @param cursor: (str) page cursor to continue from
+        @param limit: (int) insights per page
+        @returns: (serialized insights, cursor of the next page or None)
+        """
+        res = db.find(Insights.build_query(filters, start, end, cursor)).sort(keyset_sort).limit(limit + 1)
+        documents = await res.to_list(limit + 1)
+        next_cursor = Insights.encode_cursor(documents[limit - 1]) if len(documents) > limit else None
+        return [Insights.serialize(document) for document in documents[:limit]], next_cursor
+
+    @staticmethod
+    async def export(filters: object, db: AsyncIOMotorCollection, start: datetime = None, end: datetime = None,
+                     batch_size: int = 1000):
+        """
+        streams matching insights as ndjson lines, newest first
+
+        @param filters: (dict) field to value, see filter_fields
+        @param db: mongo collection instance
+        @param start: (datetime) first time, included
+        @param end: (datetime) last time, excluded
+        @param batch_size: (int) documents fetched per round trip
+        """
+        res = db.find(Insights.build_query(filters, start, end)).sort(keyset_sort).batch_size(batch_size)
+        lines = []
+        async for document in res:
+            lines.append(json.dumps(Insights.serialize(document), default=str))
+            if len(lines) >= batch_size:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+        if lines:
+            yield '\n'.join(lines) + '\n'
+
     @staticmethod
     async def create(ctx: object, insights_db: AsyncIOMotorCollection, service_db: AsyncIOMotorCollection):
         """
@@ -18,7 +222,22 @@ class Insights:
         """
         if 'service_id' in ctx:
             await Service.check_exists(ctx['service_id'], service_db)
-        await insights_db.insert_one(ctx)
+        await insights_db.insert_one(Insights.compact(ctx))
+
+    @staticmethod
+    async def create_many(ctxs: list, db: AsyncIOMotorCollection) -> int:
+        """
+        creates insights in bulk without checking their services exist
+
+        @param ctxs: (list) contexts to create insights with
+        @param db: mongo collection instance
+        @returns: number of insights created
+        """
+        try:
+            res = await db.insert_many(ctxs, ordered=False)
+            return len(res.inserted_ids)
+        except BulkWriteError as err:
+            return err.details.get('nInserted', 0)
 
     @staticmethod
     async def update(_id: str, ctx: object, db: AsyncIOMotorCollection):
@@ -28,7 +247,7 @@ class Insights:
         @param id: (str) id of insight
         @param db: mongo collection instance
         """
-        await db.update_one({'_id': bson.ObjectId(_id)}, {'$set': ctx})
+        await db.update_one({'_id': bson.ObjectId(_id)}, {'$set': Insights.compact(ctx)})
 
     @staticmethod
     async def get_by_service_id(_id: str, db: AsyncIOMotorCollection):
@@ -38,7 +257,7 @@ class Insights:
         @param id: (str) id to get insights by
         @param db: mongo collection instance
         """
-        res = db.find({'service_id': _id})
+        res = db.find({fields['service_id']: _id})
         return await res.to_list(100)
 
     @staticmethod
@@ -49,7 +268,7 @@ class Insights:
         @param scheme: (str) scheme to get insights by
         @param db: mongo collection instance
         """
-        res = db.find({'scheme': scheme})
+        res = db.find({fields['scheme']: scheme})
         return await res.to_list(100)
 
     @staticmethod
@@ -70,7 +289,7 @@ class Insights:
         @param remote_id: (str) remote_ip to get insights by
         @param db: mongo collection instance
         """
-        res = db.find({'remote_ip': remote_ip})
+        res = db.find({fields['remote_ip']: remote_ip})
         return await res.to_list(100)
 
     @staticmethod
@@ -81,7 +300,7 @@ class Insights:
         @param status_code: (str) status_code to get insights by
         @param db: mongo collection instance
         """
-        res = db.find({'status_code': status_code})
+        res = db.find({fields['status_code']: status_code})
         return await res.to_list(100)
 
     @staticmethod
@@ -92,7 +311,7 @@ class Insights:
         @param path: (str) path to get insights by
         @param db: mongo collection instance
         """
-        res = db.find({'path': path})
+        res = db.find({fields['path']: path})
         return await res.to_list(100)
 
     @staticmethod
@@ -103,7 +322,7 @@ class Insights:
         @param method: (str) method to get insights by
         @param db: mongo collection instance
         """
-        res = db.find({'method': method})
+        res = db.find({fields['method']: method})
         return await res.to_list(100)
 
     @staticmethod
@@ -116,6 +335,31 @@ class Insights:
         res = db.find({})
         return await res.to_list(100)
 
+    @staticmethod
+    async def enforce_retention(service_db: AsyncIOMotorCollection, db: AsyncIOMotorCollection):
+        """
+        drops the insights of services older than their insights_retention days,
+        needed by timeseries storage whose expiry applies to the whole collection
+
+        @param service_db: mongo collection instance of services
+        @param db: mongo collection instance
+        """
+        res = service_db.find({'insights_retention': {'$gt': 0}}, {'insights_retention': 1})
+        async for service in res:
+            expired = datetime.utcnow() - timedelta(days=service['insights_retention'])
+            await db.delete_many({fields['service_id']: str(service['_id']), fields['created_at']: {'$lt': expired}})
+
+    @staticmethod
+    async def compact_fields(db: AsyncIOMotorCollection):
+        """
+        renames the fields of insights stored before short names were used
+
+        @param db: mongo collection instance
+        """
+        await db.update_many({'service_id': {'$exists': True}}, {
+            '$rename': {name: short for name, short in fields.items()}
+        })
+
     @staticmethod
     async def remove(_id: str, db: AsyncIOMotorCollection):
         """
@@ -0,0 +1,211 @@
+import math
+from datetime import datetime, timedelta
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import UpdateOne, ASCENDING
+
+collection_name = 'insights_rollup'
+
+# latency histogram with logarithmic buckets of 2% relative accuracy. a bucket
+# only depends on the value, so histograms of any worker or minute are merged by
+# adding their counts, which mongo does with $inc
+latency_accuracy = 0.02
+latency_gamma = (1 + latency_accuracy) / (1 - latency_accuracy)
+latency_log_gamma = math.log(latency_gamma)
+epoch = datetime(1970, 1, 1)
+steps = {
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400,
+}
+
+
+class InsightsRollup:
+    """
+    insights aggregated per service, route, status class and minute
+    """
+
+    @staticmethod
+    def bucket(latency: float) -> int:
+        """
+        gets the histogram bucket of a latency
+
+        @param latency: (float) latency in microseconds
+        """
+        return 0 if latency <= 1 else math.ceil(math.log(latency) / latency_log_gamma)
+
+    @staticmethod
+    def bucket_value(bucket: int) -> float:
+        """
+        gets the latency a histogram bucket stands for
+
+        @param bucket: (int) histogram bucket
+        """
+        return 2 * latency_gamma ** bucket / (latency_gamma + 1) if bucket > 0 else 1
+
+    @staticmethod
+    def quantile(histogram: dict, quantile: float) -> float:
+        """
+        estimates a latency quantile from a histogram
+
+        @param histogram: (dict) bucket to count
+        @param quantile: (float) quantile between 0 and 1
+        @returns: latency in microseconds, None for an empty histogram
+        """
+        buckets = sorted((int(bucket), count) for bucket, count in histogram.items())
+        total = sum(count for _, count in buckets)
+        if not total:
+            return None
+        rank = quantile * (total - 1)
+        seen = 0
+        for bucket, count in buckets:
+            seen += count
+            if seen > rank:
+                return InsightsRollup.bucket_value(bucket)
+        return InsightsRollup.bucket_value(buckets[-1][0])
+
+    @staticmethod
+    def key(ctx: object) -> tuple:
+        """
+        gets the rollup an insight is counted in
+
+        @param ctx: (dict) insight of a proxied request
+        """
+        minute = ctx['created_at'].replace(second=0, microsecond=0)
+        return ctx.get('service_id'), ctx.get('route') or '', f"{int(ctx['status_code']) // 100}xx", minute
+
+    @staticmethod
+    def add(rollup: object, ctx: object) -> object:
+        """
+        counts an insight in a rollup
+
+        @param rollup: (dict) rollup counters
+        @param ctx: (dict) insight of a proxied request
+        """
+        rollup['count'] = rollup.get('count', 0) + 1
+        if ctx.get('cache'):
+            rollup['cache_hits'] = rollup.get('cache_hits', 0) + 1
+        if int(ctx['status_code']) >= 500:
+            rollup['errors'] = rollup.get('errors', 0) + 1
+        rollup['latency_sum'] = rollup.get('latency_sum', 0) + ctx['elapsed_time']
+        histogram = rollup.setdefault('latency', {})
+        bucket = str(InsightsRollup.bucket(ctx['elapsed_time']))
+        histogram[bucket] = histogram.get(bucket, 0) + 1
+        return rollup
+
+    @staticmethod
+    def merge(rollup: object, other: object) -> object:
+        """
+        adds the counters of a rollup to another
+
+        @param rollup: (dict) rollup counters to add to
+        @param other: (dict) rollup counters to add
+        """
+        for field in ['count', 'cache_hits', 'errors', 'latency_sum']:
+            if field in other:
+                rollup[field] = rollup.get(field, 0) + other[field]
+        histogram = rollup.setdefault('latency', {})
+        for bucket, count in other.get('latency', {}).items():
+            histogram[bucket] = histogram.get(bucket, 0) + count
+        return rollup
+
+    @staticmethod
+    async def create_indexes(db: AsyncIOMotorCollection, retention: int = None):
+        """
+        creates the indexes rollup queries use
+
+        @param db: mongo collection instance
+        @param retention: (int) days rollups are kept, forever when omitted
+        """
+        await db.create_index([('service_id', ASCENDING), ('minute', ASCENDING)])
+        if retention:
+            await db.create_index('minute', expireAfterSeconds=retention * 86400)
+
+    @staticmethod
+    async def upsert_many(rollups: dict, db: AsyncIOMotorCollection):
+        """
+        adds rollup counters to the stored rollups in one unordered bulk write
+
+        @param rollups: (dict) rollup key to counters
+        @param db: mongo collection instance
+        """
+        operations = []
+        for (service_id, route, status, minute), rollup in rollups.items():
+            inc = {field: rollup[field] for field in ['count', 'cache_hits', 'errors', 'latency_sum']
+                   if field in rollup}
+            for bucket, count in rollup['latency'].items():
+                inc[f'latency.{bucket}'] = count
+            operations.append(UpdateOne({
+                '_id': f'{service_id}:{status}:{minute.isoformat()}:{route}'
+            }, {
+                '$setOnInsert': {'service_id': service_id, 'route': route, 'status': status, 'minute': minute},
+                '$inc': inc,
+            }, upsert=True))
+        if operations:
+            await db.bulk_write(operations, ordered=False)
+
+    @staticmethod
+    async def query(service_id: str, start: datetime, end: datetime, db: AsyncIOMotorCollection, route: str = None,
+                    step: str = 'minute') -> list:
+        """
+        gets the merged rollups of a service
+
+        @param service_id: (str) id of service
+        @param start: (datetime) first minute, included
+        @param end: (datetime) last minute, excluded
+        @param db: mongo collection instance
+        @param route: (str) route to limit rollups to
+        @param step: (str) minute, hour, day or total
+        @returns: counters and latency percentiles per step, route and status class
+        """
+        query = {'service_id': service_id, 'minute': {'$gte': start, '$lt': end}}
+        if route is not None:
+            query['route'] = route
+        merged = {}
+        async for rollup in db.find(query):
+            if step in steps:
+                seconds = (rollup['minute'] - epoch).total_seconds()
+                time = epoch + timedelta(seconds=seconds // steps[step] * steps[step])
+            else:
+                time = start
+            group = merged.setdefault((time, rollup['route'], rollup['status']), {
+                'time': time, 'route': rollup['route'], 'status': rollup['status'],
+                'count': 0, 'cache_hits': 0, 'errors': 0, 'latency_sum': 0, 'latency': {}
+            })
+            for field in ['count', 'cache_hits', 'errors', 'latency_sum']:
+                group[field] += rollup.get(field, 0)
+            for bucket, count in rollup.get('latency', {}).items():
+                group['latency'][bucket] = group['latency'].get(bucket, 0) + count
+        results = []
+        for key in sorted(merged):
+            group = merged[key]
+            histogram = group.pop('latency')
+            latency_sum = group.pop('latency_sum')
+            group['time'] = group['time'].isoformat()
+            group['latency_avg'] = latency_sum / group['count'] if group['count'] else None
+            for name, quantile in [('p50', 0.5), ('p95', 0.95), ('p99', 0.99)]:
+                group[f'latency_{name}'] = InsightsRollup.quantile(histogram, quantile)
+            results.append(group)
+        return results
+
+    @staticmethod
+    def parse_time(value: str, default: datetime) -> datetime:
+        """
+        parses a query time given as iso format or unix seconds
+
+        @param value: (str) time to parse
+        @param default: (datetime) time when value is empty
+        """
+        if not value:
+            return default
+        if value.replace('.', '', 1).isdigit():
+            return datetime.utcfromtimestamp(float(value))
+        return datetime.fromisoformat(value)
+
+    @staticmethod
+    def default_range() -> tuple:
+        """
+        gets the last hour in utc, the range queried when none is given
+        """
+        end = datetime.utcnow().replace(second=0, microsecond=0) + timedelta(minutes=1)
+        return end - timedelta(hours=1), end
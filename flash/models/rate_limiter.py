@@ -4,6 +4,7 @@ import asyncio
 from aioredis import Redis as AioRedis
 from cerberus import Validator
 
+from flash.rate_limiter.scripts import scripts, lease
 from flash.util import Async, DB
 
 rules_set = 'rules_set'
@@ -12,9 +13,14 @@ rule_service_id_index = 'rule_service_id_index'
 entry_set = 'entries_set'
 entry_rule_id_index = 'entry_rule_id_index'
 entry_host_index = 'entry_host_index'
+entry_rule_host_index = 'entry_rule_host_index'
+counter_prefix = 'rate_limiter'
+default_algorithm = 'fixed_window'
 
 
 class RateLimiter:
+    _scripts = {}
+
     @staticmethod
     async def _set_indexes(ctx: object, db: AioRedis):
         """
@@ -27,12 +33,39 @@ class RateLimiter:
         for index in [('status_code', rule_status_code_index),
                       ('service_id', rule_service_id_index)]:
             if index[0] in ctx:
-                coroutines.append(db.hset(index[1], ctx['_id'], ctx[index[0]]))
+                coroutines.append(DB.set_index(ctx['_id'], ctx[index[0]], index[1], db))
         for index in [('rule_id', entry_rule_id_index),
                       ('host', entry_host_index)]:
             if index[0] in ctx:
-                coroutines.append(db.hset(index[1], ctx['_id'], ctx[index[0]]))
+                coroutines.append(DB.set_index(ctx['_id'], ctx[index[0]], index[1], db))
         await Async.all(coroutines)
+        if 'rule_id' in ctx or 'host' in ctx:
+            await RateLimiter._set_rule_host_index(ctx['_id'], db)
+
+    @staticmethod
+    async def _set_rule_host_index(_id: str, db: AioRedis):
+        """
+        points rule_id:host at the id of its entry, expiring with the entry
+
+        @param id: id of entry
+        @param db: redis instance
+        """
+        rule_id, host, ttl = await Async.all([
+            db.hget(entry_rule_id_index, _id),
+            db.hget(entry_host_index, _id),
+            db.pttl(_id),
+        ])
+        if rule_id is None or host is None or ttl == -2:
+            # an expired entry is not indexed again
+            return
+        value = f'{DB.decode(rule_id)}:{DB.decode(host)}'
+        old = DB.decode(await db.hget(entry_rule_host_index, _id))
+        if old is not None and old != value:
+            await db.delete(DB.index_key(entry_rule_host_index, old))
+        await Async.all([
+            db.hset(entry_rule_host_index, _id, value),
+            db.set(DB.index_key(entry_rule_host_index, value), _id, px=ttl if ttl > 0 else None),
+        ])
 
     @staticmethod
     async def _clear_indexes(_id: str, db: AioRedis):
@@ -48,7 +81,13 @@ class RateLimiter:
             rule_service_id_index,
             entry_rule_id_index,
             entry_host_index]:
-            coroutines.append(db.hdel(index, _id))
+            coroutines.append(DB.clear_index(_id, index, db))
+        old = await db.hget(entry_rule_host_index, _id)
+        if old is not None:
+            rule_host_key = DB.index_key(entry_rule_host_index, old)
+            if DB.decode(await db.get(rule_host_key)) == _id:
+                coroutines.append(db.delete(rule_host_key))
+            coroutines.append(db.hdel(entry_rule_host_index, _id))
         await Async.all(coroutines)
 
     @staticmethod
@@ -60,14 +99,23 @@ class RateLimiter:
         @param serach: (str) serach value
         @param db: redis instance
         """
-        keys = []
-        cur = b'0'
-        while cur:
-            cur, vals = await db.hscan(index, cur)
-            for key in vals:
-                if key[1].decode('utf-8') == search:
-                    keys.append(key[0].decode('utf-8'))
-        return keys
+        return await DB.search_index(index, search, db)
+
+    @staticmethod
+    async def rebuild_indexes(db: AioRedis):
+        """
+        builds the reverse indexes from the existing index hashes
+
+        @param db: redis instance
+        """
+        for index in [
+            rule_status_code_index,
+            rule_service_id_index,
+            entry_rule_id_index,
+            entry_host_index]:
+            await DB.rebuild_index(index, db)
+        async for page in DB.scan_index(entry_rule_id_index, db):
+            await Async.all([RateLimiter._set_rule_host_index(_id, db) for _id, rule_id in page])
 
     @staticmethod
     async def create_rule(ctx: dict, db: AioRedis):
@@ -173,12 +221,13 @@ class RateLimiter:
         @param db: (object) db connection
         """
         ctx['_id'] = str(bson.ObjectId())
-        await asyncio.gather(
-            RateLimiter._set_indexes(ctx, db),
+        await Async.all([
             db.hset(ctx['_id'], mapping=ctx),
             db.sadd(entry_set, ctx['_id']),
             db.expire(ctx['_id'], int(ctx['timeout']))
-        )
+        ])
+        # the rule_id:host key takes the ttl of the entry written above
+        await RateLimiter._set_indexes(ctx, db)
         # find way to remove entry from entry set after expiry
 
     @staticmethod
@@ -263,6 +312,18 @@ class RateLimiter:
         entries = await Async.all(coroutines)
         return list(filter(lambda entry: entry, entries))
 
+    @staticmethod
+    async def get_entry_by_rule_id_and_host(rule_id: str, host: str, db: AioRedis):
+        """
+        gets the entry of a host for a rule
+
+        @param rule_id: (str) id of rule
+        @param host: (str) host of entry
+        @param db: redis instance
+        """
+        _id = await db.get(DB.index_key(entry_rule_host_index, f'{rule_id}:{host}'))
+        return await db.hgetall(DB.decode(_id)) if _id is not None else {}
+
     @staticmethod
     async def increment_entry_count(_id: str, db: AioRedis):
         """
@@ -297,3 +358,57 @@ class RateLimiter:
             coroutines.append(RateLimiter._clear_indexes(empty_entry, db))
 
         await Async.all(coroutines)
+
+    @staticmethod
+    def counter_key(rule_id: str, key: str = None) -> str:
+        """
+        returns the key counting requests of a rule
+
+        @param rule_id: (str) id of rule
+        @param key: (str) optional client key the rule is counted by
+        """
+        return f'{counter_prefix}:{rule_id}' if key is None else f'{counter_prefix}:{rule_id}:{key}'
+
+    @staticmethod
+    def _script(name: str, source: str, db: AioRedis):
+        script = RateLimiter._scripts.get(name)
+        if script is None:
+            script = RateLimiter._scripts[name] = db.register_script(source)
+        return script
+
+    @staticmethod
+    async def hit(rule: object, key: str, db: AioRedis) -> tuple:
+        """
+        atomically checks and counts a request against a rule
+
+        @param rule: (dict) rate limiter rule
+        @param key: (str) client key the rule is counted by, None for one shared counter
+        @param db: redis instance
+        @returns: (allowed, remaining requests, retry after ms)
+        """
+        algorithm = rule.get('algorithm') or default_algorithm
+        script = RateLimiter._script(algorithm, scripts[algorithm], db)
+        allowed, remaining, retry_after = await script(
+            keys=[RateLimiter.counter_key(rule['_id'], key)],
+            args=[int(rule['max_requests']), int(rule['timeout']) * 1000, str(bson.ObjectId())],
+            client=db)
+        return bool(allowed), int(remaining), int(retry_after)
+
+    @staticmethod
+    async def lease(rule: object, key: str, size: int, returned: int, db: AioRedis) -> tuple:
+        """
+        leases part of the fixed window budget of a rule
+
+        @param rule: (dict) rate limiter rule
+        @param key: (str) client key the rule is counted by, None for one shared counter
+        @param size: (int) number of requests to lease
+        @param returned: (int) unused requests of the previous lease to give back
+        @param db: redis instance
+        @returns: (granted requests, window ttl ms)
+        """
+        script = RateLimiter._script('lease', lease, db)
+        granted, ttl = await script(
+            keys=[RateLimiter.counter_key(rule['_id'], key)],
+            args=[int(rule['max_requests']), int(rule['timeout']) * 1000, size, returned],
+            client=db)
+        return int(granted), int(ttl)
@@ -3,6 +3,7 @@ import pydash
 from enum import Enum
 from motor.motor_asyncio import AsyncIOMotorCollection
 from flash.service.schema import service_schema, service_validator
+from flash.util.regex import Regex
 
 collection_name = 'service'
 
@@ -23,6 +24,7 @@ class Service:
         @param db: mongo collection instance
         """
         await db.insert_one(ctx)
+        Regex.set_route(ctx)
 
     @staticmethod
     async def update(_id: str, ctx: object, db: AsyncIOMotorCollection):
@@ -34,6 +36,7 @@ class Service:
         @param db: mongo collection instance
         """
         await db.update_one({'_id': bson.ObjectId(_id)}, {'$set': ctx})
+        Regex.update_route(_id, ctx)
 
     @staticmethod
     async def get_by_id(_id: str, db: AsyncIOMotorCollection) -> object:
@@ -97,6 +100,7 @@ class Service:
         @param db: mongo collection instance
         """
         await db.delete_one({'_id': bson.ObjectId(_id)})
+        Regex.remove_route(_id)
 
     @staticmethod
     async def add_target(_id: str, target: str, db: AsyncIOMotorCollection):
@@ -108,6 +112,7 @@ class Service:
         @param db: mongo collection instance
         """
         await db.update_one({'_id': bson.ObjectId(_id)}, {'$push': {'targets': target}})
+        Regex.invalidate()
 
     @staticmethod
     async def remove_target(_id: str, target: str, db: AsyncIOMotorCollection):
@@ -119,6 +124,7 @@ class Service:
         @param db: mongo collection instance
         """
         await db.update_one({'_id': bson.ObjectId(_id)}, {'$pull': {'targets': target}})
+        Regex.invalidate()
 
     @staticmethod
     async def advance_target(_id: str, db: AsyncIOMotorCollection):
@@ -148,6 +154,7 @@ class Service:
         @param db: mongo collection instance
         """
         await db.update_one({'_id': bson.ObjectId(_id)}, {'$push': {'whitelisted_hosts': host}})
+        Regex.invalidate()
 
     @staticmethod
     async def remove_whitelist(_id: str, host: str, db: AsyncIOMotorCollection):
@@ -160,6 +167,7 @@ class Service:
         @param db: mongo collection instance
         """
         await db.update_one({'_id': bson.ObjectId(_id)}, {'$pull': {'whitelisted_hosts': host}})
+        Regex.invalidate()
 
     @staticmethod
     async def add_blacklist(_id: str, host: str, db: AsyncIOMotorCollection):
@@ -172,6 +180,7 @@ class Service:
         """
 
         await db.update_one({'_id': bson.ObjectId(_id)}, {'$push': {'blacklisted_hosts': host}})
+        Regex.invalidate()
 
     @staticmethod
     async def remove_blacklist(_id: str, host: str, db: AsyncIOMotorCollection):
@@ -183,6 +192,7 @@ class Service:
         @param db: mongo collection instance
         """
         await db.update_one({'_id': bson.ObjectId(_id)}, {'$pull': {'blacklisted_hosts': host}})
+        Regex.invalidate()
 
     @staticmethod
     async def check_exists(_id, db: AsyncIOMotorCollection):
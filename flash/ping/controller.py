@@ -1,4 +1,9 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
+
+from flash.common.error_code import ERROR_SERVER
+from flash.common.resp import resp_error_json, resp_success_json
+from flash.config.config import check_database
+from flash.util.queue import Background
 
 router = APIRouter()
 
@@ -6,3 +11,19 @@ router = APIRouter()
 @router.get('/ping')
 async def ping():
     return {'ping': 'pong'}
+
+
+@router.get('/health')
+async def health(request: Request):
+    status = await check_database(request.app)
+    if not all(status.values()):
+        return resp_error_json(ERROR_SERVER, msg='unhealthy', data=status, status_code=503)
+    return resp_success_json(data=status)
+
+
+@router.get('/background')
+async def background():
+    try:
+        return resp_success_json(data=Background.stats())
+    except Exception as err:
+        return resp_error_json(ERROR_SERVER, msg=str(err))
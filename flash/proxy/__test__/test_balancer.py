@@ -0,0 +1,76 @@
+from collections import Counter
+
+import pytest
+
+from flash.proxy.balancer import Balancer
+from flash.proxy.health import TargetHealth
+
+
+@pytest.fixture(autouse=True)
+def states(monkeypatch):
+    monkeypatch.setattr(Balancer, '_states', {})
+    monkeypatch.setattr(TargetHealth, '_targets', {})
+
+
+def build_service(load_balancer: str, **fields) -> dict:
+    return dict({'_id': 's1', 'targets': ['http://a', 'http://b', 'http://c'], 'load_balancer': load_balancer},
+                **fields)
+
+
+def test_round_robin_takes_targets_in_turn():
+    service = build_service('round_robin')
+    picks = [Balancer.pick(service) for _ in range(6)]
+    assert Counter(picks) == {'http://a': 2, 'http://b': 2, 'http://c': 2}
+    assert picks[:3] == picks[3:]
+
+
+def test_smooth_weighted_round_robin_spreads_heavy_targets():
+    service = build_service('weighted_round_robin', target_weights=[5, 1, 1])
+    picks = [Balancer.pick(service) for _ in range(7)]
+    assert Counter(picks) == {'http://a': 5, 'http://b': 1, 'http://c': 1}
+    # the heavy target is not picked five times in a row
+    assert picks[:5] != ['http://a'] * 5
+
+
+def test_weight_zero_drains_a_target():
+    service = build_service('weighted_round_robin', target_weights=[1, 0, 1])
+    assert 'http://b' not in {Balancer.pick(service) for _ in range(10)}
+
+
+def test_least_outstanding():
+    service = build_service('least_outstanding')
+    Balancer.acquire(service, 'http://a')
+    Balancer.acquire(service, 'http://b')
+    assert Balancer.pick(service) == 'http://c'
+    Balancer.acquire(service, 'http://c')
+    Balancer.acquire(service, 'http://c')
+    Balancer.release(service, 'http://a')
+    assert Balancer.pick(service) == 'http://a'
+
+
+def test_p2c_ewma_prefers_the_faster_target():
+    service = build_service('p2c_ewma', targets=['http://a', 'http://b'])
+    for _ in range(5):
+        TargetHealth.record(service, 'http://a', False, 0.5)
+        TargetHealth.record(service, 'http://b', False, 0.05)
+    assert {Balancer.pick(service) for _ in range(20)} == {'http://b'}
+
+
+def test_consistent_hash_moves_few_keys_when_a_target_is_added():
+    service = build_service('consistent_hash')
+    before = {key: Balancer.pick(service, key) for key in map(str, range(1000))}
+    assert before == {key: Balancer.pick(service, key) for key in before}
+    grown = dict(service, targets=service['targets'] + ['http://d'])
+    after = {key: Balancer.pick(grown, key) for key in before}
+    moved = [key for key in before if before[key] != after[key]]
+    assert all(after[key] == 'http://d' for key in moved)
+    assert len(moved) < 500
+
+
+@pytest.mark.parametrize('load_balancer', ['round_robin', 'weighted_round_robin', 'least_outstanding', 'p2c_ewma',
+                                           'consistent_hash'])
+def test_ejected_targets_are_skipped(load_balancer):
+    service = build_service(load_balancer, outlier_consecutive_errors=1)
+    TargetHealth.record(service, 'http://a', True, 0.1)
+    assert TargetHealth.is_ejected(service, 'http://a')
+    assert 'http://a' not in {Balancer.pick(service, str(key)) for key in range(50)}
@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+from flash.proxy import breaker as breaker_module
+from flash.proxy.breaker import Breaker
+
+fakeredis = pytest.importorskip('fakeredis.aioredis')
+pytest.importorskip('lupa')
+
+
+@pytest.fixture(autouse=True)
+def states(monkeypatch):
+    monkeypatch.setattr(Breaker, '_states', {})
+    monkeypatch.setattr(breaker_module, 'CIRCUIT_BREAKER_SYNC', 0)
+
+
+def build_breaker(**fields) -> dict:
+    return dict({'_id': 'b1', 'cooldown': 1, 'period': 60, 'threshold': 0.5, 'min_requests': 4,
+                 'half_open_probes': 2, 'status_codes': [500]}, **fields)
+
+
+def test_trips_once_the_failure_rate_is_reached():
+    async def run():
+        db = fakeredis.FakeRedis(decode_responses=True)
+        breaker = build_breaker()
+        tripped = [await Breaker.record(breaker, failed, False, db) for failed in [False, True, True, True]]
+        return tripped, await Breaker.allow(breaker, db)
+
+    tripped, (allowed, probe, retry_after) = asyncio.run(run())
+    assert tripped == [False, False, False, True]
+    assert not allowed and not probe
+    assert 0 < retry_after <= 1000
+
+
+def test_needs_min_requests():
+    async def run():
+        db = fakeredis.FakeRedis(decode_responses=True)
+        breaker = build_breaker()
+        return [await Breaker.record(breaker, True, False, db) for _ in range(3)]
+
+    assert asyncio.run(run()) == [False, False, False]
+
+
+def test_min_requests_defaults_to_the_schema_default():
+    async def run():
+        db = fakeredis.FakeRedis(decode_responses=True)
+        breaker = build_breaker(min_requests=None)
+        return [await Breaker.record(breaker, True, False, db) for _ in range(10)]
+
+    assert asyncio.run(run()) == [False] * 9 + [True]
+
+
+def test_other_workers_see_the_trip():
+    async def run():
+        db = fakeredis.FakeRedis(decode_responses=True)
+        breaker = build_breaker()
+        for _ in range(4):
+            await Breaker.record(breaker, True, False, db)
+        # a fresh worker only has the shared state
+        Breaker._states = {}
+        return await Breaker.allow(breaker, db)
+
+    allowed, _, _ = asyncio.run(run())
+    assert not allowed
+
+
+def test_half_open_probes_close_the_breaker():
+    async def run():
+        db = fakeredis.FakeRedis(decode_responses=True)
+        breaker = build_breaker()
+        for _ in range(4):
+            await Breaker.record(breaker, True, False, db)
+        await asyncio.sleep(1.05)
+        probes = [await Breaker.allow(breaker, db) for _ in range(3)]
+        for _ in range(2):
+            await Breaker.record(breaker, False, True, db)
+        return probes, await Breaker.allow(breaker, db), await db.exists('b1.state')
+
+    probes, after, shared = asyncio.run(run())
+    # at most half_open_probes requests are let through at a time
+    assert [(allowed, probe) for allowed, probe, _ in probes] == [(True, True), (True, True), (False, False)]
+    assert after == (True, False, 0)
+    assert shared == 0
+
+
+def test_failed_probe_opens_the_breaker_again():
+    async def run():
+        db = fakeredis.FakeRedis(decode_responses=True)
+        breaker = build_breaker()
+        for _ in range(4):
+            await Breaker.record(breaker, True, False, db)
+        await asyncio.sleep(1.05)
+        probe = await Breaker.allow(breaker, db)
+        await Breaker.record(breaker, True, True, db)
+        return probe, await Breaker.allow(breaker, db), await db.hget('b1.state', 'state')
+
+    probe, after, state = asyncio.run(run())
+    assert probe[:2] == (True, True)
+    assert not after[0]
+    assert state == 'open'
+
+
+def test_released_probe_is_given_back():
+    async def run():
+        db = fakeredis.FakeRedis(decode_responses=True)
+        breaker = build_breaker(half_open_probes=1)
+        for _ in range(4):
+            await Breaker.record(breaker, True, False, db)
+        await asyncio.sleep(1.05)
+        first = await Breaker.allow(breaker, db)
+        await Breaker.release(breaker, db)
+        return first, await Breaker.allow(breaker, db)
+
+    first, second = asyncio.run(run())
+    assert first[:2] == (True, True)
+    assert second[:2] == (True, True)
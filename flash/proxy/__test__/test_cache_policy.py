@@ -0,0 +1,55 @@
+from flash.proxy.cache_policy import CachePolicy
+
+cacher = {'_id': 'c1', 'timeout': 60, 'key_headers': 'Accept-Language', 'key_query': ''}
+
+
+def test_key_ignores_query_order_and_unlisted_headers():
+    first = CachePolicy.key(cacher, 'GET', '/items', {'a': '1', 'b': '2'}, {'X-Request-Id': '1'}, b'')
+    second = CachePolicy.key(cacher, 'get', '/items', {'b': '2', 'a': '1'}, {'X-Request-Id': '2'}, b'')
+    assert first == second
+    assert first.startswith('endpoint_cache:c1:')
+
+
+def test_key_varies_by_key_headers_and_body():
+    english = CachePolicy.key(cacher, 'GET', '/items', {}, {'Accept-Language': 'en'}, b'')
+    german = CachePolicy.key(cacher, 'GET', '/items', {}, {'accept-language': 'de'}, b'')
+    assert english != german
+    first = CachePolicy.key(cacher, 'POST', '/search', {}, {}, b'{"q":1}')
+    second = CachePolicy.key(cacher, 'POST', '/search', {}, {}, b'{"q":2}')
+    assert first != second
+
+
+def test_key_query_limits_the_query():
+    limited = dict(cacher, key_query='page')
+    first = CachePolicy.key(limited, 'GET', '/items', {'page': '1', 'utm': 'a'}, {}, b'')
+    second = CachePolicy.key(limited, 'GET', '/items', {'page': '1', 'utm': 'b'}, {}, b'')
+    assert first == second
+
+
+def test_request_cache_control():
+    assert CachePolicy.is_cacheable_request({})
+    assert not CachePolicy.is_cacheable_request({'cache-control': 'no-cache'})
+    assert not CachePolicy.is_cacheable_request({'cache-control': 'no-store'})
+
+
+def test_ttl():
+    assert CachePolicy.ttl(cacher, {}, 200, []) == 60
+    assert CachePolicy.ttl(cacher, {}, 200, [('Cache-Control', 'max-age=10')]) == 10
+    assert CachePolicy.ttl(cacher, {}, 500, []) == 0
+    assert CachePolicy.ttl(dict(cacher, response_codes=[500]), {}, 500, []) == 60
+    assert CachePolicy.ttl(cacher, {}, 200, [('Cache-Control', 'private')]) == 0
+    assert CachePolicy.ttl(cacher, {}, 200, [('Cache-Control', 'no-store')]) == 0
+
+
+def test_ttl_refuses_vary_outside_key_headers():
+    assert CachePolicy.ttl(cacher, {}, 200, [('Vary', 'Accept-Language')]) == 60
+    assert CachePolicy.ttl(cacher, {}, 200, [('Vary', 'Accept-Encoding')]) == 0
+    assert CachePolicy.ttl(cacher, {}, 200, [('Vary', '*')]) == 0
+
+
+def test_ttl_of_requests_with_credentials():
+    assert CachePolicy.ttl(cacher, {'Authorization': 'Bearer t'}, 200, []) == 0
+    assert CachePolicy.ttl(cacher, {'Authorization': 'Bearer t'}, 200, [('Cache-Control', 's-maxage=30')]) == 30
+    assert CachePolicy.ttl(cacher, {'Cookie': 'session=1'}, 200, []) == 0
+    assert CachePolicy.ttl(cacher, {'Cookie': 'session=1'}, 200, [('Cache-Control', 'public')]) == 60
+    assert CachePolicy.ttl(dict(cacher, key_headers='Cookie'), {'Cookie': 'session=1'}, 200, []) == 60
@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+from flash.proxy.health import TargetHealth
+
+
+@pytest.fixture(autouse=True)
+def targets(monkeypatch):
+    monkeypatch.setattr(TargetHealth, '_targets', {})
+
+
+def build_service(**fields) -> dict:
+    return dict({'_id': 's1', 'targets': ['http://a', 'http://b', 'http://c', 'http://d'],
+                 'outlier_consecutive_errors': 3, 'outlier_base_ejection': 10, 'outlier_max_ejection': 25}, **fields)
+
+
+def test_consecutive_errors_eject_a_target():
+    service = build_service()
+    assert [TargetHealth.record(service, 'http://a', True, 0.1) for _ in range(3)] == [False, False, True]
+    assert TargetHealth.is_ejected(service, 'http://a')
+    assert not TargetHealth.is_ejected(service, 'http://b')
+
+
+def test_success_resets_the_error_count():
+    service = build_service()
+    for failed in [True, True, False, True, True]:
+        TargetHealth.record(service, 'http://a', failed, 0.1)
+    assert not TargetHealth.is_ejected(service, 'http://a')
+
+
+def test_ejection_backs_off_exponentially_up_to_the_max():
+    service = build_service()
+    durations = []
+    for _ in range(3):
+        TargetHealth._state(service, 'http://a')['ejected_until'] = 0
+        for _ in range(3):
+            TargetHealth.record(service, 'http://a', True, 0.1)
+        durations.append(round(TargetHealth._targets[('s1', 'http://a')]['ejected_until'] - time.monotonic()))
+    assert durations == [10, 20, 25]
+
+
+def test_max_ejection_percent_keeps_capacity():
+    service = build_service()
+    for target in ['http://a', 'http://b', 'http://c']:
+        for _ in range(3):
+            TargetHealth.record(service, target, True, 0.1)
+    ejected = [target for target in service['targets'] if TargetHealth.is_ejected(service, target)]
+    assert ejected == ['http://a', 'http://b']
+
+
+def test_latency_outlier_is_ejected():
+    service = build_service(outlier_latency_factor=3)
+    for target in ['http://b', 'http://c', 'http://d']:
+        for _ in range(10):
+            TargetHealth.record(service, target, False, 0.05)
+    ejected = [TargetHealth.record(service, 'http://a', False, 0.5) for _ in range(10)]
+    assert ejected[-1]
+    assert TargetHealth.is_ejected(service, 'http://a')
+
+
+def test_failed_active_check_ejects_until_a_check_passes():
+    service = build_service()
+    TargetHealth._state(service, 'http://a')['active'] = True
+    assert TargetHealth.is_ejected(service, 'http://a')
+    TargetHealth._state(service, 'http://a')['active'] = False
+    assert not TargetHealth.is_ejected(service, 'http://a')
@@ -0,0 +1,91 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from flash.proxy import insights_writer
+from flash.proxy.insights_writer import InsightsWriter
+
+
+class Collection:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.batches = []
+
+    async def insert_many(self, documents: list, ordered: bool = True):
+        if self.fail:
+            raise ConnectionError('mongo is gone')
+        assert not ordered
+        self.batches.append(documents)
+        return SimpleNamespace(inserted_ids=list(range(len(documents))))
+
+
+@pytest.fixture(autouse=True)
+def writer(monkeypatch):
+    monkeypatch.setattr(InsightsWriter, '_db', None)
+    monkeypatch.setattr(InsightsWriter, '_rollup_db', None)
+    monkeypatch.setattr(InsightsWriter, '_buffer', [])
+    monkeypatch.setattr(InsightsWriter, '_rollups', {})
+    monkeypatch.setattr(InsightsWriter, '_flusher', None)
+    monkeypatch.setattr(InsightsWriter, '_wakeup', None)
+    monkeypatch.setattr(InsightsWriter, '_options', dict(insights_writer._default_options))
+    monkeypatch.setattr(InsightsWriter, '_stats', {'written': 0, 'failed': 0, 'dropped': 0})
+
+
+def insight(status_code: int = 200) -> dict:
+    return {
+        'service_id': 's1',
+        'route': '/users',
+        'path': '/users/1',
+        'status_code': status_code,
+        'elapsed_time': 1000,
+        'cache': False,
+        'created_at': datetime(2024, 1, 1, 12, 0, 30),
+    }
+
+
+def test_flush_writes_compact_insights_in_one_call():
+    db = Collection()
+    InsightsWriter._db = db
+    for _ in range(3):
+        assert InsightsWriter.record(insight())
+    asyncio.run(InsightsWriter.flush())
+    assert len(db.batches) == 1
+    assert db.batches[0][0]['s'] == 's1' and db.batches[0][0]['st'] == 200
+    assert InsightsWriter.stats() == {'written': 3, 'failed': 0, 'dropped': 0, 'depth': 0}
+
+
+def test_full_batches_are_written_without_waiting_for_the_interval():
+    db = Collection()
+
+    async def run():
+        InsightsWriter.start(db, None, batch_size=2, flush_interval=60)
+        for _ in range(3):
+            InsightsWriter.record(insight())
+        await asyncio.sleep(0.05)
+        flushed = [len(batch) for batch in db.batches]
+        await InsightsWriter.stop()
+        return flushed
+
+    flushed = asyncio.run(run())
+    assert flushed == [2]
+    # stop writes what is left
+    assert [len(batch) for batch in db.batches] == [2, 1]
+
+
+def test_full_buffer_drops_records_but_still_counts_them():
+    InsightsWriter._options['buffer_size'] = 2
+    assert [InsightsWriter.record(insight()) for _ in range(3)] == [True, True, False]
+    assert InsightsWriter.stats()['dropped'] == 1
+    assert InsightsWriter.stats()['depth'] == 2
+    rollup, = InsightsWriter._rollups.values()
+    assert rollup['count'] == 3
+
+
+def test_failed_flush_is_counted():
+    InsightsWriter._db = Collection(fail=True)
+    InsightsWriter.record(insight())
+    with pytest.raises(ConnectionError):
+        asyncio.run(InsightsWriter.flush())
+    assert InsightsWriter.stats()['failed'] == 1
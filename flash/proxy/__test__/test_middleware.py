@@ -0,0 +1,492 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import jwt
+import pytest
+from aiohttp import web
+from fastapi import Request
+
+from flash.models.endpoint_cacher import EndpointCacher
+from flash.models.rate_limiter import RateLimiter
+from flash.proxy import middleware
+from flash.proxy.balancer import Balancer
+from flash.proxy.breaker import Breaker
+from flash.proxy.health import TargetHealth
+from flash.proxy.insights_writer import InsightsWriter
+from flash.proxy.policy import Policy
+from flash.proxy.warmup import Warmup
+from flash.util.cache import TTLCache, LRUCache
+from flash.util.regex import Regex
+from flash.util import token
+from flash.util.http import Http
+from flash.util.router import Router
+from flash.util.singleflight import SingleFlight
+
+fakeredis = pytest.importorskip('fakeredis.aioredis')
+FakeServer = pytest.importorskip('fakeredis').FakeServer
+pytest.importorskip('lupa')
+
+
+class Cursor:
+    """
+    mongo cursor over the documents matching every field of a query
+    """
+
+    def __init__(self, documents: list, query: dict):
+        self.documents = [document for document in documents
+                          if all(document.get(field) == value for field, value in query.items())]
+
+    async def __aiter__(self):
+        for document in self.documents:
+            yield document
+
+    async def to_list(self, length: int):
+        return self.documents[:length]
+
+
+class Collection:
+    def __init__(self, documents: list = None):
+        self.documents = documents or []
+
+    def find(self, query: dict, *args):
+        return Cursor(self.documents, query)
+
+
+@pytest.fixture(autouse=True)
+def state(monkeypatch):
+    monkeypatch.setattr(Regex, '_routes', Router())
+    monkeypatch.setattr(Regex, '_loaded_at', None)
+    monkeypatch.setattr(Regex, '_lock', None)
+    monkeypatch.setattr(Policy, '_cache', TTLCache(60, 100))
+    monkeypatch.setattr(Balancer, '_states', {})
+    monkeypatch.setattr(Breaker, '_states', {})
+    monkeypatch.setattr(TargetHealth, '_targets', {})
+    monkeypatch.setattr(InsightsWriter, '_buffer', [])
+    monkeypatch.setattr(InsightsWriter, '_rollups', {})
+    monkeypatch.setattr(EndpointCacher, '_local', LRUCache(100, 1 << 20))
+    monkeypatch.setattr(EndpointCacher, '_counts', {})
+    monkeypatch.setattr(Warmup, '_seen', {})
+    monkeypatch.setattr(middleware, 'cache_fills', SingleFlight())
+
+
+def build_service(**fields) -> dict:
+    return dict({
+        '_id': 's1',
+        'path': r'/users/(\w+)',
+        'state': 'UP',
+        'targets': ['http://127.0.0.1:9'],
+        'cur_target_index': 0,
+        'whitelisted_hosts': [],
+        'blacklisted_hosts': [],
+    }, **fields)
+
+
+def seed_policy(service_id: str = 's1', **policy):
+    # the snapshot the proxy would otherwise load from redis and mongo
+    Policy._cache.set(service_id, dict({'rule': None, 'breaker': None, 'validator': None, 'cacher': None}, **policy))
+
+
+def build_app(services: list = None, redis=None):
+    server = FakeServer()
+    return SimpleNamespace(state=SimpleNamespace(
+        mongo={'service': Collection(services), 'circuit_breaker': Collection(), 'request_validator': Collection(),
+               'event': Collection()},
+        redis=redis or fakeredis.FakeRedis(server=server, decode_responses=True),
+        redis_bytes=fakeredis.FakeRedis(server=server),
+    ))
+
+
+def build_request(app, path: str = '/users/1', method: str = 'GET', headers: dict = None) -> Request:
+    scope = {
+        'type': 'http',
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode('utf-8'),
+        'query_string': b'',
+        'headers': [(key.lower().encode('latin-1'), value.encode('latin-1'))
+                    for key, value in (headers or {}).items()],
+        'client': ('10.0.0.1', 50000),
+        'server': ('gateway', 80),
+        'app': app,
+    }
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    return Request(scope, receive)
+
+
+async def start_upstream(handlers: dict) -> tuple:
+    """
+    serves handlers on a local port
+
+    @param handlers: (dict) path to aiohttp handler
+    @returns: (runner to clean up, base url)
+    """
+    upstream = web.Application()
+    for path, handler in handlers.items():
+        upstream.router.add_route('*', path, handler)
+    runner = web.AppRunner(upstream)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    return runner, f'http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}'
+
+
+def with_upstream(handlers: dict, test):
+    """
+    runs a test coroutine with a local upstream and the shared http session
+
+    @param handlers: (dict) path to aiohttp handler
+    @param test: coroutine function taking the upstream base url
+    """
+    async def run():
+        runner, base = await start_upstream(handlers)
+        await Http.start()
+        try:
+            return await test(base)
+        finally:
+            await Http.close()
+            await runner.cleanup()
+
+    return asyncio.run(run())
+
+
+async def send_response(response) -> tuple:
+    """
+    runs a response like the server would
+
+    @returns: (status, headers, body)
+    """
+    messages = []
+
+    async def receive():
+        # the client stays connected
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    await response({'type': 'http', 'method': 'GET'}, receive, send)
+    start = messages[0]
+    body = b''.join(message.get('body', b'') for message in messages[1:])
+    return start['status'], {key.decode('latin-1'): value.decode('latin-1') for key, value in start['headers']}, body
+
+
+async def call_next(request):
+    raise AssertionError('admin routes are not proxied')
+
+
+async def proxy(app, **kwargs) -> tuple:
+    return await send_response(await middleware.proxy(build_request(app, **kwargs), call_next))
+
+
+def test_refusals_keep_their_status_and_tell_when_to_retry():
+    response = middleware.build_error_response(Exception({
+        'message': 'Too Many Requests',
+        'status_code': 429,
+        'retry_after': 1500,
+    }))
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '2'
+    assert json.loads(response.body)['code'] == 429
+
+
+def test_other_errors_have_no_retry_after():
+    response = middleware.build_error_response(Exception({'message': 'Not found', 'status_code': 404}))
+    assert 'Retry-After' not in response.headers
+    assert json.loads(response.body)['msg']
+
+
+def test_rate_limited_requests_get_429_with_retry_after():
+    async def run():
+        app = build_app([build_service()])
+        await RateLimiter.create_rule({'service_id': 's1', 'max_requests': 0, 'timeout': 60, 'key_by': 'rule'},
+                                      app.state.redis)
+        return await proxy(app)
+
+    status, headers, body = asyncio.run(run())
+    assert status == 429
+    assert 1 <= int(headers['retry-after']) <= 60
+    assert json.loads(body)['msg'] == 'Too Many Requests'
+
+
+def test_a_down_service_is_refused_before_the_rate_limiter():
+    async def run():
+        app = build_app([build_service(state='DOWN')])
+        await RateLimiter.create_rule({'service_id': 's1', 'max_requests': 1, 'timeout': 60, 'key_by': 'rule'},
+                                      app.state.redis)
+        responses = [await proxy(app) for _ in range(2)]
+        rule = (await RateLimiter.get_rule_by_service_id('s1', app.state.redis))[0]
+        return responses, await app.state.redis.exists(RateLimiter.counter_key(rule['_id']))
+
+    responses, counted = asyncio.run(run())
+    assert all('Service is currently DOWN' in json.loads(body)['msg'] for _, _, body in responses)
+    # refused requests do not spend the budget of the rule
+    assert not counted
+
+
+@pytest.mark.parametrize('rule, headers, expected', [
+    ({'key_by': 'rule'}, {}, None),
+    ({'key_by': 'remote_ip'}, {}, '10.0.0.1'),
+    ({'key_by': 'header', 'key_name': 'X-Api-Key'}, {'X-Api-Key': 'k1'}, 'k1'),
+    # a missing key falls back to the remote ip
+    ({'key_by': 'header', 'key_name': 'X-Api-Key'}, {}, '10.0.0.1'),
+    ({'key_by': 'path_group', 'key_name': '0'}, {}, 'alice'),
+])
+def test_rate_limiter_key(rule, headers, expected):
+    request = build_request(build_app(), path='/users/alice', headers=headers)
+    key = middleware.get_rate_limiter_key(request, build_service(regex_groups=('alice',)), rule)
+    assert key == (expected if expected in [None, '10.0.0.1'] else middleware.Hasher.hash_sha_256(expected))
+
+
+def test_rate_limiter_key_uses_verified_jwt_claims_only(monkeypatch):
+    monkeypatch.setattr(token, 'JWT_SECRET', 'secret')
+    rule = {'key_by': 'jwt_claim', 'key_name': 'sub'}
+    signed = jwt.encode({'sub': 'alice'}, 'secret', algorithm='HS256')
+    forged = jwt.encode({'sub': 'alice'}, 'other', algorithm='HS256')
+    app = build_app()
+    assert middleware.get_rate_limiter_key(build_request(app, headers={'Authorization': f'Bearer {signed}'}),
+                                           build_service(), rule) == middleware.Hasher.hash_sha_256('alice')
+    assert middleware.get_rate_limiter_key(build_request(app, headers={'Authorization': f'Bearer {forged}'}),
+                                           build_service(), rule) == '10.0.0.1'
+
+
+def test_clients_are_limited_apart():
+    rule = {'_id': 'r1', 'max_requests': 1, 'timeout': 60, 'key_by': 'header', 'key_name': 'X-Api-Key'}
+
+    async def run():
+        app = build_app()
+        refused = []
+        for key in ['a', 'b', 'a']:
+            try:
+                await middleware.handle_rate_limiter(build_request(app, headers={'X-Api-Key': key}),
+                                                     build_service(), rule)
+            except Exception as err:
+                refused.append((key, err.args[0]['status_code']))
+        return refused
+
+    # every client has its own budget
+    assert asyncio.run(run()) == [('a', 429)]
+
+
+def test_upstream_responses_are_streamed_through():
+    body = b'x' * (1 << 20)
+
+    async def users(request):
+        response = web.StreamResponse(headers={'X-Upstream': '1', 'Content-Type': 'application/octet-stream'})
+        await response.prepare(request)
+        for offset in range(0, len(body), 65536):
+            await response.write(body[offset:offset + 65536])
+        await response.write_eof()
+        return response
+
+    async def test(base):
+        # a target is the url requests are sent to
+        return await proxy(build_app([build_service(targets=[f'{base}/users/1'])]))
+
+    status, headers, received = with_upstream({'/users/1': users}, test)
+    assert status == 200
+    assert received == body
+    assert headers['x-upstream'] == '1'
+    # hop by hop headers of the upstream are not passed on
+    assert 'transfer-encoding' not in headers
+
+
+def test_failed_upstream_calls_are_refused():
+    async def test(base):
+        # nothing listens on the target
+        return await proxy(build_app([build_service(targets=['http://127.0.0.1:9'])]))
+
+    status, _, body = with_upstream({}, test)
+    assert json.loads(body)['code'] == 500
+
+
+def build_cacher(**fields) -> dict:
+    return dict({'_id': 'c1', 'service_id': 's1', 'timeout': 60}, **fields)
+
+
+def counting_upstream(calls: list, body: bytes = b'hello', delay: float = 0.1, status: int = 200, **headers):
+    async def handler(request):
+        calls.append(request.path)
+        await asyncio.sleep(delay)
+        return web.Response(body=body, status=status, content_type='text/plain', headers=headers)
+
+    return handler
+
+
+def test_concurrent_misses_share_one_upstream_call():
+    calls = []
+
+    async def test(base):
+        app = build_app([build_service(targets=[f'{base}/users/1'])])
+        seed_policy(cacher=build_cacher())
+        misses = await asyncio.gather(*[proxy(app) for _ in range(5)])
+        return misses, await proxy(app)
+
+    misses, hit = with_upstream({'/users/1': counting_upstream(calls, **{'Cache-Control': 'max-age=60'})}, test)
+    assert len(calls) == 1
+    assert [body for _, _, body in misses] == [b'hello'] * 5
+    assert hit[2] == b'hello'
+
+
+def test_uncacheable_responses_are_not_shared():
+    calls = []
+
+    async def test(base):
+        app = build_app([build_service(targets=[f'{base}/users/1'])])
+        seed_policy(cacher=build_cacher())
+        return await asyncio.gather(*[proxy(app) for _ in range(3)])
+
+    responses = with_upstream({'/users/1': counting_upstream(calls, **{'Cache-Control': 'no-store'})}, test)
+    # followers make their own call once the leader's response turns out to be private
+    assert len(calls) == 3
+    assert [body for _, _, body in responses] == [b'hello'] * 3
+
+
+def test_upstream_is_closed_when_the_client_is_gone():
+    closed = []
+
+    async def chunks():
+        yield b'never sent'
+
+    async def close():
+        closed.append(True)
+
+    async def run():
+        response = middleware.build_response({'status': 200, 'headers': [], 'stream': chunks(), 'close': close})
+
+        async def receive():
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            raise OSError('client is gone')
+
+        try:
+            await response({'type': 'http', 'method': 'GET'}, receive, send)
+        except OSError:
+            pass
+
+    asyncio.run(run())
+    assert closed == [True]
+
+
+async def seed_stale_cache(app, cacher: dict, body: bytes, **kwargs):
+    """
+    caches a response for a request that is already past its expiry
+    """
+    request = build_request(app, **kwargs)
+    req_ctx = middleware.get_request_ctx(request, build_service(), await request.body())
+    await EndpointCacher.write(middleware.get_request_hash(request, cacher, req_ctx), {
+        'status': 200,
+        'content_type': 'text/plain',
+        'headers': [('Content-Type', 'text/plain')],
+        'body': body,
+    }, 0, app.state.redis_bytes, EndpointCacher.stale_window(cacher))
+
+
+def test_stale_response_is_served_while_it_revalidates():
+    calls = []
+    cacher = build_cacher(stale_while_revalidate=30)
+
+    async def test(base):
+        app = build_app([build_service(targets=[f'{base}/users/1'])])
+        seed_policy(cacher=cacher)
+        await seed_stale_cache(app, cacher, b'old')
+        stale = await proxy(app)
+        await asyncio.gather(*middleware.revalidations)
+        return stale, await proxy(app)
+
+    stale, fresh = with_upstream({'/users/1': counting_upstream(calls, b'new', **{'Cache-Control': 'max-age=60'})},
+                                 test)
+    assert stale[2] == b'old'
+    assert fresh[2] == b'new'
+    assert len(calls) == 1
+
+
+def test_failed_revalidation_is_logged_and_keeps_the_stale_response(caplog):
+    cacher = build_cacher(stale_while_revalidate=30)
+
+    async def test(base):
+        app = build_app([build_service()])
+        seed_policy(cacher=cacher)
+        await seed_stale_cache(app, cacher, b'old')
+        stale = await proxy(app)
+        await asyncio.gather(*middleware.revalidations, return_exceptions=True)
+        await asyncio.sleep(0)
+        return stale, await proxy(app)
+
+    stale, again = with_upstream({}, test)
+    assert stale[2] == again[2] == b'old'
+    assert 'cache revalidation failed' in caplog.text
+
+
+def test_stale_response_is_served_when_the_upstream_errors():
+    calls = []
+    cacher = build_cacher(stale_if_error=30)
+
+    async def test(base):
+        target = f'{base}/users/1'
+        app = build_app([build_service(targets=[target])])
+        seed_policy(cacher=cacher)
+        await seed_stale_cache(app, cacher, b'old')
+        return await proxy(app), TargetHealth.stats(build_service(targets=[target]))[0]
+
+    (status, _, body), health = with_upstream({'/users/1': counting_upstream(calls, b'boom', 0, status=500)}, test)
+    assert (status, body) == (200, b'old')
+    assert len(calls) == 1
+    # the 5xx still counts against the target
+    assert health['consecutive_errors'] == 1
+
+
+def test_stale_response_is_served_when_the_upstream_is_unreachable():
+    cacher = build_cacher(stale_if_error=30)
+
+    async def test(base):
+        app = build_app([build_service()])
+        seed_policy(cacher=cacher)
+        await seed_stale_cache(app, cacher, b'old')
+        return await proxy(app)
+
+    status, _, body = with_upstream({}, test)
+    assert (status, body) == (200, b'old')
+
+
+def test_down_service_serves_stale_responses_only():
+    cacher = build_cacher(stale_if_error=30)
+
+    async def run():
+        app = build_app([build_service(state='DOWN')])
+        seed_policy(cacher=cacher)
+        await seed_stale_cache(app, cacher, b'old')
+        return await proxy(app), await proxy(app, path='/users/2')
+
+    (status, _, body), (_, _, refused) = asyncio.run(run())
+    assert (status, body) == (200, b'old')
+    assert b'Service is currently DOWN' in refused
+
+
+def test_tripped_breaker_refuses_with_retry_after(monkeypatch):
+    trips = []
+
+    async def put(func, *args):
+        trips.append(func)
+        return True
+
+    monkeypatch.setattr(middleware.Background, 'put', put)
+    breaker = {'_id': 'b1', 'status': 'ON', 'status_codes': [500], 'threshold': 0.5, 'period': 60, 'cooldown': 30,
+               'min_requests': 2, 'half_open_probes': 1}
+
+    async def test(base):
+        app = build_app([build_service()])
+        seed_policy(breaker=breaker)
+        return [await proxy(app) for _ in range(3)]
+
+    *failed, (status, headers, _) = with_upstream({}, test)
+    assert [json.loads(body)['code'] for _, _, body in failed] == [500, 500]
+    assert trips == [middleware.handle_circuit_breaker_trip]
+    assert status == 503
+    assert 29 <= int(headers['retry-after']) <= 30
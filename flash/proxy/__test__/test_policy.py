@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from flash.models.rate_limiter import RateLimiter
+from flash.proxy.policy import Policy
+from flash.util.cache import TTLCache
+
+fakeredis = pytest.importorskip('fakeredis.aioredis')
+
+
+class Collection:
+    """
+    mongo collection answering find by service_id with fixed documents
+    """
+
+    def __init__(self, documents: list):
+        self.documents = documents
+        self.finds = 0
+
+    def find(self, query: dict):
+        self.finds += 1
+        collection = self
+
+        class Cursor:
+            async def to_list(self, length: int):
+                return [document for document in collection.documents
+                        if document.get('service_id') == query.get('service_id')][:length]
+
+        return Cursor()
+
+
+@pytest.fixture(autouse=True)
+def cache(monkeypatch):
+    monkeypatch.setattr(Policy, '_cache', TTLCache(60, 100))
+
+
+def test_snapshot_is_loaded_once_per_service():
+    breakers = Collection([{'_id': 'b1', 'service_id': 's1'}])
+    validators = Collection([])
+    service = {'_id': 's1', 'path': '/users'}
+
+    async def run():
+        db = fakeredis.FakeRedis(decode_responses=True)
+        await RateLimiter.create_rule({'service_id': 's1', 'max_requests': 5, 'timeout': 60}, db)
+        first = await Policy.get(service, db, breakers, validators)
+        second = await Policy.get(dict(service, state='UP'), db, breakers, validators)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert breakers.finds == 1 and validators.finds == 1
+    assert first['rule']['service_id'] == 's1'
+    assert first['breaker']['_id'] == 'b1'
+    assert first['validator'] is None and first['cacher'] is None
+    # the snapshot carries the matched service of the request, not the cached one
+    assert second['service']['state'] == 'UP'
+
+
+def test_invalidate_reloads_the_snapshot():
+    breakers = Collection([])
+    validators = Collection([])
+
+    async def run():
+        db = fakeredis.FakeRedis(decode_responses=True)
+        await Policy.get({'_id': 's1'}, db, breakers, validators)
+        await Policy.get({'_id': 's2'}, db, breakers, validators)
+        Policy.invalidate('s1')
+        await Policy.get({'_id': 's1'}, db, breakers, validators)
+        await Policy.get({'_id': 's2'}, db, breakers, validators)
+        Policy.invalidate()
+        await Policy.get({'_id': 's2'}, db, breakers, validators)
+
+    asyncio.run(run())
+    assert breakers.finds == 4
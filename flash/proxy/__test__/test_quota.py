@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from flash.proxy.quota import LocalQuota
+from flash.rate_limiter.schema import rate_limit_rule_validator
+from flash.util.cache import TTLCache
+
+fakeredis = pytest.importorskip('fakeredis.aioredis')
+pytest.importorskip('lupa')
+
+
+@pytest.fixture(autouse=True)
+def leases(monkeypatch):
+    monkeypatch.setattr(LocalQuota, '_leases', TTLCache(3600, 1000))
+    monkeypatch.setattr(LocalQuota, '_pending', {})
+
+
+def test_is_enabled():
+    assert LocalQuota.is_enabled({'local_quota_slice': 5})
+    assert not LocalQuota.is_enabled({'local_quota_slice': 0})
+    assert not LocalQuota.is_enabled({})
+
+
+def test_is_enabled_only_for_fixed_window_rules():
+    # other algorithms keep their own counters, a slice of them cannot be leased
+    assert LocalQuota.is_enabled({'local_quota_slice': 5, 'algorithm': 'fixed_window'})
+    assert not LocalQuota.is_enabled({'local_quota_slice': 5, 'algorithm': 'token_bucket'})
+    assert not LocalQuota.is_enabled({'local_quota_slice': 5, 'algorithm': 'sliding_window_log'})
+
+
+def test_schema_only_accepts_slices_of_fixed_window_rules():
+    assert rate_limit_rule_validator.validate({'local_quota_slice': 5})
+    assert rate_limit_rule_validator.validate({'local_quota_slice': 5, 'algorithm': 'fixed_window'})
+    assert not rate_limit_rule_validator.validate({'local_quota_slice': 5, 'algorithm': 'token_bucket'})
+
+
+def test_workers_never_exceed_the_global_limit():
+    rule = {'_id': 'quota', 'max_requests': 10, 'timeout': 60, 'local_quota_slice': 4}
+
+    async def run():
+        db = fakeredis.FakeRedis(decode_responses=True)
+        allowed = 0
+        for _ in range(3):
+            # every worker starts with its own leases
+            LocalQuota._leases = TTLCache(3600, 1000)
+            for _ in range(6):
+                allowed += (await LocalQuota.hit(rule, None, db))[0]
+        return allowed, int(await db.get('rate_limiter:quota'))
+
+    allowed, leased = asyncio.run(run())
+    assert leased == 10
+    # the unused part of a worker's last lease is refused early, at most one slice
+    assert 10 - 4 <= allowed <= 10
+
+
+def test_concurrent_requests_share_one_renewal():
+    rule = {'_id': 'quota-concurrent', 'max_requests': 100, 'timeout': 60, 'local_quota_slice': 10}
+
+    async def run():
+        db = fakeredis.FakeRedis(decode_responses=True)
+        results = await asyncio.gather(*[LocalQuota.hit(rule, None, db) for _ in range(10)])
+        return results, int(await db.get('rate_limiter:quota-concurrent'))
+
+    results, leased = asyncio.run(run())
+    assert all(allowed for allowed, _, _ in results)
+    assert leased == 10
+
+
+def test_refusal_tells_when_to_retry():
+    rule = {'_id': 'quota-refused', 'max_requests': 2, 'timeout': 60, 'local_quota_slice': 2}
+
+    async def run():
+        db = fakeredis.FakeRedis(decode_responses=True)
+        return [await LocalQuota.hit(rule, None, db) for _ in range(3)]
+
+    results = asyncio.run(run())
+    assert [allowed for allowed, _, _ in results] == [True, True, False]
+    assert 0 < results[2][2] <= 60000
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from flash.proxy import warmup
+from flash.proxy.warmup import Warmup
+
+fakeredis = pytest.importorskip('fakeredis.aioredis')
+
+
+@pytest.fixture(autouse=True)
+def seen(monkeypatch):
+    monkeypatch.setattr(Warmup, '_seen', {})
+    monkeypatch.setattr(Warmup, '_seen_at', 0)
+
+
+def record(db, method: str = 'GET', headers: dict = None, path: str = '/items'):
+    Warmup.record({'_id': 'c1', 'key_headers': 'accept'}, method, path, {'page': '1'},
+                  headers or {'Accept': 'application/json', 'X-Trace': 'abc'}, db)
+
+
+def test_records_the_most_requested_contexts(monkeypatch):
+    monkeypatch.setattr(warmup, 'ENDPOINT_CACHE_STATS_SYNC', 3600)
+
+    async def run():
+        db = fakeredis.FakeRedis(decode_responses=True)
+        for _ in range(3):
+            record(db, path='/popular')
+        record(db, path='/rare')
+        await Warmup.flush(db)
+        return await Warmup.top('c1', 2, db)
+
+    top = asyncio.run(run())
+    assert [ctx['path'] for ctx in top] == ['/popular', '/rare']
+    # only the headers of the cache key are kept
+    assert top[0]['headers'] == [['accept', 'application/json']]
+    assert top[0]['params'] == [['page', '1']]
+
+
+def test_skips_unsafe_methods_and_credentials(monkeypatch):
+    monkeypatch.setattr(warmup, 'ENDPOINT_CACHE_STATS_SYNC', 3600)
+    record(None, method='POST')
+    record(None, headers={'Authorization': 'Bearer x'})
+    record(None, headers={'Cookie': 'session=1'})
+    assert Warmup._seen == {}
+
+
+def test_flushes_are_referenced_until_done(monkeypatch):
+    monkeypatch.setattr(warmup, 'ENDPOINT_CACHE_STATS_SYNC', 0)
+
+    async def run():
+        db = fakeredis.FakeRedis(decode_responses=True)
+        record(db)
+        flushes = set(warmup.warmup_flushes)
+        await asyncio.gather(*flushes)
+        return flushes, await Warmup.top('c1', 10, db)
+
+    flushes, top = asyncio.run(run())
+    assert len(flushes) == 1
+    assert not warmup.warmup_flushes
+    assert len(top) == 1
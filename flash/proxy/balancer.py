@@ -0,0 +1,186 @@
+import bisect
+import hashlib
+import random
+
+from flash.proxy.health import TargetHealth
+
+default_strategy = 'round_robin'
+# points of a target with weight 1 on the consistent hash ring
+ring_points = 100
+
+
+class Balancer:
+    """
+    picks the target of a service a request is sent to, in memory per worker
+
+    strategies:
+    - round_robin: targets in turn
+    - weighted_round_robin: smooth weighted round robin over target_weights,
+      spreading the turns of a heavy target instead of sending them in a row
+    - least_outstanding: target with the fewest requests waiting for headers
+    - p2c_ewma: the better of two random targets, by average latency times
+      requests waiting
+    - consistent_hash: a ring of target points, weighted by target_weights, so
+      requests with the same key keep their target while the targets change little
+
+    ejected targets are skipped by every strategy. target_weights lines up with
+    targets, a missing weight is 1 and a weight of 0 takes a target out of rotation.
+    the event loop is single threaded, so the counters need no locking
+    """
+    _states = {}
+
+    @staticmethod
+    def _state(service: object) -> dict:
+        _id = str(service['_id'])
+        targets = tuple(service.get('targets') or [])
+        weights = tuple(service.get('target_weights') or [])
+        state = Balancer._states.get(_id)
+        if state is None or state['targets'] != targets or state['weights'] != weights:
+            # counters of targets still in the service are kept
+            outstanding = state['outstanding'] if state is not None else {}
+            state = Balancer._states[_id] = {
+                'targets': targets,
+                'weights': weights,
+                'turn': 0,
+                'current': {},
+                'ring': None,
+                'outstanding': {target: outstanding.get(target, 0) for target in targets},
+            }
+        return state
+
+    @staticmethod
+    def weight(service: object, index: int) -> int:
+        """
+        gets the weight of a target
+
+        @param service: (dict) service
+        @param index: (int) index of target
+        """
+        weights = service.get('target_weights') or []
+        return int(weights[index]) if index < len(weights) and weights[index] is not None else 1
+
+    @staticmethod
+    def _candidates(service: object) -> list:
+        # (target, weight) pairs in rotation, all weighted targets when every one is ejected
+        weighted = [(target, Balancer.weight(service, index)) for index, target in enumerate(service['targets'])]
+        weighted = [(target, weight) for target, weight in weighted if weight > 0] or \
+            [(target, 1) for target in service['targets']]
+        healthy = [(target, weight) for target, weight in weighted if not TargetHealth.is_ejected(service, target)]
+        return healthy or weighted
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+    @staticmethod
+    def _ring(service: object, state: dict) -> tuple:
+        if state['ring'] is None:
+            points = []
+            for index, target in enumerate(service['targets']):
+                for point in range(ring_points * Balancer.weight(service, index)):
+                    points.append((Balancer._hash(f'{target}#{point}'), target))
+            points.sort()
+            state['ring'] = ([point for point, _ in points], [target for _, target in points])
+        return state['ring']
+
+    @staticmethod
+    def _round_robin(state: dict, candidates: list) -> str:
+        state['turn'] += 1
+        return candidates[state['turn'] % len(candidates)][0]
+
+    @staticmethod
+    def _weighted_round_robin(state: dict, candidates: list) -> str:
+        current = state['current']
+        total = 0
+        best = None
+        for target, weight in candidates:
+            current[target] = current.get(target, 0) + weight
+            total += weight
+            if best is None or current[target] > current[best]:
+                best = target
+        current[best] -= total
+        return best
+
+    @staticmethod
+    def _least_outstanding(state: dict, candidates: list) -> str:
+        outstanding = state['outstanding']
+        least = min(outstanding.get(target, 0) for target, _ in candidates)
+        return random.choice([target for target, _ in candidates if outstanding.get(target, 0) == least])
+
+    @staticmethod
+    def _p2c_ewma(service: object, state: dict, candidates: list) -> str:
+        if len(candidates) == 1:
+            return candidates[0][0]
+        (first, _), (second, _) = random.sample(candidates, 2)
+
+        def cost(target: str) -> float:
+            # targets without a latency yet are tried first
+            return (TargetHealth.latency(service, target) or 0) * (state['outstanding'].get(target, 0) + 1)
+
+        return first if cost(first) <= cost(second) else second
+
+    @staticmethod
+    def _consistent_hash(service: object, state: dict, candidates: list, key: str) -> str:
+        if key is None:
+            return Balancer._round_robin(state, candidates)
+        points, targets = Balancer._ring(service, state)
+        allowed = {target for target, _ in candidates}
+        start = bisect.bisect(points, Balancer._hash(key))
+        # the next point clockwise whose target is in rotation
+        for offset in range(len(points)):
+            target = targets[(start + offset) % len(points)]
+            if target in allowed:
+                return target
+        return candidates[0][0]
+
+    @staticmethod
+    def pick(service: object, key: str = None) -> str:
+        """
+        picks the target of a request
+
+        @param service: (dict) service
+        @param key: (str) key of the request, only used by consistent_hash
+        """
+        state = Balancer._state(service)
+        candidates = Balancer._candidates(service)
+        strategy = service.get('load_balancer') or default_strategy
+        if strategy == 'weighted_round_robin':
+            return Balancer._weighted_round_robin(state, candidates)
+        if strategy == 'least_outstanding':
+            return Balancer._least_outstanding(state, candidates)
+        if strategy == 'p2c_ewma':
+            return Balancer._p2c_ewma(service, state, candidates)
+        if strategy == 'consistent_hash':
+            return Balancer._consistent_hash(service, state, candidates, key)
+        return Balancer._round_robin(state, candidates)
+
+    @staticmethod
+    def acquire(service: object, target: str):
+        """
+        counts a request sent to a target
+
+        @param service: (dict) service
+        @param target: (str) target url
+        """
+        outstanding = Balancer._state(service)['outstanding']
+        outstanding[target] = outstanding.get(target, 0) + 1
+
+    @staticmethod
+    def release(service: object, target: str):
+        """
+        counts the response headers of a target as arrived
+
+        @param service: (dict) service
+        @param target: (str) target url
+        """
+        outstanding = Balancer._state(service)['outstanding']
+        outstanding[target] = max(outstanding.get(target, 0) - 1, 0)
+
+    @staticmethod
+    def stats(service: object) -> dict:
+        """
+        gets the requests waiting for headers per target
+
+        @param service: (dict) service
+        """
+        return dict(Balancer._state(service)['outstanding'])
@@ -0,0 +1,182 @@
+import time
+
+from aioredis import Redis as AioRedis
+
+from flash.models.circuit_breaker import CircuitBreaker
+from flash.util.env import CIRCUIT_BREAKER_SYNC
+
+# the rolling window of a breaker is split in this many buckets of period / buckets seconds
+window_buckets = 10
+default_threshold = 0.5
+# schema default of min_requests, for breakers stored before it existed
+default_min_requests = 10
+
+
+class Breaker:
+    """
+    closed, open and half open circuit breaker checked in memory
+
+    outcomes of upstream calls are counted per worker in a rolling window of
+    the breaker period. once min_requests were counted and the failure rate
+    reaches 1 - threshold the worker trips the shared state, which refuses
+    requests for cooldown seconds and then lets half_open_probes requests
+    through at a time. that many successful probes close the breaker and a
+    failed one opens it again. every transition of the shared state is one
+    redis script call; a closed breaker only reads it every CIRCUIT_BREAKER_SYNC
+    seconds to notice trips of other workers. the event loop is single threaded,
+    so the local state needs no locking
+    """
+    _states = {}
+
+    @staticmethod
+    def _local(breaker: object) -> dict:
+        _id = str(breaker['_id'])
+        local = Breaker._states.get(_id)
+        if local is None:
+            local = Breaker._states[_id] = {
+                'state': 'closed',
+                'until': 0,
+                'probes': 0,
+                'synced_at': time.monotonic(),
+                'buckets': [[0, 0, 0] for _ in range(window_buckets)],
+            }
+        return local
+
+    @staticmethod
+    def _apply(local: dict, state: str, remaining: int, now: float):
+        if state == 'closed' and local['state'] != 'closed':
+            # a closed breaker starts counting from scratch
+            local['buckets'] = [[0, 0, 0] for _ in range(window_buckets)]
+        local['state'] = state
+        local['until'] = now + remaining / 1000 if state == 'open' else 0
+        local['synced_at'] = now
+
+    @staticmethod
+    async def _transition(breaker: object, action: str, db: AioRedis):
+        try:
+            return await CircuitBreaker.transition(breaker, action, db)
+        except Exception:
+            # redis is gone, the worker goes on with its local state
+            return None
+
+    @staticmethod
+    def _slot(breaker: object, now: float) -> int:
+        return int(now * window_buckets / max(int(breaker.get('period') or 0), 1))
+
+    @staticmethod
+    def count(breaker: object, failed: bool, now: float) -> tuple:
+        """
+        counts an outcome in the rolling window of a breaker
+
+        @param breaker: (dict) circuit breaker
+        @param failed: (bool) if the upstream call failed
+        @param now: (float) monotonic time
+        @returns: (outcomes, failures) in the window
+        """
+        slot = Breaker._slot(breaker, now)
+        buckets = Breaker._local(breaker)['buckets']
+        bucket = buckets[slot % window_buckets]
+        if bucket[0] != slot:
+            bucket[0], bucket[1], bucket[2] = slot, 0, 0
+        bucket[1] += 1
+        if failed:
+            bucket[2] += 1
+        total = failures = 0
+        for bucket_slot, outcomes, failed_outcomes in buckets:
+            if slot - bucket_slot < window_buckets:
+                total += outcomes
+                failures += failed_outcomes
+        return total, failures
+
+    @staticmethod
+    async def allow(breaker: object, db: AioRedis) -> tuple:
+        """
+        checks if a request may be sent upstream
+
+        @param breaker: (dict) circuit breaker
+        @param db: redis instance
+        @returns: (allowed, probe, retry after ms) where probe tells if the request is a half open probe
+        """
+        local = Breaker._local(breaker)
+        now = time.monotonic()
+        if local['state'] == 'closed':
+            if now - local['synced_at'] >= CIRCUIT_BREAKER_SYNC:
+                # concurrent requests go on with the local state while one reads the shared one
+                local['synced_at'] = now
+                result = await Breaker._transition(breaker, 'sync', db)
+                if result is not None:
+                    Breaker._apply(local, result[0], result[1], time.monotonic())
+            if local['state'] == 'closed':
+                return True, False, 0
+        if local['state'] == 'open' and now < local['until']:
+            return False, False, int((local['until'] - now) * 1000)
+
+        result = await Breaker._transition(breaker, 'probe', db)
+        now = time.monotonic()
+        if result is None:
+            # without redis every worker probes on its own
+            allowed = local['probes'] < int(breaker.get('half_open_probes') or 1)
+        else:
+            state, remaining, allowed = result
+            if state == 'closed':
+                Breaker._apply(local, state, remaining, now)
+                return True, False, 0
+            if not allowed:
+                # wait locally instead of asking redis again on every request
+                retry_after = min(remaining / 1000, CIRCUIT_BREAKER_SYNC) if state == 'half_open' else remaining / 1000
+                local['state'], local['until'] = 'open', now + retry_after
+                return False, False, int(retry_after * 1000)
+        if not allowed:
+            return False, False, int(CIRCUIT_BREAKER_SYNC * 1000)
+        local['state'] = 'half_open'
+        local['probes'] += 1
+        return True, True, 0
+
+    @staticmethod
+    async def record(breaker: object, failed: bool, probe: bool, db: AioRedis) -> bool:
+        """
+        records the outcome of an upstream call
+
+        @param breaker: (dict) circuit breaker
+        @param failed: (bool) if the upstream call failed
+        @param probe: (bool) if the call was a half open probe
+        @param db: redis instance
+        @returns: if this call tripped the breaker
+        """
+        local = Breaker._local(breaker)
+        now = time.monotonic()
+        if probe:
+            local['probes'] = max(local['probes'] - 1, 0)
+            result = await Breaker._transition(breaker, 'failure' if failed else 'success', db)
+            if result is not None:
+                Breaker._apply(local, result[0], result[1], time.monotonic())
+            elif failed:
+                Breaker._apply(local, 'open', int(breaker.get('cooldown') or 0) * 1000, now)
+            return False
+
+        total, failures = Breaker.count(breaker, failed, now)
+        if not failed or local['state'] != 'closed' or total < int(breaker.get('min_requests') or default_min_requests):
+            return False
+        threshold = breaker.get('threshold')
+        if failures / total < 1 - (default_threshold if threshold is None else float(threshold)):
+            return False
+
+        # refuse right away, the shared state tells the other workers
+        Breaker._apply(local, 'open', int(breaker.get('cooldown') or 0) * 1000, now)
+        result = await Breaker._transition(breaker, 'trip', db)
+        if result is None:
+            return True
+        Breaker._apply(local, result[0], result[1], time.monotonic())
+        return result[2]
+
+    @staticmethod
+    async def release(breaker: object, db: AioRedis):
+        """
+        gives back a half open probe that did not reach the upstream
+
+        @param breaker: (dict) circuit breaker
+        @param db: redis instance
+        """
+        local = Breaker._local(breaker)
+        local['probes'] = max(local['probes'] - 1, 0)
+        await Breaker._transition(breaker, 'release', db)
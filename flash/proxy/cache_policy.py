@@ -0,0 +1,128 @@
+import hashlib
+import re
+from urllib.parse import urlencode
+
+# status codes cacheable by default (RFC 9110 15.1) when a config lists none
+default_response_codes = {200, 203, 204, 300, 301, 308, 404, 405, 410, 414, 501}
+body_methods = {'POST', 'PUT', 'PATCH', 'DELETE'}
+_directive = re.compile(r'\s*([a-zA-Z-]+)\s*(?:=\s*"?([^",]*)"?)?\s*(?:,|$)')
+
+
+class CachePolicy:
+    """
+    decides which responses are cached and under which key
+
+    the key only holds what selects a different upstream response: the method,
+    the path, the query (sorted, optionally limited to key_query) and the request
+    headers listed in key_headers. responses whose Vary names a header outside
+    key_headers are not cached, since the key could not tell their variants apart.
+    neither are responses to requests with credentials, Authorization or Cookie,
+    unless that header is part of the key or the response is marked public
+    """
+
+    @staticmethod
+    def names(value) -> list:
+        """
+        parses a list of names stored as a comma separated string
+
+        @param value: (str|list) names
+        @returns: stripped names without empty ones
+        """
+        if not value:
+            return []
+        if isinstance(value, str):
+            value = value.split(',')
+        return [name.strip() for name in value if name and name.strip()]
+
+    @staticmethod
+    def cache_control(headers) -> dict:
+        """
+        parses the Cache-Control directives of headers
+
+        @param headers: (iterable) header name and value pairs
+        @returns: directive names in lower case mapped to their value or None
+        """
+        directives = {}
+        for key, value in headers:
+            if key.lower() == 'cache-control':
+                for name, arg in _directive.findall(value):
+                    directives[name.lower()] = arg or None
+        return directives
+
+    @staticmethod
+    def key(endpoint_cacher: object, method: str, path: str, params: dict, headers: dict, data: bytes) -> str:
+        """
+        builds the normalized cache key of a request
+
+        @param endpoint_cacher: (dict) endpoint cache config
+        @param method: (str) request method
+        @param path: (str) request path
+        @param params: (dict) query params
+        @param headers: (dict) request headers
+        @param data: (bytes) request body, only part of the key for methods carrying one
+        """
+        key_query = CachePolicy.names(endpoint_cacher.get('key_query'))
+        if key_query:
+            params = {name: value for name, value in params.items() if name in key_query}
+        lowered = {name.lower(): value for name, value in headers.items()}
+        digest = hashlib.sha256()
+        digest.update(f'{method.upper()}\n{path}\n{urlencode(sorted(params.items()))}\n'.encode('utf-8'))
+        for name in sorted(name.lower() for name in CachePolicy.names(endpoint_cacher.get('key_headers'))):
+            digest.update(f'{name}:{lowered.get(name, "")}\n'.encode('utf-8'))
+        if method.upper() in body_methods:
+            digest.update(data or b'')
+        return f"endpoint_cache:{endpoint_cacher['_id']}:{digest.hexdigest()}"
+
+    @staticmethod
+    def is_cacheable_request(headers: dict) -> bool:
+        """
+        checks if the client allows its request to be answered from the cache
+
+        @param headers: (dict) request headers
+        """
+        directives = CachePolicy.cache_control(headers.items())
+        return 'no-store' not in directives and 'no-cache' not in directives
+
+    @staticmethod
+    def ttl(endpoint_cacher: object, req_headers: dict, status: int, headers: list) -> int:
+        """
+        gets how long a response may be cached
+
+        @param endpoint_cacher: (dict) endpoint cache config
+        @param req_headers: (dict) request headers
+        @param status: (int) response status
+        @param headers: (list) response header name and value pairs
+        @returns: seconds to cache the response, 0 when it must not be cached
+        """
+        response_codes = endpoint_cacher.get('response_codes')
+        if response_codes:
+            if str(status) not in {str(code) for code in response_codes}:
+                return 0
+        elif status not in default_response_codes:
+            return 0
+
+        directives = CachePolicy.cache_control(headers)
+        if 'no-store' in directives or 'no-cache' in directives or 'private' in directives:
+            return 0
+
+        key_headers = {name.lower() for name in CachePolicy.names(endpoint_cacher.get('key_headers'))}
+        for key, value in headers:
+            if key.lower() == 'vary':
+                for name in CachePolicy.names(value):
+                    if name == '*' or name.lower() not in key_headers:
+                        return 0
+
+        # responses to authorized requests are shared only when explicitly allowed
+        if 'authorization' not in key_headers and any(name.lower() == 'authorization' for name in req_headers) and \
+                'public' not in directives and 's-maxage' not in directives:
+            return 0
+        # the same goes for cookies, which often carry the session the response belongs to
+        if 'cookie' not in key_headers and any(name.lower() == 'cookie' for name in req_headers) and \
+                'public' not in directives:
+            return 0
+
+        ttl = int(endpoint_cacher['timeout'])
+        max_age = directives.get('s-maxage') or directives.get('max-age')
+        if max_age is not None and max_age.isdigit():
+            ttl = min(ttl, int(max_age))
+        return ttl
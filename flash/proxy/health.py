@@ -0,0 +1,254 @@
+import asyncio
+import math
+import statistics
+import time
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+from flash.models.service import Service
+from flash.util import Api
+from flash.util.env import ROUTE_TABLE_TTL
+
+# service fields tuning outlier detection, used when a service does not set them
+defaults = {
+    'outlier_consecutive_errors': 5,
+    'outlier_latency_factor': 0,
+    'outlier_base_ejection': 30,
+    'outlier_max_ejection': 300,
+    'outlier_max_ejection_percent': 50,
+    'health_check_interval': 10,
+    'health_check_timeout': 2,
+}
+# weight of the last response in the latency average of a target
+latency_alpha = 0.2
+# responses a target needs before its latency is compared with the others
+latency_min_samples = 10
+
+
+class TargetHealth:
+    """
+    tracks the health of every target of a service and ejects unhealthy ones
+
+    passive detection looks at the proxied responses: a target answering
+    outlier_consecutive_errors times in a row with a 5xx or a failed call, or
+    whose average latency is above outlier_latency_factor times the median of
+    the other targets, is ejected. an ejection lasts outlier_base_ejection
+    seconds, doubled for every ejection in a row up to outlier_max_ejection, and
+    at most outlier_max_ejection_percent of the targets are ejected by it.
+    services with a health_check_path are also checked actively, a failed check
+    ejects the target until a later check passes.
+    the state lives in memory per worker, the event loop is single threaded so
+    it needs no locking
+    """
+    _targets = {}
+    _checker = None
+
+    @staticmethod
+    def option(service: object, name: str):
+        """
+        gets an outlier detection option of a service
+
+        @param service: (dict) service
+        @param name: (str) option name
+        """
+        value = service.get(name)
+        return defaults[name] if value is None else value
+
+    @staticmethod
+    def _state(service: object, target: str) -> dict:
+        key = (str(service['_id']), target)
+        state = TargetHealth._targets.get(key)
+        if state is None:
+            state = TargetHealth._targets[key] = {
+                'errors': 0,
+                'ejections': 0,
+                'ejected_until': 0,
+                'active': False,
+                'latency': None,
+                'samples': 0,
+            }
+        return state
+
+    @staticmethod
+    def is_ejected(service: object, target: str, now: float = None) -> bool:
+        """
+        checks if a target is out of rotation
+
+        @param service: (dict) service
+        @param target: (str) target url
+        @param now: (float) monotonic time
+        """
+        state = TargetHealth._targets.get((str(service['_id']), target))
+        if state is None:
+            return False
+        return state['active'] or (now or time.monotonic()) < state['ejected_until']
+
+    @staticmethod
+    def latency(service: object, target: str) -> float:
+        """
+        gets the average latency of a target
+
+        @param service: (dict) service
+        @param target: (str) target url
+        @returns: seconds, None before the first response
+        """
+        state = TargetHealth._targets.get((str(service['_id']), target))
+        return state['latency'] if state is not None else None
+
+    @staticmethod
+    def eject(service: object, target: str, now: float) -> bool:
+        """
+        takes a target out of rotation for its back-off time
+
+        @param service: (dict) service
+        @param target: (str) target url
+        @param now: (float) monotonic time
+        @returns: if the target was ejected, False when outlier_max_ejection_percent is reached
+        """
+        state = TargetHealth._state(service, target)
+        targets = service.get('targets') or []
+        ejected = sum(1 for other in targets if TargetHealth.is_ejected(service, other, now))
+        max_ejected = math.floor(len(targets) * int(TargetHealth.option(service, 'outlier_max_ejection_percent')) / 100)
+        if ejected + 1 > max_ejected:
+            state['errors'] = 0
+            return False
+        state['ejections'] += 1
+        duration = min(int(TargetHealth.option(service, 'outlier_base_ejection')) * 2 ** (state['ejections'] - 1),
+                       int(TargetHealth.option(service, 'outlier_max_ejection')))
+        state['ejected_until'] = now + duration
+        state['errors'] = 0
+        state['latency'] = None
+        state['samples'] = 0
+        return True
+
+    @staticmethod
+    def _is_latency_outlier(service: object, target: str, state: dict) -> bool:
+        factor = float(TargetHealth.option(service, 'outlier_latency_factor'))
+        if factor <= 0 or state['samples'] < latency_min_samples:
+            return False
+        others = []
+        for other in service.get('targets') or []:
+            other_state = TargetHealth._targets.get((str(service['_id']), other))
+            if other != target and other_state is not None and other_state['samples'] >= latency_min_samples:
+                others.append(other_state['latency'])
+        # a median needs at least two other targets to tell an outlier apart
+        return len(others) >= 2 and state['latency'] > factor * statistics.median(others)
+
+    @staticmethod
+    def record(service: object, target: str, failed: bool, latency: float) -> bool:
+        """
+        counts a proxied response of a target
+
+        @param service: (dict) service
+        @param target: (str) target url
+        @param failed: (bool) if the call failed or answered with a 5xx
+        @param latency: (float) seconds until the response headers arrived
+        @returns: if the target was ejected
+        """
+        state = TargetHealth._state(service, target)
+        now = time.monotonic()
+        if now < state['ejected_until']:
+            # late responses of an ejected target
+            return False
+        if failed:
+            state['errors'] += 1
+            consecutive_errors = int(TargetHealth.option(service, 'outlier_consecutive_errors'))
+            return consecutive_errors > 0 and state['errors'] >= consecutive_errors and \
+                TargetHealth.eject(service, target, now)
+
+        state['errors'] = 0
+        if state['ejections'] and now - state['ejected_until'] >= int(
+                TargetHealth.option(service, 'outlier_max_ejection')):
+            # healthy long enough, the next ejection starts from the base time again
+            state['ejections'] = 0
+        state['latency'] = latency if state['latency'] is None else \
+            latency_alpha * latency + (1 - latency_alpha) * state['latency']
+        state['samples'] += 1
+        return TargetHealth._is_latency_outlier(service, target, state) and TargetHealth.eject(service, target, now)
+
+    @staticmethod
+    async def check(service: object, target: str) -> bool:
+        """
+        actively checks a target at the health_check_path of its service
+
+        @param service: (dict) service
+        @param target: (str) target url
+        @returns: if the target is healthy
+        """
+        try:
+            req = await Api.stream(method='GET', url=target.rstrip('/') + service['health_check_path'],
+                                   timeout=TargetHealth.option(service, 'health_check_timeout'))
+            await req['close']()
+            healthy = 200 <= req['status'] < 400
+        except Exception:
+            healthy = False
+        TargetHealth._state(service, target)['active'] = not healthy
+        return healthy
+
+    @staticmethod
+    def start(service_db: AsyncIOMotorCollection, tick: float = 1):
+        """
+        starts actively checking the targets of services with a health_check_path, call once per worker process
+
+        @param service_db: mongo collection instance
+        @param tick: (float) seconds between looking for due checks
+        """
+        TargetHealth._checker = asyncio.ensure_future(TargetHealth._check_loop(service_db, tick))
+
+    @staticmethod
+    async def stop():
+        """
+        stops the active checks
+        """
+        checker, TargetHealth._checker = TargetHealth._checker, None
+        if checker is not None:
+            checker.cancel()
+            await asyncio.gather(checker, return_exceptions=True)
+
+    @staticmethod
+    async def _check_loop(service_db: AsyncIOMotorCollection, tick: float):
+        checked_at = {}
+        services, loaded_at = [], 0
+        while True:
+            await asyncio.sleep(tick)
+            try:
+                now = time.monotonic()
+                if now - loaded_at >= ROUTE_TABLE_TTL:
+                    services, loaded_at = await Service.get_all(service_db), now
+                checks = []
+                for service in services:
+                    if not service.get('health_check_path'):
+                        continue
+                    _id = str(service['_id'])
+                    if now - checked_at.get(_id, 0) < int(TargetHealth.option(service, 'health_check_interval')):
+                        continue
+                    checked_at[_id] = now
+                    checks.extend(TargetHealth.check(service, target) for target in service.get('targets') or [])
+                await asyncio.gather(*checks)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # mongo is gone, checks go on once it is back
+                pass
+
+    @staticmethod
+    def stats(service: object) -> list:
+        """
+        gets the health of every target of a service
+
+        @param service: (dict) service
+        """
+        now = time.monotonic()
+        stats = []
+        for target in service.get('targets') or []:
+            state = TargetHealth._targets.get((str(service['_id']), target)) or {}
+            stats.append({
+                'target': target,
+                'ejected': TargetHealth.is_ejected(service, target, now),
+                'ejected_for': max(state.get('ejected_until', 0) - now, 0),
+                'ejections': state.get('ejections', 0),
+                'consecutive_errors': state.get('errors', 0),
+                'latency': state.get('latency'),
+                'active_check_failed': state.get('active', False),
+            })
+        return stats
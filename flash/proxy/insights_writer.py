@@ -0,0 +1,148 @@
+import asyncio
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+from flash.models.insights import Insights
+from flash.models.insights_rollup import InsightsRollup
+
+_default_options = {
+    'batch_size': 500,
+    'flush_interval': 1,
+    'buffer_size': 50000,
+    'storage': 'plain',
+    'retention': 30,
+}
+
+
+class InsightsWriter:
+    """
+    buffers insights of proxied requests and writes them in bulk
+
+    records are flushed with one unordered insert_many once batch_size of them
+    are buffered or every flush_interval seconds. the service of a record was
+    resolved by the proxy already, so it is not looked up again. when mongo
+    falls behind the buffer fills up to buffer_size and newer records are
+    dropped and counted instead of holding more memory.
+    every record is also counted in the rollup of its minute, and the rollups
+    are added to the stored ones each flush_interval, dropped records included
+    """
+    _db = None
+    _rollup_db = None
+    _buffer = []
+    _rollups = {}
+    _flusher = None
+    _wakeup = None
+    _options = dict(_default_options)
+    _stats = {'written': 0, 'failed': 0, 'dropped': 0}
+
+    @staticmethod
+    def start(db: AsyncIOMotorCollection, rollup_db: AsyncIOMotorCollection, **options):
+        """
+        starts flushing buffered insights, call once per worker process
+
+        @param db: mongo collection instance of insights
+        @param rollup_db: mongo collection instance of insights rollups
+        @param options: batch_size, flush_interval, buffer_size, storage and retention overriding the defaults
+        """
+        InsightsWriter._db = db
+        InsightsWriter._rollup_db = rollup_db
+        InsightsWriter._options = dict(_default_options, **{key: value for key, value in options.items()
+                                                             if value is not None})
+        InsightsWriter._wakeup = asyncio.Event()
+        InsightsWriter._flusher = asyncio.ensure_future(InsightsWriter._flush_loop())
+
+    @staticmethod
+    async def stop():
+        """
+        stops flushing and writes what is left in the buffer
+        """
+        flusher, InsightsWriter._flusher = InsightsWriter._flusher, None
+        if flusher is not None:
+            flusher.cancel()
+            await asyncio.gather(flusher, return_exceptions=True)
+        try:
+            await InsightsWriter.flush_rollups()
+            while InsightsWriter._buffer and InsightsWriter._db is not None:
+                await InsightsWriter.flush()
+        except Exception:
+            # mongo is gone, what is left can not be written
+            pass
+
+    @staticmethod
+    def record(ctx: object, retention: int = None) -> bool:
+        """
+        buffers an insight
+
+        @param ctx: (dict) insight of a proxied request
+        @param retention: (int) days the insight is kept, the default retention when omitted
+        @returns: if the insight was buffered, False when it was dropped
+        """
+        InsightsRollup.add(InsightsWriter._rollups.setdefault(InsightsRollup.key(ctx), {}), ctx)
+        if len(InsightsWriter._buffer) >= InsightsWriter._options['buffer_size']:
+            InsightsWriter._stats['dropped'] += 1
+            return False
+        if InsightsWriter._options['storage'] == 'ttl':
+            ctx['expire_at'] = Insights.expire_at(ctx['created_at'], retention or InsightsWriter._options['retention'])
+        InsightsWriter._buffer.append(Insights.compact(ctx))
+        if len(InsightsWriter._buffer) >= InsightsWriter._options['batch_size'] and InsightsWriter._wakeup:
+            InsightsWriter._wakeup.set()
+        return True
+
+    @staticmethod
+    async def flush():
+        """
+        writes one batch of buffered insights
+        """
+        batch = InsightsWriter._buffer[:InsightsWriter._options['batch_size']]
+        if not batch:
+            return
+        del InsightsWriter._buffer[:len(batch)]
+        try:
+            written = await Insights.create_many(batch, InsightsWriter._db)
+        except Exception:
+            InsightsWriter._stats['failed'] += len(batch)
+            raise
+        InsightsWriter._stats['written'] += written
+        InsightsWriter._stats['failed'] += len(batch) - written
+
+    @staticmethod
+    async def flush_rollups():
+        """
+        adds the rollups counted since the last flush to the stored ones
+        """
+        rollups, InsightsWriter._rollups = InsightsWriter._rollups, {}
+        if not rollups or InsightsWriter._rollup_db is None:
+            return
+        try:
+            await InsightsRollup.upsert_many(rollups, InsightsWriter._rollup_db)
+        except Exception:
+            # keep the counters for the next flush
+            for key, rollup in rollups.items():
+                InsightsRollup.merge(InsightsWriter._rollups.setdefault(key, {}), rollup)
+            raise
+
+    @staticmethod
+    async def _flush_loop():
+        while True:
+            try:
+                await asyncio.wait_for(InsightsWriter._wakeup.wait(), InsightsWriter._options['flush_interval'])
+            except asyncio.TimeoutError:
+                pass
+            InsightsWriter._wakeup.clear()
+            try:
+                await InsightsWriter.flush_rollups()
+                # a full batch is written right away, the rest once per interval
+                await InsightsWriter.flush()
+                while len(InsightsWriter._buffer) >= InsightsWriter._options['batch_size']:
+                    await InsightsWriter.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                await asyncio.sleep(InsightsWriter._options['flush_interval'])
+
+    @staticmethod
+    def stats() -> dict:
+        """
+        gets buffer depth and write counters
+        """
+        return dict(InsightsWriter._stats, depth=len(InsightsWriter._buffer))
@@ -1,62 +1,296 @@
+import asyncio
 import json
-from datetime import time, datetime, timedelta
+import logging
+import math
+from datetime import time, datetime
 
 import pydash
 from multidict import CIMultiDict
 
-from flash.common.error_code import ERROR_SERVER
+from flash.common.error_code import ERROR_SERVER, ErrorBase
 from flash.common.resp import resp_success_json, resp_error_json
 from flash.models.circuit_breaker import CircuitBreaker, CircuitBreakerStatus
 from flash.models.request_validator import RequestValidator
 from flash.util.error import Error
-from flash.util.tasks import queue_async_func
-from flash.models.rate_limiter import RateLimiter
+from flash.util.queue import Background
 from flash.models.service import ServiceState
+from flash.models.rate_limiter import RateLimiter
 from flash.service import controller as service_controller
 from flash.circuit_breaker import controller as circuit_breaker_controller
 from flash.request_validator import controller as request_validator_controller
 from flash.models.event import Event
 from flash.models.endpoint_cacher import EndpointCacher
-from flash.insights import controller as insights_controller
 from flash.event import controller as event_controller
 from app import app
-from flash.util import DB, Api, Hasher, Bytes, Bson, Async
+from flash.util import DB, Api, Hasher, Bson, Async, Token
+from flash.util.env import ENDPOINT_CACHE_MAX_BODY
+from flash.util.http import Http
+from flash.util.singleflight import SingleFlight
 from flash.util.regex import Regex
+from flash.proxy.balancer import Balancer
+from flash.proxy.breaker import Breaker
+from flash.proxy.cache_policy import CachePolicy
+from flash.proxy.health import TargetHealth
+from flash.proxy.insights_writer import InsightsWriter
+from flash.proxy.policy import Policy
+from flash.proxy.quota import LocalQuota
+from flash.proxy.warmup import Warmup
 from fastapi import Request
-from fastapi.responses import JSONResponse  # , ORJSONResponse
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
+
+# concurrent cache misses of the same request share one upstream call
+cache_fills = SingleFlight()
+# background revalidations, referenced until done so they are not garbage collected mid-run
+revalidations = set()
+logger = logging.getLogger(__name__)
+
+
+def get_request_hash(request: Request, endpoint_cacher: object, req_ctx: object):
+    return CachePolicy.key(endpoint_cacher, request.method, request.url.path, req_ctx['params'],
+                           req_ctx['headers'], req_ctx['data'])
 
 
-async def handle_request(request: Request, service: object, endpoint_cacher: object):
-    req_ctx = {
+async def cache_stream(req: object, chunks):
+    body = bytearray()
+    try:
+        async for chunk in chunks:
+            if body is not None:
+                body.extend(chunk)
+                if len(body) > ENDPOINT_CACHE_MAX_BODY:
+                    body = None
+            yield chunk
+        if body is not None:
+            req['body'] = bytes(body)
+    finally:
+        if 'flight' in req:
+            # followers get the buffered response, or do their own call if there is none
+            cache_fills.land(req['hash'], req['flight'], {
+                'status': req['status'],
+                'content_type': req['content_type'],
+                'headers': req['headers'],
+                'body': req['body'],
+            } if 'body' in req else None)
+
+
+def prepare_cache_fill(req: object, req_ctx: object, req_ctx_hash: str, endpoint_cacher: object, path: str):
+    req['hash'] = req_ctx_hash
+    req['path'] = path
+    req['ttl'] = CachePolicy.ttl(endpoint_cacher, req_ctx['headers'], req['status'], req['headers'])
+    if req['ttl'] > 0:
+        # only buffer the body when it has to be stored
+        req['stream'] = cache_stream(req, req['stream'])
+    return req
+
+
+async def lead_cache_fill(request: Request, req_ctx: object, req_ctx_hash: str, endpoint_cacher: object,
+                          timeout: float):
+    flight = cache_fills.lead(req_ctx_hash, timeout)
+    fill_locked = False
+    try:
+        # other workers missing the same request wait for the one holding the lock
+        fill_lock = int(endpoint_cacher.get('fill_lock') or 0)
+        if fill_lock:
+            fill_locked = await EndpointCacher.lock_fill(req_ctx_hash, fill_lock, DB.get_redis_bytes(request))
+            if not fill_locked:
+                req_cache = await EndpointCacher.wait_fill(req_ctx_hash, fill_lock, DB.get_redis_bytes(request))
+                if req_cache is not None:
+                    cache_fills.land(req_ctx_hash, flight, req_cache)
+                    return req_cache, True
+        req = await Api.stream(**req_ctx)
+    except Exception:
+        cache_fills.land(req_ctx_hash, flight, None)
+        if fill_locked:
+            await EndpointCacher.unlock_fill(req_ctx_hash, DB.get_redis_bytes(request))
+        raise
+
+    close = req['close']
+
+    async def close_flight():
+        cache_fills.land(req_ctx_hash, flight, None)
+        await close()
+
+    req['flight'] = flight
+    req['fill_locked'] = fill_locked
+    req['close'] = close_flight
+    prepare_cache_fill(req, req_ctx, req_ctx_hash, endpoint_cacher, request.url.path)
+    if req['ttl'] <= 0:
+        cache_fills.land(req_ctx_hash, flight, None)
+        if fill_locked:
+            await EndpointCacher.unlock_fill(req_ctx_hash, DB.get_redis_bytes(request))
+            req['fill_locked'] = False
+    return req, False
+
+
+async def coalesce_request(request: Request, req_ctx: object, req_ctx_hash: str, endpoint_cacher: object,
+                           timeout: float):
+    flight = cache_fills.join(req_ctx_hash)
+    if flight is None:
+        return await lead_cache_fill(request, req_ctx, req_ctx_hash, endpoint_cacher, timeout)
+
+    req_cache = await cache_fills.wait(flight, timeout)
+    if req_cache is not None:
+        return req_cache, True
+
+    # the leader's response could not be shared
+    req = await Api.stream(**req_ctx)
+    return prepare_cache_fill(req, req_ctx, req_ctx_hash, endpoint_cacher, request.url.path), False
+
+
+async def revalidate_cache(redis, req_ctx: object, req_ctx_hash: str, endpoint_cacher: object, timeout: float,
+                           path: str):
+    # one refresh at a time per worker and, through the fill lock, across workers
+    if cache_fills.join(req_ctx_hash) is not None or not await EndpointCacher.lock_fill(
+            req_ctx_hash, int(timeout * 1000), redis):
+        return
+    flight = cache_fills.lead(req_ctx_hash, timeout)
+    req = {}
+    try:
+        req = await Api.stream(**req_ctx)
+        # an error response does not replace the stale copy
+        if req['status'] < 500 and prepare_cache_fill(req, req_ctx, req_ctx_hash, endpoint_cacher, path)['ttl'] > 0:
+            async for _ in req['stream']:
+                pass
+            await handle_cache_fill(req, endpoint_cacher, redis)
+    finally:
+        # failures reach finish_revalidation, which logs them
+        cache_fills.land(req_ctx_hash, flight, None)
+        if 'close' in req:
+            await req['close']()
+        await EndpointCacher.unlock_fill(req_ctx_hash, redis)
+
+
+def finish_revalidation(task: asyncio.Future):
+    revalidations.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error('cache revalidation failed', exc_info=task.exception())
+
+
+def start_revalidation(*args):
+    task = asyncio.ensure_future(revalidate_cache(*args))
+    revalidations.add(task)
+    task.add_done_callback(finish_revalidation)
+
+
+def get_request_ctx(request: Request, service: object, data: bytes, target: str = None):
+    return {
         'method': request.method,
-        'url': service['targets'][service['cur_target_index']],
+        'url': target or service['targets'][service['cur_target_index']],
         'params': dict(request.query_params),
-        'data': await request.json(),
+        'data': data,
         'cookies': dict(request.cookies),
-        'headers': pydash.omit(dict(request.headers), 'Host'),
+        'headers': pydash.omit(dict(request.headers), 'host'),
+        'timeout': service.get('timeout'),
     }
-    req = None
-    req_cache = None
-    req_ctx_hash = None
-
-    if not pydash.is_empty(endpoint_cacher):
-        req_ctx_hash = Hasher.hash_sha_256(json.dumps(req_ctx))
-        req_cache = await EndpointCacher.get_cache(req_ctx_hash, DB.get_redis(request))
-
-    if pydash.is_empty(req_cache):
-        req = await Api.call(**req_ctx)
-        if pydash.is_empty(req_ctx_hash):
-            req_ctx_hash = Hasher.hash_sha_256(json.dumps(req_ctx))
-        not pydash.is_empty(endpoint_cacher) and queue_async_func.s({
-            'func': 'EndpointCacher.set_cache',
-            'args': [req_ctx_hash, req, int(endpoint_cacher['timeout']), 'redis'],
-            'kwargs': {}
-        }).apply_async()
-    else:
-        req = json.loads(req_cache)
 
-    cache_hit = True if not pydash.is_empty(req_cache) else False
-    return req, cache_hit
+
+async def handle_request(request: Request, service: object, endpoint_cacher: object, target: str):
+    req_ctx = get_request_ctx(request, service, await request.body(), target)
+
+    if pydash.is_empty(endpoint_cacher):
+        return await Api.stream(**req_ctx), False
+
+    cacher_id = endpoint_cacher['_id']
+    redis = DB.get_redis_bytes(request)
+    if not CachePolicy.is_cacheable_request(req_ctx['headers']):
+        EndpointCacher.count(cacher_id, 'bypass', redis)
+        return await Api.stream(**req_ctx), False
+
+    Warmup.record(endpoint_cacher, request.method, request.url.path, req_ctx['params'], req_ctx['headers'],
+                  DB.get_redis(request))
+    timeout = Http.timeout(service.get('timeout')).total
+    req_ctx_hash = get_request_hash(request, endpoint_cacher, req_ctx)
+    req_cache = await EndpointCacher.read(req_ctx_hash, redis)
+    stale_cache = None
+    if req_cache is not None:
+        staleness = EndpointCacher.staleness(req_cache)
+        if staleness <= 0:
+            EndpointCacher.count(cacher_id, 'hit', redis)
+            return req_cache, True
+        if staleness <= int(endpoint_cacher.get('stale_while_revalidate') or 0):
+            EndpointCacher.count(cacher_id, 'stale', redis)
+            start_revalidation(redis, req_ctx, req_ctx_hash, endpoint_cacher, timeout, request.url.path)
+            return req_cache, True
+        if staleness <= int(endpoint_cacher.get('stale_if_error') or 0):
+            stale_cache = req_cache
+
+    try:
+        req, req_cache_hit = await coalesce_request(request, req_ctx, req_ctx_hash, endpoint_cacher, timeout)
+    except Exception:
+        if stale_cache is None:
+            raise
+        EndpointCacher.count(cacher_id, 'stale', redis)
+        # the failed upstream call is kept for the circuit breaker
+        return pydash.assign({}, stale_cache, {'upstream_error': True}), True
+    if stale_cache is not None and not req_cache_hit and req['status'] >= 500:
+        await req['close']()
+        EndpointCacher.count(cacher_id, 'stale', redis)
+        # the upstream status is kept for the circuit breaker
+        return pydash.assign({}, stale_cache, {'upstream_status': req['status']}), True
+    if req_cache_hit:
+        EndpointCacher.count(cacher_id, 'hit', redis)
+    else:
+        EndpointCacher.count(cacher_id, 'miss', redis)
+        if req['ttl'] <= 0:
+            EndpointCacher.count(cacher_id, 'uncacheable', redis)
+    return req, req_cache_hit
+
+
+async def handle_stale_service(request: Request, service: object, endpoint_cacher: object):
+    if pydash.is_empty(endpoint_cacher) or int(endpoint_cacher.get('stale_if_error') or 0) <= 0:
+        return None
+    req_ctx = get_request_ctx(request, service, await request.body())
+    req_ctx_hash = get_request_hash(request, endpoint_cacher, req_ctx)
+    req_cache = await EndpointCacher.read(req_ctx_hash, DB.get_redis_bytes(request))
+    if req_cache is None or EndpointCacher.staleness(req_cache) > int(endpoint_cacher['stale_if_error']):
+        return None
+    EndpointCacher.count(endpoint_cacher['_id'], 'stale', DB.get_redis_bytes(request))
+    return req_cache
+
+
+async def handle_cache_fill(req: object, endpoint_cacher: object, db):
+    if 'body' in req:
+        await EndpointCacher.write(req['hash'], {
+            'status': req['status'],
+            'content_type': req['content_type'],
+            'headers': req['headers'],
+            'body': req['body'],
+        }, req['ttl'], db, EndpointCacher.stale_window(endpoint_cacher),
+            EndpointCacher.tags(endpoint_cacher, req['path'], req['headers']),
+            int(endpoint_cacher['timeout']) + EndpointCacher.stale_window(endpoint_cacher))
+    if req.get('fill_locked'):
+        await EndpointCacher.unlock_fill(req['hash'], db)
+
+
+class UpstreamResponse(StreamingResponse):
+    """
+    streams an upstream body and always closes the upstream request afterwards,
+    also when the client is gone before the body is iterated and the stream
+    never starts
+    """
+
+    def __init__(self, content, close, **kwargs):
+        super().__init__(content, **kwargs)
+        self.close = close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.close()
+
+
+def build_response(req: object, background: BackgroundTask = None):
+    if 'stream' in req:
+        response = UpstreamResponse(req['stream'], req['close'], status_code=req['status'], background=background)
+    else:
+        response = Response(content=req['body'], status_code=req['status'], background=background)
+    headers = req.get('headers') or []
+    if isinstance(headers, dict):
+        headers = Api.pass_headers(headers.items())
+    response.raw_headers.extend(
+        (key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in headers)
+    return response
 
 
 async def handle_service(service: object, remote: str):
@@ -65,11 +299,6 @@ async def handle_service(service: object, remote: str):
             'message': 'Not found',
             'status_code': 404
         })
-    if service['state'] in [ServiceState.DOWN.name, ServiceState.OFF.name]:
-        raise Exception({
-            'message': f"Service is currently {service['state']}",
-            'status_code': 503
-        })
     if not pydash.is_empty(
             service['whitelisted_hosts']) and remote not in service['whitelisted_hosts'] or not pydash.is_empty(
         service['blacklisted_hosts']) and remote in service['blacklisted_hosts']:
@@ -79,35 +308,64 @@ async def handle_service(service: object, remote: str):
         })
 
 
-async def handle_rate_limiter(request, service_id: str, rule: object):
+def handle_service_state(service: object):
+    if service['state'] in [ServiceState.DOWN.name, ServiceState.OFF.name]:
+        raise Exception({
+            'message': f"Service is currently {service['state']}",
+            'status_code': 503
+        })
+
+
+def get_rate_limiter_key(request: Request, service: object, rule: object):
+    key_by = rule.get('key_by') or 'remote_ip'
+    key_name = rule.get('key_name')
+    if key_by == 'rule':
+        return None
+    if key_by == 'header' and key_name and request.headers.get(key_name):
+        return Hasher.hash_sha_256(request.headers.get(key_name))
+    if key_by == 'jwt_claim' and key_name:
+        # only a verified token picks the bucket, a forged claim falls back to the remote ip
+        token = request.headers.get('Authorization', '')
+        claim = Token.claims(token.split(' ')[-1]).get(key_name)
+        if claim is not None:
+            return Hasher.hash_sha_256(str(claim))
+    if key_by == 'path_group':
+        groups = service.get('regex_groups') or ()
+        index = int(key_name) if key_name and key_name.isdigit() else 0
+        if index < len(groups) and groups[index] is not None:
+            return Hasher.hash_sha_256(groups[index])
+    # remote ip, also used when the configured key is missing from the request
+    return request.client.host
+
+
+def get_balancer_key(request: Request, service: object):
+    if service.get('load_balancer') != 'consistent_hash':
+        return None
+    key_by = service.get('hash_key_by') or 'remote_ip'
+    key_name = service.get('hash_key_name')
+    if key_by == 'header' and key_name and request.headers.get(key_name):
+        return request.headers.get(key_name)
+    if key_by == 'cookie' and key_name and request.cookies.get(key_name):
+        return request.cookies.get(key_name)
+    if key_by == 'path':
+        return request.url.path
+    # remote ip, also used when the configured key is missing from the request
+    return request.client.host
+
+
+async def handle_rate_limiter(request, service: object, rule: object):
     if not pydash.is_empty(rule):
-        entries = await RateLimiter.get_entry_by_rule_id(rule['_id'], DB.get_redis(request))
-        if not pydash.is_empty(entries):
-            entry = entries[0]
-            if int(entry['count']) >= int(rule['max_requests']):
-                raise Exception({
-                    'message': rule['message'] or 'Too Many Requests',
-                    'status_code': int(rule['status_code']) or 429
-                })
-            ## 真的low 啊
-            queue_async_func.s({
-                'func': 'RateLimiter.increment_entry_count',
-                'args': [entry['_id'], 'redis'],
-                'kwargs': {}
-            }).apply_async()
+        key = get_rate_limiter_key(request, service, rule)
+        if LocalQuota.is_enabled(rule):
+            allowed, remaining, retry_after = await LocalQuota.hit(rule, key, DB.get_redis(request))
         else:
-            entry = {
-                'rule_id': rule['_id'],
-                'host': request.remote,
-                'count': 1,
-                'timeout': int(rule['timeout'])
-            }
-            ## 真的low 啊
-            queue_async_func.s({
-                'func': 'RateLimiter.create_entry',
-                'args': [entry, 'redis'],
-                'kwargs': {}
-            }).apply_async()
+            allowed, remaining, retry_after = await RateLimiter.hit(rule, key, DB.get_redis(request))
+        if not allowed:
+            raise Exception({
+                'message': rule.get('message') or 'Too Many Requests',
+                'status_code': int(rule.get('status_code') or 429),
+                'retry_after': retry_after
+            })
 
 
 async def handle_request_validator(validator: object, ctx: str, method: str):
@@ -120,153 +378,151 @@ async def handle_request_validator(validator: object, ctx: str, method: str):
                 ctx[validator['password_field']], validator['password_policy']['strength'])
 
 
-async def handle_circuit_breaker(breaker: object, service: object, request: Request, req: object):
-    breaker_count = 0
-    if req['status'] in breaker['status_codes']:
-        breaker_count = await CircuitBreaker.get_count(
-            str(breaker['_id']),
-            DB.get_redis(request)
-        )
-    if not breaker_count:
-        await CircuitBreaker.set_count(
-            str(breaker['_id']),
-            0,
-            breaker['period'],
-            DB.get_redis(request)
-        )
-    else:
-        failures_rate = breaker['tripped_count'] / int(breaker_count)
-        if failures_rate >= (1 - breaker['threshold']):
-            queued = await CircuitBreaker.get_queued(str(breaker['_id']), DB.get_redis(request))
-            if not queued or queued is 'False':
-                cooldown_eta = datetime.utcnow(
-                ) + timedelta(seconds=breaker['cooldown'])
-                queue_async_func.s({'func': 'Service.update',
-                                    'args': [str(service['_id']),
-                                             {'state': ServiceState.DOWN.name},
-                                             f'mongo:{service_controller.table}'],
-                                    'kwargs': {}}).apply_async()
-                queue_async_func.s({
-                    'func': 'CircuitBreaker.set_queued',
-                    'args': [str(breaker['_id']), 'True', breaker['cooldown'], 'redis'],
-                    'kwargs': {}
-                }).apply_async()
-                queue_async_func.s({'func': 'Service.update',
-                                    'args': [str(service['_id']),
-                                             {'state': ServiceState.UP.name},
-                                             f'mongo:{service_controller.table}'],
-                                    'kwargs': {}}).apply_async(eta=cooldown_eta)
-                queue_async_func.s({
-                    'func': 'CircuitBreaker.set_queued',
-                    'args': [str(breaker['_id']), 'False', breaker['cooldown'], 'redis'],
-                    'kwargs': {}
-                }).apply_async(eta=cooldown_eta)
-                queue_async_func.s({'func': 'CircuitBreaker.update',
-                                    'args': [str(breaker['_id']),
-                                             {'tripped_count': 0},
-                                             f'mongo:{circuit_breaker_controller.table}'],
-                                    'kwargs': {}}).apply_async(eta=cooldown_eta)
-                events = await Event.get_by_circuit_breaker_id(str(breaker['_id']),
-                                                               DB.get(request, event_controller.table))
-                for event in events:
-                    queue_async_func.s({
-                        'func': 'Event.handle_event',
-                        'args': [Bson.to_json(event)],
-                        'kwargs': {}
-                    }).apply_async()
-
-    await Async.all([
-        CircuitBreaker.incr_tripped_count(str(breaker['_id']), DB.get(
-            request, circuit_breaker_controller.table)),
-        CircuitBreaker.incr_count(str(breaker['_id']), DB.get_redis(request))
-    ])
-
-
-async def handle_insights(request: Request, response: object, service_id: str, elapsed_time: int, cache: bool):
+def get_upstream_status(req: object, req_cache_hit: bool):
+    # 0 when the upstream call failed, None when no call was made for the response
+    if req.get('upstream_error'):
+        return 0
+    if 'upstream_status' in req:
+        return req['upstream_status']
+    if req_cache_hit:
+        return None
+    return req['status']
+
+
+async def handle_circuit_breaker_trip(breaker: object, circuit_breaker_db, event_db):
+    await CircuitBreaker.incr_tripped_count(str(breaker['_id']), circuit_breaker_db)
+    for event in await Event.get_by_circuit_breaker_id(str(breaker['_id']), event_db):
+        await Event.handle_event(Bson.to_json(event))
+
+
+async def handle_circuit_breaker(breaker: object, request: Request, upstream_status, probe: bool):
+    if upstream_status is None:
+        if probe:
+            await Breaker.release(breaker, DB.get_redis(request))
+        return
+    failed = upstream_status == 0 or upstream_status in breaker['status_codes']
+    if await Breaker.record(breaker, failed, probe, DB.get_redis(request)):
+        await Background.put(handle_circuit_breaker_trip, breaker, DB.get(request, circuit_breaker_controller.table),
+                             DB.get(request, event_controller.table))
+
+
+async def handle_insights(request: Request, response: object, service: object, elapsed_time: int, cache: bool):
     ctx = {
         'method': request.method,
-        'service_id': service_id,
-        'path': request.url,
+        'service_id': str(service['_id']),
+        'route': service.get('path'),
+        'path': request.url.path,
         'remote_ip': request.client.host,
-        'scheme': request.query_params,
+        'scheme': request.url.scheme,
         'status_code': response['status'],
         'content_type': response['content_type'],
         'elapsed_time': elapsed_time,
-        'cache': cache
+        'cache': cache,
+        'created_at': datetime.utcnow()
     }
-    queue_async_func.s({'func': 'Insights.create',
-                        'args': [ctx,
-                                 f'mongo:{insights_controller.table}',
-                                 f'mongo:{service_controller.table}'],
-                        'kwargs': {}}).apply_async()
+    InsightsWriter.record(ctx, service.get('insights_retention'))
+
+
+def build_error_response(err: Exception):
+    err_ctx = err.args[0] if err.args else None
+    if isinstance(err_ctx, dict) and err_ctx.get('retry_after') is not None:
+        # refusals the client should retry keep their status and tell when to come back
+        response = resp_error_json(ErrorBase(code=err_ctx['status_code']), msg=err_ctx['message'],
+                                   status_code=err_ctx['status_code'])
+        response.headers['Retry-After'] = str(max(math.ceil(err_ctx['retry_after'] / 1000), 1))
+        return response
+    return resp_error_json(ERROR_SERVER, msg=str(err))
 
 
 @app.middleware("http")
 async def proxy(request, call_next):
+    req = None
     try:
         req_start_time = datetime.now()
-        if pydash.starts_with(request.path_qs, '/gateway'):
+        if pydash.starts_with(request.url.path, '/gateway'):
             return await call_next(request)
 
         # 通过url 查到best match 找到service
-        service = Regex.best_match(
-            await Regex.get_matched_paths(request.path, DB.get(request, service_controller.table)))
-        await handle_service(service, request.remote)
+        service = await Regex.match(request.url.path, DB.get(request, service_controller.table))
+        await handle_service(service, request.client.host)
+
+        policy = await Policy.get(service, DB.get_redis(request),
+                                  DB.get(request, circuit_breaker_controller.table),
+                                  DB.get(request, request_validator_controller.table))
+
+        try:
+            handle_service_state(service)
+        except Exception:
+            # a service marked DOWN keeps serving stale cached responses to clients it would let through
+            if service['state'] != ServiceState.DOWN.name:
+                raise
+            req_cache = await handle_stale_service(request, service, policy['cacher'])
+            if req_cache is None:
+                raise
+            return build_response(req_cache)
 
         # 限流
-        rate_limiter_rules = await RateLimiter.get_rule_by_service_id(str(service['_id']), DB.get_redis(request))
-        rate_limiter_rule = rate_limiter_rules[0] if rate_limiter_rules else None
-        await handle_rate_limiter(request, str(service['_id']), rate_limiter_rule)
-
-        breakers = await CircuitBreaker.get_by_service_id(str(service['_id']),
-                                                          DB.get(request, circuit_breaker_controller.table))
-        breaker = breakers[0] if breakers else None
-
-        request_validators = await RequestValidator.get_by_service_id(str(service['_id']),
-                                                                      DB.get(request,
-                                                                             request_validator_controller.table))
-        request_validator = request_validators[0] if request_validators else None
+        await handle_rate_limiter(request, service, policy['rule'])
 
-        endpoint_cachers = not pydash.is_empty(service) and await EndpointCacher.get_by_service_id(str(service['_id']),
-                                                                                                   DB.get_redis(
-                                                                                                       request)) or None
-        endpoint_cacher = endpoint_cachers[0] if endpoint_cachers else None
+        breaker = policy['breaker']
+        request_validator = policy['validator']
+        endpoint_cacher = policy['cacher']
 
         # 请求校验
-        await handle_request_validator(request_validator, json.loads(await request.text()), request.method)
+        not pydash.is_empty(request_validator) and await handle_request_validator(
+            request_validator, json.loads(await request.text()), request.method)
+
+        if pydash.is_empty(breaker) or breaker['status'] != CircuitBreakerStatus.ON.name:
+            breaker = None
+        probe = False
+        if breaker is not None:
+            allowed, probe, retry_after = await Breaker.allow(breaker, DB.get_redis(request))
+            if not allowed:
+                req_cache = await handle_stale_service(request, service, endpoint_cacher)
+                if req_cache is None:
+                    raise Exception({
+                        'message': 'Service is currently unavailable',
+                        'status_code': 503,
+                        'retry_after': retry_after
+                    })
+                return build_response(req_cache)
 
         # 缓存
-        req, req_cache_hit = await handle_request(request, service, endpoint_cacher)
+        target = Balancer.pick(service, get_balancer_key(request, service))
+        Balancer.acquire(service, target)
+        upstream_start_time = asyncio.get_running_loop().time()
+        try:
+            req, req_cache_hit = await handle_request(request, service, endpoint_cacher, target)
+        except Exception:
+            TargetHealth.record(service, target, True, asyncio.get_running_loop().time() - upstream_start_time)
+            if breaker is not None:
+                await handle_circuit_breaker(breaker, request, 0, probe)
+            raise
+        finally:
+            Balancer.release(service, target)
 
         checks = []
 
         #  回馈service状态
-        if not pydash.is_empty(
-                breaker) and breaker['status'] == CircuitBreakerStatus.ON.name:
-            if req['status'] in breaker['status_codes']:
-                checks.append(handle_circuit_breaker(
-                    breaker, service, request, req))
-            else:
-                await CircuitBreaker.incr_count(str(breaker['_id']), DB.get_redis(request))
-
-        queue_async_func.s({
-            'func': 'Service.advance_target',
-            'args': [str(service['_id']), f'mongo:{service_controller.table}'],
-            'kwargs': {}
-        }).apply_async()
+        upstream_status = get_upstream_status(req, req_cache_hit)
+        if upstream_status is not None:
+            TargetHealth.record(service, target, upstream_status == 0 or upstream_status >= 500,
+                                asyncio.get_running_loop().time() - upstream_start_time)
+        if breaker is not None:
+            await handle_circuit_breaker(breaker, request, upstream_status, probe)
 
         # finish insights 做记录
         req_finish_time = datetime.now()
-        req_elapsed_time = (req_finish_time - req_start_time).microseconds
-        checks.append(handle_insights(request, req, str(
-            service['_id']), req_elapsed_time, req_cache_hit))
+        req_elapsed_time = int((req_finish_time - req_start_time).total_seconds() * 1000000)
+        checks.append(handle_insights(request, req, service, req_elapsed_time, req_cache_hit))
         await Async.all(checks)
 
-        return JSONResponse(
-            content=Bytes.decode_bytes(
-                req['body_bytes']),
-            status_code=req['status'],
-            media_type=req['content_type'])
+        background = None
+        if not req_cache_hit and not pydash.is_empty(endpoint_cacher):
+            background = BackgroundTask(handle_cache_fill, req, endpoint_cacher, DB.get_redis_bytes(request))
+        return build_response(req, background)
 
     except Exception as err:
-        return resp_error_json(ERROR_SERVER, msg=str(err))
+        if req is not None and 'close' in req:
+            await req['close']()
+        return build_error_response(err)
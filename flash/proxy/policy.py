@@ -0,0 +1,76 @@
+import pydash
+from aioredis import Redis as AioRedis
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+from flash.models.circuit_breaker import CircuitBreaker
+from flash.models.endpoint_cacher import EndpointCacher
+from flash.models.rate_limiter import RateLimiter
+from flash.models.request_validator import RequestValidator
+from flash.util import Async
+from flash.util.cache import TTLCache
+from flash.util.env import POLICY_CACHE_TTL, POLICY_CACHE_SIZE
+
+
+class Policy:
+    """
+    per service snapshot of everything the proxy needs to handle a request
+
+    snapshots are kept in a local ttl cache and dropped by the crud controllers,
+    changes made through another worker are picked up once the ttl runs out
+    """
+    _cache = TTLCache(POLICY_CACHE_TTL, POLICY_CACHE_SIZE)
+
+    @staticmethod
+    async def load(service: object, redis: AioRedis, circuit_breaker_db: AsyncIOMotorCollection,
+                   request_validator_db: AsyncIOMotorCollection) -> dict:
+        """
+        loads the policy snapshot of a service
+
+        @param service: (dict) matched service
+        @param redis: redis instance
+        @param circuit_breaker_db: mongo collection instance
+        @param request_validator_db: mongo collection instance
+        """
+        service_id = str(service['_id'])
+        rules, breakers, validators, cachers = await Async.all([
+            RateLimiter.get_rule_by_service_id(service_id, redis),
+            CircuitBreaker.get_by_service_id(service_id, circuit_breaker_db),
+            RequestValidator.get_by_service_id(service_id, request_validator_db),
+            EndpointCacher.get_by_service_id(service_id, redis),
+        ])
+        return {
+            'service': service,
+            'rule': rules[0] if rules else None,
+            'breaker': breakers[0] if breakers else None,
+            'validator': validators[0] if validators else None,
+            'cacher': cachers[0] if cachers else None,
+        }
+
+    @staticmethod
+    async def get(service: object, redis: AioRedis, circuit_breaker_db: AsyncIOMotorCollection,
+                  request_validator_db: AsyncIOMotorCollection) -> dict:
+        """
+        gets the policy snapshot of a service, loading it on a cache miss
+
+        @param service: (dict) matched service
+        @param redis: redis instance
+        @param circuit_breaker_db: mongo collection instance
+        @param request_validator_db: mongo collection instance
+        """
+        policy = Policy._cache.get(str(service['_id']))
+        if policy is None:
+            policy = await Policy.load(service, redis, circuit_breaker_db, request_validator_db)
+            Policy._cache.set(str(service['_id']), policy)
+        return pydash.assign({}, policy, {'service': service})
+
+    @staticmethod
+    def invalidate(service_id: str = None):
+        """
+        drops cached snapshots
+
+        @param service_id: (str) service to drop, every snapshot when omitted
+        """
+        if service_id is None:
+            Policy._cache.clear()
+        else:
+            Policy._cache.delete(str(service_id))
@@ -0,0 +1,88 @@
+import asyncio
+import math
+import time
+
+from aioredis import Redis as AioRedis
+
+from flash.models.rate_limiter import RateLimiter, default_algorithm
+from flash.util.cache import TTLCache
+from flash.util.env import LOCAL_QUOTA_MAX_KEYS
+
+default_sync_ms = 1000
+
+
+class LocalQuota:
+    """
+    enforces rate limiter rules in memory from slices of their budget
+
+    a worker leases local_quota_slice requests of a rule's fixed window from redis
+    and spends them without another round trip. unused requests are given back
+    when the lease is renewed, which happens once the slice is spent or after
+    local_quota_sync_ms. the global limit is never exceeded; at most slice
+    requests per worker may be refused early, so the slice is the accuracy bound.
+    the event loop is single threaded, so the counters need no locking
+    """
+    _leases = TTLCache(3600, LOCAL_QUOTA_MAX_KEYS)
+    _pending = {}
+
+    @staticmethod
+    def is_enabled(rule: object) -> bool:
+        """
+        checks if a rule is enforced with a local quota, only fixed window rules are
+
+        @param rule: (dict) rate limiter rule
+        """
+        return bool(rule.get('local_quota_slice')) and int(rule['local_quota_slice']) > 0 and \
+            (rule.get('algorithm') or default_algorithm) == default_algorithm
+
+    @staticmethod
+    def _spend(lease: list, now: float, sync: float):
+        # lease: [requests left, window end, leased at, exhausted]
+        if lease is None or now >= lease[1] or now - lease[2] >= sync:
+            return None
+        if lease[0] > 0:
+            lease[0] -= 1
+            return True, lease[0], 0
+        if lease[3]:
+            return False, 0, int((lease[1] - now) * 1000)
+        return None
+
+    @staticmethod
+    async def _renew(rule: object, key: str, counter_key: str, db: AioRedis):
+        now = time.monotonic()
+        lease = LocalQuota._leases.get(counter_key)
+        returned = lease[0] if lease is not None and now < lease[1] else 0
+        granted, ttl = await RateLimiter.lease(rule, key, int(rule['local_quota_slice']), returned, db)
+        ttl = ttl / 1000 if ttl > 0 else int(rule['timeout'])
+        lease = [granted, now + ttl, now, granted <= 0]
+        LocalQuota._leases.set(counter_key, lease, ttl)
+        return lease
+
+    @staticmethod
+    async def hit(rule: object, key: str, db: AioRedis) -> tuple:
+        """
+        checks and counts a request against the local slice of a rule
+
+        @param rule: (dict) rate limiter rule
+        @param key: (str) client key the rule is counted by, None for one shared counter
+        @param db: redis instance
+        @returns: (allowed, remaining requests in slice, retry after ms)
+        """
+        sync = int(rule.get('local_quota_sync_ms') or default_sync_ms) / 1000
+        counter_key = RateLimiter.counter_key(rule['_id'], key)
+        while True:
+            result = LocalQuota._spend(LocalQuota._leases.get(counter_key), time.monotonic(), sync)
+            if result is not None:
+                return result
+            # one renewal per key at a time, concurrent requests wait for it
+            pending = LocalQuota._pending.get(counter_key)
+            if pending is None:
+                pending = asyncio.ensure_future(LocalQuota._renew(rule, key, counter_key, db))
+                LocalQuota._pending[counter_key] = pending
+                pending.add_done_callback(lambda _: LocalQuota._pending.pop(counter_key, None))
+            lease = await pending
+            if lease[3]:
+                return False, 0, math.ceil(max(lease[1] - time.monotonic(), 0) * 1000)
+            if lease[0] > 0:
+                lease[0] -= 1
+                return True, lease[0], 0
@@ -0,0 +1,198 @@
+import asyncio
+import json
+import time
+
+import pydash
+from aioredis import Redis as AioRedis
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+from flash.models.endpoint_cacher import EndpointCacher
+from flash.models.service import Service, ServiceState
+from flash.proxy.balancer import Balancer
+from flash.proxy.cache_policy import CachePolicy
+from flash.util import Api
+from flash.util.env import ENDPOINT_CACHE_MAX_BODY, ENDPOINT_CACHE_STATS_SYNC, ENDPOINT_CACHE_WARMUP_SIZE, \
+    ENDPOINT_CACHE_WARMUP_CONCURRENCY
+
+endpoint_cache_warmup = 'endpoint_cache_warmup'
+warmup_methods = {'GET', 'HEAD'}
+# recorded contexts are forgotten a day after the last request of their cache
+warmup_timeout = 86400
+# count flushes in flight, referenced until done so they are not garbage collected mid-run
+warmup_flushes = set()
+
+
+class Warmup:
+    """
+    records the most requested contexts of every endpoint cache and replays them
+    against the service targets to fill the cache before real traffic arrives
+
+    only GET and HEAD requests without credentials are recorded, with just the
+    headers the cache key is built from. counts are summed locally and added to
+    a sorted set per cache, which keeps a few times ENDPOINT_CACHE_WARMUP_SIZE
+    contexts so new ones can climb into the replayed top
+    """
+    _seen = {}
+    _seen_at = 0
+
+    @staticmethod
+    def key(_id: str) -> str:
+        """
+        returns key of the sorted set of recorded contexts
+        """
+        return f'{endpoint_cache_warmup}:{_id}'
+
+    @staticmethod
+    def record(endpoint_cacher: object, method: str, path: str, params: dict, headers: dict, db: AioRedis):
+        """
+        counts a request to an endpoint cache
+
+        @param endpoint_cacher: (dict) endpoint cache config
+        @param method: (str) request method
+        @param path: (str) request path
+        @param params: (dict) query params
+        @param headers: (dict) request headers
+        @param db: redis instance
+        """
+        if method.upper() not in warmup_methods:
+            return
+        headers = {name.lower(): value for name, value in headers.items()}
+        if 'authorization' in headers or 'cookie' in headers:
+            return
+        key_headers = {name.lower() for name in CachePolicy.names(endpoint_cacher.get('key_headers'))}
+        ctx = json.dumps({
+            'method': method.upper(),
+            'path': path,
+            'params': sorted(params.items()),
+            'headers': sorted((name, value) for name, value in headers.items() if name in key_headers),
+        }, separators=(',', ':'))
+        seen = Warmup._seen.setdefault(endpoint_cacher['_id'], {})
+        if ctx in seen or len(seen) < ENDPOINT_CACHE_WARMUP_SIZE * 4:
+            seen[ctx] = seen.get(ctx, 0) + 1
+        now = time.monotonic()
+        if now - Warmup._seen_at >= ENDPOINT_CACHE_STATS_SYNC:
+            Warmup._seen_at = now
+            flush = asyncio.ensure_future(Warmup.flush(db))
+            warmup_flushes.add(flush)
+            flush.add_done_callback(warmup_flushes.discard)
+
+    @staticmethod
+    async def flush(db: AioRedis):
+        """
+        adds the locally summed request counts to redis
+
+        @param db: redis instance
+        """
+        seen, Warmup._seen = Warmup._seen, {}
+        if not seen:
+            return
+        try:
+            async with db.pipeline(transaction=False) as pipe:
+                for _id, contexts in seen.items():
+                    key = Warmup.key(_id)
+                    for ctx, count in contexts.items():
+                        pipe.zincrby(key, count, ctx)
+                    pipe.zremrangebyrank(key, 0, -ENDPOINT_CACHE_WARMUP_SIZE * 4 - 1)
+                    pipe.expire(key, warmup_timeout)
+                await pipe.execute()
+        except Exception:
+            # counts are best effort, a lost flush only delays the ranking
+            pass
+
+    @staticmethod
+    async def top(_id: str, limit: int, db: AioRedis) -> list:
+        """
+        gets the most requested contexts of an endpoint cache
+
+        @param _id: (str) id of endpoint cache
+        @param limit: (int) number of contexts
+        @param db: redis instance
+        """
+        contexts = await db.zrevrange(Warmup.key(_id), 0, limit - 1)
+        return [json.loads(ctx) for ctx in contexts]
+
+    @staticmethod
+    async def replay(endpoint_cacher: object, service: object, ctx: object, db: AioRedis) -> str:
+        """
+        requests a recorded context from the service and caches the response
+
+        @param endpoint_cacher: (dict) endpoint cache config
+        @param service: (dict) service of endpoint cache
+        @param ctx: (dict) recorded context
+        @param db: redis instance
+        @returns: warmed, or skipped when cached already or not cacheable
+        """
+        params = dict(ctx['params'])
+        headers = dict(ctx['headers'])
+        _hash = CachePolicy.key(endpoint_cacher, ctx['method'], ctx['path'], params, headers, b'')
+        if await db.exists(_hash):
+            return 'skipped'
+        req = await Api.stream(method=ctx['method'], url=Balancer.pick(service),
+                               params=params, headers=headers, timeout=service.get('timeout'))
+        try:
+            ttl = CachePolicy.ttl(endpoint_cacher, headers, req['status'], req['headers'])
+            if ttl <= 0:
+                return 'skipped'
+            body = bytearray()
+            async for chunk in req['stream']:
+                body.extend(chunk)
+                if len(body) > ENDPOINT_CACHE_MAX_BODY:
+                    return 'skipped'
+        finally:
+            await req['close']()
+        stale = EndpointCacher.stale_window(endpoint_cacher)
+        await EndpointCacher.write(_hash, {
+            'status': req['status'],
+            'content_type': req['content_type'],
+            'headers': req['headers'],
+            'body': bytes(body),
+        }, ttl, db, stale, EndpointCacher.tags(endpoint_cacher, ctx['path'], req['headers']),
+            int(endpoint_cacher['timeout']) + stale)
+        return 'warmed'
+
+    @staticmethod
+    async def run(endpoint_cacher: object, service: object, db: AioRedis, limit: int = None,
+                  concurrency: int = None) -> object:
+        """
+        replays the most requested contexts of an endpoint cache
+
+        @param endpoint_cacher: (dict) endpoint cache config
+        @param service: (dict) service of endpoint cache
+        @param db: redis instance
+        @param limit: (int) number of contexts, ENDPOINT_CACHE_WARMUP_SIZE when omitted
+        @param concurrency: (int) requests in flight, ENDPOINT_CACHE_WARMUP_CONCURRENCY when omitted
+        @returns: number of warmed, skipped and failed contexts
+        """
+        contexts = await Warmup.top(endpoint_cacher['_id'], limit or ENDPOINT_CACHE_WARMUP_SIZE, db)
+        semaphore = asyncio.Semaphore(concurrency or ENDPOINT_CACHE_WARMUP_CONCURRENCY)
+        stats = {'warmed': 0, 'skipped': 0, 'failed': 0}
+
+        async def replay(ctx: object):
+            async with semaphore:
+                try:
+                    stats[await Warmup.replay(endpoint_cacher, service, ctx, db)] += 1
+                except Exception:
+                    stats['failed'] += 1
+
+        await asyncio.gather(*[replay(ctx) for ctx in contexts])
+        return stats
+
+    @staticmethod
+    async def run_all(service_db: AsyncIOMotorCollection, db: AioRedis) -> object:
+        """
+        replays the most requested contexts of every endpoint cache of a service that is up
+
+        @param service_db: mongo collection instance
+        @param db: redis instance
+        @returns: number of warmed, skipped and failed contexts
+        """
+        stats = {'warmed': 0, 'skipped': 0, 'failed': 0}
+        for endpoint_cacher in await EndpointCacher.get_all(db):
+            if pydash.is_empty(endpoint_cacher.get('service_id')):
+                continue
+            service = await Service.get_by_id(endpoint_cacher['service_id'], service_db)
+            if pydash.is_empty(service) or service['state'] != ServiceState.UP.name:
+                continue
+            for key, count in (await Warmup.run(endpoint_cacher, service, db)).items():
+                stats[key] += count
+        return stats
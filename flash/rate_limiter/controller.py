@@ -6,6 +6,7 @@ from fastapi import Request
 from flash.common.error_code import ERROR_SERVER
 from flash.common.resp import resp_error_json, resp_success_json
 from flash.models.rate_limiter import RateLimiter
+from flash.proxy.policy import Policy
 from flash.rate_limiter.schema import rate_limit_entry_validator, rate_limit_rule_validator
 from flash.util import DB
 from flash.util.validate import Validate
@@ -44,7 +45,8 @@ async def create_rule(request: Request):
     try:
         ctx = json.loads(await request.json())
         Validate.validate_schema(ctx, rate_limit_rule_validator)
-        await RateLimiter.create_rule(ctx, DB.get_redis(request))
+        await RateLimiter.create_rule(rate_limit_rule_validator.normalized(ctx), DB.get_redis(request))
+        Policy.invalidate(ctx.get('service_id'))
         return resp_success_json(msg='Created rate limiter rule')
     except Exception as err:
         return resp_error_json(ERROR_SERVER, msg=str(err))
@@ -58,6 +60,7 @@ async def update_rule(request: Request):
         Validate.validate_schema(ctx, rate_limit_rule_validator)
         Validate.validate_object_id(_id)
         await RateLimiter.update_rule(_id, ctx, DB.get_redis(request))
+        Policy.invalidate()
         return resp_success_json(msg='rate limiter rule updated')
     except Exception as err:
         return resp_error_json(ERROR_SERVER, msg=str(err))
@@ -70,6 +73,7 @@ async def delete_rule(request: Request):
         _id = request.query_params.get('id')
         Validate.validate_object_id(_id)
         await RateLimiter.delete_rule(_id, DB.get_redis(request))
+        Policy.invalidate()
         return resp_success_json(msg='rate limiter rule deleted')
     except Exception as err:
         return resp_error_json(ERROR_SERVER, msg=str(err))
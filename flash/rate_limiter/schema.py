@@ -23,6 +23,29 @@ rate_limit_rule_schema = {
     },
     'status_code': {
         'type': 'integer',
+    },
+    'algorithm': {
+        'type': 'string',
+        'allowed': ['fixed_window', 'sliding_window_log', 'sliding_window_counter', 'token_bucket'],
+        'default': 'fixed_window'
+    },
+    'key_by': {
+        'type': 'string',
+        'allowed': ['rule', 'remote_ip', 'header', 'jwt_claim', 'path_group'],
+        'default': 'remote_ip'
+    },
+    'key_name': {
+        'type': 'string'
+    },
+    'local_quota_slice': {
+        'type': 'integer',
+        'min': 1,
+        # slices are leased from a fixed window counter
+        'dependencies': {'algorithm': ['fixed_window']}
+    },
+    'local_quota_sync_ms': {
+        'type': 'integer',
+        'min': 1
     }
 }
 
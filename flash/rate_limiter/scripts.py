@@ -0,0 +1,109 @@
+# redis lua scripts checking and counting a request against a rate limiter rule
+# in one atomic step.
+#
+# KEYS[1]: counter key
+# ARGV[1]: max requests (capacity of the bucket for token_bucket)
+# ARGV[2]: window in milliseconds
+# ARGV[3]: unique id of the request
+#
+# every script returns {allowed (0|1), remaining requests, retry after ms}
+
+_args = """
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+"""
+
+_now = _args + """
+if redis.replicate_commands then redis.replicate_commands() end
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+"""
+
+fixed_window = _args + """
+local count = tonumber(redis.call('GET', KEYS[1]) or '0')
+if count >= limit then
+    return {0, 0, redis.call('PTTL', KEYS[1])}
+end
+count = redis.call('INCR', KEYS[1])
+if count == 1 then
+    redis.call('PEXPIRE', KEYS[1], window)
+end
+return {1, limit - count, 0}
+"""
+
+sliding_window_log = _now + """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local count = redis.call('ZCARD', KEYS[1])
+if count >= limit then
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    return {0, 0, math.max(tonumber(oldest[2]) + window - now, 0)}
+end
+redis.call('ZADD', KEYS[1], now, ARGV[3])
+redis.call('PEXPIRE', KEYS[1], window)
+return {1, limit - count - 1, 0}
+"""
+
+sliding_window_counter = _now + """
+local current = math.floor(now / window)
+local counts = redis.call('HMGET', KEYS[1], current, current - 1)
+local current_count = tonumber(counts[1] or '0')
+local previous_count = tonumber(counts[2] or '0')
+local weight = 1 - (now % window) / window
+local estimate = previous_count * weight + current_count
+if estimate + 1 > limit then
+    return {0, 0, window - now % window}
+end
+redis.call('HINCRBY', KEYS[1], current, 1)
+redis.call('HDEL', KEYS[1], current - 2)
+redis.call('PEXPIRE', KEYS[1], window * 2)
+return {1, math.floor(limit - estimate - 1), 0}
+"""
+
+token_bucket = _now + """
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1])
+local ts = tonumber(bucket[2])
+if tokens == nil or ts == nil then
+    tokens = limit
+    ts = now
+end
+tokens = math.min(limit, tokens + math.max(now - ts, 0) * limit / window)
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    retry_after = math.ceil((1 - tokens) * window / limit)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], window)
+return {allowed, math.floor(tokens), retry_after}
+"""
+
+# leases up to ARGV[3] requests of a fixed window budget to a worker, after
+# giving back the ARGV[4] requests left over from its previous lease.
+# returns {granted requests, window ttl ms}
+lease = _args + """
+local returned = tonumber(ARGV[4])
+if returned > 0 and redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('DECRBY', KEYS[1], returned)
+end
+local count = tonumber(redis.call('GET', KEYS[1]) or '0')
+local granted = math.min(tonumber(ARGV[3]), limit - count)
+if granted <= 0 then
+    return {0, redis.call('PTTL', KEYS[1])}
+end
+count = redis.call('INCRBY', KEYS[1], granted)
+if count == granted then
+    redis.call('PEXPIRE', KEYS[1], window)
+end
+return {granted, redis.call('PTTL', KEYS[1])}
+"""
+
+scripts = {
+    'fixed_window': fixed_window,
+    'sliding_window_log': sliding_window_log,
+    'sliding_window_counter': sliding_window_counter,
+    'token_bucket': token_bucket,
+}
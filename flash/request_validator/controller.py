@@ -7,6 +7,7 @@ from fastapi import Request
 from flash.common.error_code import ERROR_SERVER
 from flash.common.resp import resp_error_json, resp_success_json
 from flash.models.request_validator import RequestValidator
+from flash.proxy.policy import Policy
 from flash.request_validator.schema import request_validator
 from flash.service import controller as service_controller
 from flash.util import DB, Bson
@@ -46,6 +47,7 @@ async def create_handler(request: Request):
         Validate.validate_schema(body, request_validator)
         await RequestValidator.create(request_validator.normalized(body), DB.get(request, table),
                                       DB.get(request, service_controller.table))
+        Policy.invalidate(body.get('service_id'))
 
         return resp_success_json(msg='Request validator created')
     except Exception as err:
@@ -60,6 +62,7 @@ async def update_handler(request: Request):
         Validate.validate_object_id(id)
         Validate.validate_schema(body, request_validator)
         await RequestValidator.update(id, body, DB.get(request, table))
+        Policy.invalidate()
         return resp_success_json(msg='request validator updated')
     except Exception as err:
         return resp_error_json(ERROR_SERVER, msg=str(err))
@@ -71,6 +74,7 @@ async def delete_handler(request: Request):
         id = request.query_params.get('id')
         Validate.validate_object_id(id)
         await RequestValidator.delete(id, DB.get(request, table))
+        Policy.invalidate()
         return resp_success_json(msg='request validator deleted')
     except Exception as err:
         return resp_error_json(ERROR_SERVER, msg=str(err))
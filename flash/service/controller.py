@@ -1,5 +1,7 @@
 import json
 
+import pydash
+
 from aiohttp import web
 from fastapi import APIRouter
 
@@ -10,6 +12,9 @@ from flash.util import DB, Bson
 from flash.util.error import Error
 from flash.util.validate import Validate
 from flash.models.service import Service
+from flash.proxy.balancer import Balancer
+from flash.proxy.health import TargetHealth
+from flash.proxy.policy import Policy
 from fastapi import Request
 
 router = APIRouter()
@@ -55,6 +60,23 @@ async def get_handler(request: Request):
         return resp_error_json(ERROR_SERVER, msg=str(err))
 
 
+@router.get('/service/health')
+async def health_handler(request: Request):
+    try:
+        Validate.validate_object_id(request.query_params.get('id'))
+        service = await Service.get_by_id(request.query_params.get('id'), DB.get(request, table))
+        if service is None:
+            raise Exception({
+                'message': 'Service id provided does not exist',
+                'status_code': 400
+            })
+        outstanding = Balancer.stats(service)
+        return resp_success_json(data=[pydash.assign(stats, {'outstanding': outstanding.get(stats['target'], 0)})
+                                       for stats in TargetHealth.stats(service)])
+    except Exception as err:
+        return resp_error_json(ERROR_SERVER, msg=str(err))
+
+
 @router.patch('/service')
 async def patch_handler(request: Request):
     try:
@@ -63,6 +85,7 @@ async def patch_handler(request: Request):
         Validate.validate_object_id(service_id)
         Validate.validate_schema(ctx, service_validator)
         await Service.update(service_id, ctx, DB.get(request, table))
+        Policy.invalidate(service_id)
 
         return resp_success_json(msg='service updated')
     except Exception as err:
@@ -74,6 +97,7 @@ async def delete_handler(request: Request):
     try:
         Validate.validate_object_id(request.query_params.get('id'))
         await Service.remove(request.query_params.get('id'), DB.get(request, table))
+        Policy.invalidate(request.query_params.get('id'))
         return resp_success_json(msg='service deleted')
     except Exception as err:
         return resp_error_json(ERROR_SERVER, msg=str(err))
@@ -31,6 +31,27 @@ service_schema = {
         'type': 'integer',
         'default': 0,
     },
+    'load_balancer': {
+        'type': 'string',
+        'allowed': ['round_robin', 'weighted_round_robin', 'least_outstanding', 'p2c_ewma', 'consistent_hash'],
+        'default': 'round_robin'
+    },
+    'target_weights': {
+        'type': 'list',
+        'schema': {
+            'type': 'integer',
+            'min': 0
+        },
+        'default': []
+    },
+    'hash_key_by': {
+        'type': 'string',
+        'allowed': ['remote_ip', 'header', 'cookie', 'path'],
+        'default': 'remote_ip'
+    },
+    'hash_key_name': {
+        'type': 'string'
+    },
     'whitelisted_hosts': {
         'type': 'list',
         'schema': {
@@ -49,6 +70,54 @@ service_schema = {
     },
     'public_key': {
         'type': 'string'
+    },
+    'timeout': {
+        'type': 'number',
+        'min': 0
+    },
+    'outlier_consecutive_errors': {
+        'type': 'integer',
+        'min': 0,
+        'default': 5
+    },
+    'outlier_latency_factor': {
+        'type': 'number',
+        'min': 0,
+        'default': 0
+    },
+    'outlier_base_ejection': {
+        'type': 'integer',
+        'min': 0,
+        'default': 30
+    },
+    'outlier_max_ejection': {
+        'type': 'integer',
+        'min': 0,
+        'default': 300
+    },
+    'outlier_max_ejection_percent': {
+        'type': 'integer',
+        'min': 0,
+        'max': 100,
+        'default': 50
+    },
+    'health_check_path': {
+        'type': 'string',
+        'regex': r'^/.*$'
+    },
+    'health_check_interval': {
+        'type': 'integer',
+        'min': 1,
+        'default': 10
+    },
+    'health_check_timeout': {
+        'type': 'number',
+        'min': 0,
+        'default': 2
+    },
+    'insights_retention': {
+        'type': 'integer',
+        'min': 1
     }
 }
 
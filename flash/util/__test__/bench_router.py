@@ -0,0 +1,77 @@
+"""
+micro benchmark of the route matcher against the linear compiled scan
+
+run with: python -m flash.util.__test__.bench_router
+"""
+import random
+import re
+import timeit
+
+from flash.util.router import Router
+
+
+def build_routes(count: int) -> list:
+    """
+    builds a mix of literal prefixed and prefix-less service paths
+
+    @param count: (int) number of routes
+    """
+    routes = []
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            routes.append(rf'/api/v1/svc{i}/(\w+)')
+        elif kind == 1:
+            routes.append(rf'/api/v1/svc{i}/(\w+)/(\d+)')
+        elif kind == 2:
+            routes.append(rf'/static/s{i}/(.*)')
+        else:
+            routes.append(rf'/(v\d)/svc{i}/(\w+)')
+    return routes
+
+
+def linear_match(compiled: list, path: str):
+    best = None
+    best_groups = 0
+    for pattern in compiled:
+        if pattern.groups > best_groups:
+            match = pattern.match(path)
+            if match:
+                best = (pattern, match.groups())
+                best_groups = pattern.groups
+    return best
+
+
+def bench(count: int, lookups: int = 2000):
+    routes = build_routes(count)
+    compiled = [re.compile(route) for route in routes]
+    router = Router()
+    for index, pattern in enumerate(compiled):
+        router.add(str(index), pattern, pattern)
+
+    rand = random.Random(count)
+    paths = []
+    for _ in range(lookups):
+        i = rand.randrange(count)
+        paths.append(rand.choice([
+            f'/api/v1/svc{i}/users/42',
+            f'/static/s{i}/app.js',
+            f'/v2/svc{i}/items',
+            '/unknown/path',
+        ]))
+
+    for path in paths[:200]:
+        expected = linear_match(compiled, path)
+        actual = router.match(path)
+        assert (expected and expected[0]) is (actual and actual[0]), path
+
+    router.match(paths[0])
+    linear = timeit.timeit(lambda: [linear_match(compiled, path) for path in paths], number=1)
+    routed = timeit.timeit(lambda: [router.match(path) for path in paths], number=1)
+    print(f'{count:>6} routes  linear {linear / lookups * 1e6:10.1f} us/lookup  '
+          f'router {routed / lookups * 1e6:8.1f} us/lookup  x{linear / routed:.1f}')
+
+
+if __name__ == '__main__':
+    for count in [10, 100, 1000, 10000]:
+        bench(count)
@@ -0,0 +1,74 @@
+import time
+
+from flash.util.cache import TTLCache, LRUCache
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(60, 10)
+    cache.set('a', 1)
+    cache.set('b', 2, ttl=0)
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert 'b' not in cache
+    assert len(cache) == 1
+
+
+def test_ttl_cache_evicts_the_oldest_when_full():
+    cache = TTLCache(60, 2)
+    for key in ['a', 'b', 'c']:
+        cache.set(key, key)
+    assert cache.get('a') is None
+    assert cache.get('b') == 'b' and cache.get('c') == 'c'
+    # setting a key again makes it the newest
+    cache.set('b', 'b')
+    cache.set('d', 'd')
+    assert cache.get('c') is None and cache.get('b') == 'b'
+
+
+def test_ttl_cache_delete_and_clear():
+    cache = TTLCache(60, 10)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.delete('a')
+    assert cache.get('a', 'missing') == 'missing'
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_ttl_cache_entry_lives_its_ttl():
+    cache = TTLCache(0.05, 10)
+    cache.set('a', 1)
+    time.sleep(0.06)
+    assert cache.get('a') is None
+
+
+def test_lru_cache_evicts_the_least_recently_used():
+    cache = LRUCache(2, 1000)
+    cache.set('a', 1, 60, 1)
+    cache.set('b', 2, 60, 1)
+    # reading a makes b the least recently used
+    assert cache.get('a') == 1
+    cache.set('c', 3, 60, 1)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+
+
+def test_lru_cache_is_bounded_by_bytes():
+    cache = LRUCache(10, 100)
+    cache.set('a', 'a', 60, 60)
+    cache.set('b', 'b', 60, 60)
+    assert cache.get('a') is None
+    assert cache.bytes == 60
+    # a value bigger than the cache is not kept
+    cache.set('c', 'c', 60, 101)
+    assert cache.get('c') is None and cache.get('b') == 'b'
+
+
+def test_lru_cache_entries_carry_their_ttl():
+    cache = LRUCache(10, 100)
+    cache.set('a', 'a', 0.05, 1)
+    cache.set('b', 'b', 0, 1)
+    assert cache.get('b') is None
+    time.sleep(0.06)
+    assert cache.get('a') is None
+    assert cache.bytes == 0
@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+
+from flash.util import DB
+
+fakeredis = pytest.importorskip('fakeredis.aioredis')
+
+
+def test_set_index_moves_ids_between_values():
+    async def run():
+        db = fakeredis.FakeRedis(decode_responses=True)
+        await DB.set_index('a', 's1', 'index', db)
+        await DB.set_index('b', 's1', 'index', db)
+        await DB.set_index('a', 's2', 'index', db)
+        return sorted(await DB.search_index('index', 's1', db)), await DB.search_index('index', 's2', db)
+
+    assert asyncio.run(run()) == (['b'], ['a'])
+
+
+def test_clear_index_removes_the_id():
+    async def run():
+        db = fakeredis.FakeRedis(decode_responses=True)
+        await DB.set_index('a', 's1', 'index', db)
+        await DB.clear_index('a', 'index', db)
+        return await DB.search_index('index', 's1', db), await db.hget('index', 'a')
+
+    assert asyncio.run(run()) == ([], None)
+
+
+def test_rebuild_index_from_the_forward_hash():
+    async def run():
+        db = fakeredis.FakeRedis()
+        await db.hset('index', mapping={'a': 's1', 'b': 's1', 'c': 's2'})
+        count = await DB.rebuild_index('index', db)
+        return count, sorted(await DB.search_index('index', 's1', db))
+
+    assert asyncio.run(run()) == (3, ['a', 'b'])
@@ -0,0 +1,86 @@
+import asyncio
+import json
+
+from aiohttp import web
+
+from flash.util import Api
+from flash.util.http import Http
+
+
+async def start_upstream():
+    async def login(request):
+        response = web.json_response({'cookies': dict(request.cookies)})
+        response.set_cookie('session', 'user-a-secret')
+        return response
+
+    async def echo(request):
+        return web.json_response({'cookies': dict(request.cookies)})
+
+    app = web.Application()
+    app.router.add_get('/login', login)
+    app.router.add_get('/echo', echo)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    # the default cookie jar ignores ip hosts, so the upstream is reached by name
+    return runner, f'http://localhost:{site._server.sockets[0].getsockname()[1]}'
+
+
+async def read_cookies(url: str, cookies: dict = None) -> dict:
+    req = await Api.stream(method='GET', url=url, cookies=cookies)
+    body = b''.join([chunk async for chunk in req['stream']])
+    return json.loads(body)['cookies']
+
+
+def test_upstream_cookies_are_not_shared_between_clients():
+    async def run():
+        runner, base = await start_upstream()
+        try:
+            await Http.start()
+            # client a logs in, client b comes after it on the same session
+            await read_cookies(f'{base}/login')
+            client_b = await read_cookies(f'{base}/echo')
+            client_c = await read_cookies(f'{base}/echo', {'theme': 'dark'})
+            return client_b, client_c
+        finally:
+            await Http.close()
+            await runner.cleanup()
+
+    client_b, client_c = asyncio.run(run())
+    assert client_b == {}
+    assert client_c == {'theme': 'dark'}
+
+
+def test_upstream_connections_are_kept_alive():
+    peers = []
+
+    async def run():
+        async def peer(request):
+            peers.append(request.transport.get_extra_info('peername'))
+            return web.json_response({'cookies': {}})
+
+        app = web.Application()
+        app.router.add_get('/peer', peer)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        try:
+            await Http.start()
+            session = await Http.session()
+            for _ in range(3):
+                await read_cookies(f'http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/peer')
+            return session is await Http.session()
+        finally:
+            await Http.close()
+            await runner.cleanup()
+
+    assert asyncio.run(run())
+    # every call went over the same pooled connection
+    assert len(set(peers)) == 1
+
+
+def test_timeout_falls_back_to_the_default():
+    assert Http.timeout(None).total == Http._options['timeout']
+    assert Http.timeout(2).total == 2
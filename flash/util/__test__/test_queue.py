@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from flash.util.queue import Background
+
+
+@pytest.fixture(autouse=True)
+def queue(monkeypatch):
+    monkeypatch.setattr(Background, '_queue', None)
+    monkeypatch.setattr(Background, '_stopped', False)
+    monkeypatch.setattr(Background, '_workers', [])
+    monkeypatch.setattr(Background, '_stats', {'done': 0, 'failed': 0, 'dropped': 0})
+
+
+def test_runs_queued_jobs_and_counts_failures():
+    done = []
+
+    async def job(value):
+        done.append(value)
+
+    async def failing():
+        raise ValueError('boom')
+
+    async def run():
+        Background.start(workers=2)
+        queued = [await Background.put(job, 1), await Background.put(failing), await Background.put(job, 2)]
+        await Background.stop()
+        return queued
+
+    assert asyncio.run(run()) == [True, True, True]
+    assert sorted(done) == [1, 2]
+    assert Background.stats() == {'done': 2, 'failed': 1, 'dropped': 0, 'depth': 0}
+
+
+def test_drops_jobs_when_full():
+    async def job():
+        await asyncio.sleep(1)
+
+    async def run():
+        Background.start(size=1, workers=1, put_timeout=0.01)
+        # the worker takes the first job, the second fills the queue
+        queued = [await Background.put(job)]
+        await asyncio.sleep(0)
+        queued += [await Background.put(job), await Background.put(job)]
+        await Background.stop(timeout=0)
+        return queued
+
+    assert asyncio.run(run()) == [True, True, False]
+    assert Background.stats()['dropped'] == 1
+
+
+def test_drops_jobs_once_stopping():
+    async def job():
+        pass
+
+    async def run():
+        Background.start()
+        await Background.stop()
+        return await Background.put(job)
+
+    assert asyncio.run(run()) is False
+    assert Background._queue is None
+    assert Background.stats()['dropped'] == 1
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from flash.util.regex import Regex
+from flash.util.router import Router
+
+
+class Collection:
+    """
+    service collection answering find with fixed documents
+    """
+
+    def __init__(self, documents: list):
+        self.documents = documents
+        self.finds = 0
+
+    def find(self, query: dict):
+        self.finds += 1
+
+        async def documents():
+            for document in self.documents:
+                yield document
+
+        return documents()
+
+
+@pytest.fixture(autouse=True)
+def routes(monkeypatch):
+    monkeypatch.setattr(Regex, '_routes', Router())
+    monkeypatch.setattr(Regex, '_loaded_at', None)
+    monkeypatch.setattr(Regex, '_lock', None)
+
+
+def test_match_loads_the_route_table_once():
+    db = Collection([
+        {'_id': 's1', 'path': r'/users/(\w+)'},
+        {'_id': 's2', 'path': r'/users/(\w+)/posts/(\w+)'},
+        {'_id': 's3'},
+    ])
+
+    async def run():
+        return [await Regex.match(path, db) for path in ['/users/1', '/users/1/posts/2', '/other']]
+
+    users, posts, other = asyncio.run(run())
+    assert db.finds == 1
+    assert users['_id'] == 's1' and users['regex_groups'] == ('1',)
+    # the route with the most groups wins
+    assert posts['_id'] == 's2' and posts['regex_groups'] == ('1', '2')
+    assert other is None
+
+
+def test_invalidate_reloads_on_next_lookup():
+    db = Collection([{'_id': 's1', 'path': r'/users/(\w+)'}])
+
+    async def run():
+        await Regex.match('/users/1', db)
+        db.documents = []
+        Regex.invalidate()
+        return await Regex.match('/users/1', db)
+
+    assert asyncio.run(run()) is None
+    assert db.finds == 2
+
+
+def test_set_and_remove_route():
+    Regex.set_route({'_id': 's1', 'path': r'/users/(\w+)'})
+    assert Regex.match_routes('/users/1')['_id'] == 's1'
+    # an invalid path takes the service out of the table
+    Regex.set_route({'_id': 's1', 'path': r'/users/(\w+'})
+    assert Regex.match_routes('/users/1') is None
+    Regex.set_route({'_id': 's1', 'path': r'/users/(\w+)'})
+    Regex.remove_route('s1')
+    assert Regex.match_routes('/users/1') is None
+
+
+def test_update_route_replaces_lists():
+    Regex.set_route({
+        '_id': 'r1',
+        'path': r'/svc/(\w+)',
+        'targets': ['http://x', 'http://y'],
+        'whitelisted_hosts': ['10.0.0.1', '10.0.0.2'],
+    })
+    Regex.update_route('r1', {'targets': ['http://z'], 'whitelisted_hosts': []})
+    service = Regex.match_routes('/svc/users')
+    assert service['targets'] == ['http://z']
+    assert service['whitelisted_hosts'] == []
+    assert service['regex_groups'] == ('users',)
@@ -0,0 +1,59 @@
+import re
+
+from flash.util.__test__.bench_router import build_routes, linear_match
+from flash.util.router import Router
+
+
+def build_router(patterns: list) -> Router:
+    router = Router()
+    for i, pattern in enumerate(patterns):
+        router.add(str(i), re.compile(pattern), {'_id': str(i), 'path': pattern})
+    return router
+
+
+def test_match_prefers_most_groups():
+    router = build_router([r'/api/(\w+)', r'/api/(\w+)/(\d+)'])
+    payload, groups = router.match('/api/users/42')
+    assert payload['_id'] == '1'
+    assert groups == ('users', '42')
+
+
+def test_match_prefers_earliest_on_ties():
+    router = build_router([r'/api/(\w+)', r'/(api)/users'])
+    payload, _ = router.match('/api/users')
+    assert payload['_id'] == '0'
+
+
+def test_match_without_literal_prefix():
+    router = build_router([r'/(v\d)/svc/(\w+)'])
+    payload, groups = router.match('/v2/svc/items')
+    assert payload['_id'] == '0'
+    assert groups == ('v2', 'items')
+
+
+def test_routes_without_groups_never_win():
+    router = build_router([r'/api/users'])
+    assert router.match('/api/users') is None
+    assert len(router) == 0
+
+
+def test_replace_and_remove():
+    router = build_router([r'/api/(\w+)'])
+    router.add('0', re.compile(r'/other/(\w+)'), {'_id': '0'})
+    assert router.match('/api/users') is None
+    assert router.match('/other/users')[0] == {'_id': '0'}
+    router.remove('0')
+    assert router.match('/other/users') is None
+    assert router.get('0') is None
+
+
+def test_match_agrees_with_linear_scan():
+    compiled = [re.compile(route) for route in build_routes(200)]
+    router = Router()
+    for i, pattern in enumerate(compiled):
+        router.add(str(i), pattern, pattern)
+    for i in range(200):
+        for path in [f'/api/v1/svc{i}/users/42', f'/static/s{i}/app.js', f'/v2/svc{i}/items', '/unknown/path']:
+            expected = linear_match(compiled, path)
+            actual = router.match(path)
+            assert (expected and expected[0]) is (actual and actual[0]), path
@@ -0,0 +1,49 @@
+import asyncio
+
+from flash.util.singleflight import SingleFlight
+
+
+def test_followers_share_the_leader_result():
+    async def run():
+        flights = SingleFlight()
+        flight = flights.lead('key')
+        assert flights.join('key') is flight
+        waiter = asyncio.ensure_future(SingleFlight.wait(flights.join('key'), 1))
+        flights.land('key', flight, 'result')
+        assert await waiter == 'result'
+        assert flights.join('key') is None
+
+    asyncio.run(run())
+
+
+def test_wait_gives_up_after_timeout():
+    async def run():
+        flights = SingleFlight()
+        flight = flights.lead('key')
+        assert await SingleFlight.wait(flight, 0.01) is None
+        # the flight itself is not cancelled by a follower giving up
+        assert not flight.done()
+
+    asyncio.run(run())
+
+
+def test_flight_lands_after_its_timeout():
+    async def run():
+        flights = SingleFlight()
+        flight = flights.lead('key', 0.01)
+        await asyncio.sleep(0.05)
+        assert flight.done() and flight.result() is None
+        assert flights.join('key') is None
+
+    asyncio.run(run())
+
+
+def test_land_of_a_replaced_flight_keeps_the_new_one():
+    async def run():
+        flights = SingleFlight()
+        old = flights.lead('key')
+        new = flights.lead('key')
+        flights.land('key', old, None)
+        assert flights.join('key') is new
+
+    asyncio.run(run())
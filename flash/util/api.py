@@ -5,17 +5,29 @@ import requests
 from motor.motor_asyncio import AsyncIOMotorClient
 
 from flash.util import Bytes
+from flash.util.http import Http
+from flash.util.promise import Async
+
+# headers that only apply to a single connection, plus the ones aiohttp
+# invalidates by decompressing the body it hands back
+hop_by_hop_headers = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te', 'trailer',
+    'transfer-encoding', 'upgrade', 'content-length', 'content-encoding',
+}
 
 
 class Api:
     @staticmethod
-    async def call(method=None, url=None, params=None, data=None, json=None, cookies=None, headers=None, auth=None):
+    async def call(method=None, url=None, params=None, data=None, json=None, cookies=None, headers=None, auth=None,
+                   timeout=None):
         """
         makes a request
 
         @returns: request response
         """
-        async with aiohttp.request(method=method, url=url, params=params, data=data, json=json, cookies=cookies, headers=headers, auth=auth) as response:
+        session = await Http.session()
+        async with session.request(method=method, url=url, params=params, data=data, json=json, cookies=cookies,
+                                   headers=headers, auth=auth, timeout=Http.timeout(timeout)) as response:
             return {
                 'headers': dict(response.headers),
                 'body_bytes': Bytes.encode_bytes(await response.read()).decode('utf-8'),
@@ -29,6 +41,51 @@ class Api:
                 'url': str(response.url),
             }
 
+    @staticmethod
+    async def stream(method=None, url=None, params=None, data=None, json=None, cookies=None, headers=None, auth=None,
+                     timeout=None, chunk_size=65536):
+        """
+        makes a request without reading its body
+
+        the body is exposed as an async iterator of chunks, iterating it to the end
+        or calling close hands the connection back to the pool
+
+        @returns: request response
+        """
+        session = await Http.session()
+        response = await session.request(method=method, url=url, params=params, data=data, json=json,
+                                         cookies=cookies, headers=headers, auth=auth, timeout=Http.timeout(timeout))
+
+        async def close():
+            response.release()
+
+        async def chunks():
+            try:
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    yield chunk
+            finally:
+                await close()
+
+        return {
+            'headers': Api.pass_headers(response.headers.items()),
+            'content_length': response.content_length,
+            'content_type': response.content_type,
+            'status': int(response.status),
+            'url': str(response.url),
+            'stream': chunks(),
+            'close': close,
+        }
+
+    @staticmethod
+    def pass_headers(headers) -> list:
+        """
+        filters out hop by hop headers
+
+        @param headers: (iterable) header name and value pairs
+        @returns: list of headers safe to pass on
+        """
+        return [[key, value] for key, value in headers if key.lower() not in hop_by_hop_headers]
+
     @staticmethod
     async def batch(requests: list) -> list:
         """
@@ -0,0 +1,132 @@
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    size bounded in process cache whose entries expire after a ttl
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self._lookup(key) is not None
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            self._entries.pop(key, None)
+            return None
+        return entry
+
+    def get(self, key, default=None):
+        """
+        gets a value that has not expired yet
+
+        @param key: key of value
+        @param default: returned when key is missing or expired
+        """
+        entry = self._lookup(key)
+        return default if entry is None else entry[1]
+
+    def set(self, key, value, ttl: float = None):
+        """
+        sets a value, evicting the oldest entries when full
+
+        @param key: key of value
+        @param value: value to store
+        @param ttl: (float) seconds to keep value, defaults to cache ttl
+        """
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """
+        deletes a value
+
+        @param key: key of value
+        """
+        self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        deletes every value
+        """
+        self._entries.clear()
+
+
+class LRUCache:
+    """
+    in process cache bounded by entry count and total bytes, evicting the least
+    recently used entries first. every entry carries its own ttl
+    """
+
+    def __init__(self, max_size: int, max_bytes: int):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """
+        gets a value that has not expired yet and marks it as recently used
+
+        @param key: key of value
+        @param default: returned when key is missing or expired
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        if entry[0] <= time.monotonic():
+            self.delete(key)
+            return default
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def set(self, key, value, ttl: float, size: int):
+        """
+        sets a value, evicting least recently used entries when over a bound
+
+        @param key: key of value
+        @param value: value to store
+        @param ttl: (float) seconds to keep value
+        @param size: (int) bytes accounted for value
+        """
+        self.delete(key)
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        self._entries[key] = (time.monotonic() + ttl, value, size)
+        self.bytes += size
+        while len(self._entries) > self.max_size or self.bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= evicted[2]
+
+    def delete(self, key):
+        """
+        deletes a value
+
+        @param key: key of value
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def clear(self):
+        """
+        deletes every value
+        """
+        self._entries.clear()
+        self.bytes = 0
@@ -1,28 +1,38 @@
+import asyncio
 import pydash
-from aiohttp import web
 from aioredis import Redis
 from motor.motor_asyncio import AsyncIOMotorCollection
+from starlette.requests import HTTPConnection
 
 
 class DB:
     @staticmethod
-    def get(request: web.Request, collection: str) -> AsyncIOMotorCollection:
+    def get(request: HTTPConnection, collection: str) -> AsyncIOMotorCollection:
         """
-        gets a mongo collection instance
+        gets a mongo collection instance from the pooled client of the app
 
-        @param request: (Request) aiohttp request instance
+        @param request: (Request) fastapi request instance
         @param collection: (str) name of collection to get
         """
-        return request.app['mongo'][collection]
+        return request.app.state.mongo[collection]
 
     @staticmethod
-    def get_redis(request: web.Request) -> Redis:
+    def get_redis(request: HTTPConnection) -> Redis:
         """
-        gets redis instance
+        gets the pooled redis instance of the app, usable as a fastapi dependency
 
-        @param request: (Request) aiohttp request instance
+        @param request: (Request) fastapi request instance
         """
-        return request.app['redis']
+        return request.app.state.redis
+
+    @staticmethod
+    def get_redis_bytes(request: HTTPConnection) -> Redis:
+        """
+        gets the pooled redis instance of the app returning raw bytes
+
+        @param request: (Request) fastapi request instance
+        """
+        return request.app.state.redis_bytes
 
     @staticmethod
     def format_document(document: object) -> object:
@@ -45,6 +55,25 @@ class DB:
         return list(
             map(lambda document: DB.format_document(document), documents))
 
+    @staticmethod
+    def decode(value):
+        """
+        decodes a redis reply that may or may not be bytes
+
+        @param value: reply to decode
+        """
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    @staticmethod
+    def index_key(index: str, value) -> str:
+        """
+        gets the key of the reverse index set holding ids for a value
+
+        @param index: (str) name of index
+        @param value: indexed value
+        """
+        return f'{index}:{DB.decode(value)}'
+
     @staticmethod
     async def fetch_members(key: str, db: Redis) -> list:
         """
@@ -53,4 +82,80 @@ class DB:
         @param key: (str) id of set to get
         @param db: (Redis) redis instance
         """
-        return await db.smembers(key, encoding='utf-8')
+        return [DB.decode(member) for member in await db.smembers(key)]
+
+    @staticmethod
+    async def set_index(_id: str, value, index: str, db: Redis):
+        """
+        points the forward index of an id at value and moves the id to the
+        reverse index set of that value
+
+        @param _id: (str) id of indexed entity
+        @param value: indexed value
+        @param index: (str) name of index
+        @param db: (Redis) redis instance
+        """
+        value = str(value)
+        old = DB.decode(await db.hget(index, _id))
+        if old is not None and old != value:
+            await db.srem(DB.index_key(index, old), _id)
+        await asyncio.gather(
+            db.hset(index, _id, value),
+            db.sadd(DB.index_key(index, value), _id),
+        )
+
+    @staticmethod
+    async def clear_index(_id: str, index: str, db: Redis):
+        """
+        removes an id from a forward index and its reverse index set
+
+        @param _id: (str) id of indexed entity
+        @param index: (str) name of index
+        @param db: (Redis) redis instance
+        """
+        old = await db.hget(index, _id)
+        if old is not None:
+            await db.srem(DB.index_key(index, old), _id)
+        await db.hdel(index, _id)
+
+    @staticmethod
+    async def search_index(index: str, value, db: Redis) -> list:
+        """
+        gets the ids indexed under a value
+
+        @param index: (str) name of index
+        @param value: indexed value
+        @param db: (Redis) redis instance
+        """
+        members = await db.smembers(DB.index_key(index, str(value)))
+        return [DB.decode(member) for member in members]
+
+    @staticmethod
+    async def scan_index(index: str, db: Redis):
+        """
+        iterates over a forward index a page at a time
+
+        @param index: (str) name of index
+        @param db: (Redis) redis instance
+        @returns: async iterator of lists of (id, value)
+        """
+        cur = b'0'
+        while cur:
+            cur, vals = await db.hscan(index, cur)
+            items = vals.items() if isinstance(vals, dict) else vals
+            yield [(DB.decode(key), DB.decode(value)) for key, value in items]
+
+    @staticmethod
+    async def rebuild_index(index: str, db: Redis) -> int:
+        """
+        rebuilds the reverse index sets of a forward index
+
+        @param index: (str) name of index
+        @param db: (Redis) redis instance
+        @returns: number of indexed ids
+        """
+        count = 0
+        async for page in DB.scan_index(index, db):
+            await asyncio.gather(*[db.sadd(DB.index_key(index, value), _id) for _id, value in page])
+            count += len(page)
+        return count
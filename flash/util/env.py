@@ -7,3 +7,19 @@ JWT_SECRET = os.getenv('JWT_SECRET')
 REDIS = os.getenv('REDIS')
 RAVEN_ADMIN_USER = os.getenv('RAVEN_ADMIN_USER')
 RAVEN_ADMIN_PASS = os.getenv('RAVEN_ADMIN_PASS')
+ROUTE_TABLE_TTL = float(os.getenv('ROUTE_TABLE_TTL') or 30)
+POLICY_CACHE_TTL = float(os.getenv('POLICY_CACHE_TTL') or 5)
+POLICY_CACHE_SIZE = int(os.getenv('POLICY_CACHE_SIZE') or 10000)
+LOCAL_QUOTA_MAX_KEYS = int(os.getenv('LOCAL_QUOTA_MAX_KEYS') or 100000)
+ENDPOINT_CACHE_MAX_BODY = int(os.getenv('ENDPOINT_CACHE_MAX_BODY') or 1024 * 1024)
+ENDPOINT_CACHE_L1_SIZE = int(os.getenv('ENDPOINT_CACHE_L1_SIZE') or 10000)
+ENDPOINT_CACHE_L1_BYTES = int(os.getenv('ENDPOINT_CACHE_L1_BYTES') or 64 * 1024 * 1024)
+ENDPOINT_CACHE_L1_TTL = float(os.getenv('ENDPOINT_CACHE_L1_TTL') or 5)
+ENDPOINT_CACHE_STATS_SYNC = float(os.getenv('ENDPOINT_CACHE_STATS_SYNC') or 5)
+# gzip, zstd (needs the zstandard package) or none
+ENDPOINT_CACHE_COMPRESSION = os.getenv('ENDPOINT_CACHE_COMPRESSION') or 'gzip'
+ENDPOINT_CACHE_COMPRESS_MIN = int(os.getenv('ENDPOINT_CACHE_COMPRESS_MIN') or 1024)
+ENDPOINT_CACHE_PURGE_BATCH = int(os.getenv('ENDPOINT_CACHE_PURGE_BATCH') or 500)
+ENDPOINT_CACHE_WARMUP_SIZE = int(os.getenv('ENDPOINT_CACHE_WARMUP_SIZE') or 100)
+ENDPOINT_CACHE_WARMUP_CONCURRENCY = int(os.getenv('ENDPOINT_CACHE_WARMUP_CONCURRENCY') or 8)
+CIRCUIT_BREAKER_SYNC = float(os.getenv('CIRCUIT_BREAKER_SYNC') or 1)
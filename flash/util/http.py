@@ -0,0 +1,73 @@
+import aiohttp
+
+
+class Http:
+    """
+    long lived upstream http client of a worker
+
+    one session with a pooled connector is shared by every upstream call so
+    keep-alive connections and resolved hosts are reused across requests. it
+    keeps no cookies, an upstream call only carries the cookies of its caller
+    """
+    _session = None
+    _options = {
+        'limit': 100,
+        'limit_per_host': 0,
+        'dns_cache_ttl': 300,
+        'keepalive_timeout': 15,
+        'timeout': 30,
+    }
+
+    @staticmethod
+    async def start(**options):
+        """
+        creates the shared session
+
+        @param limit: (int) max open connections
+        @param limit_per_host: (int) max open connections per target host, 0 for no limit
+        @param dns_cache_ttl: (int) seconds to cache resolved hosts
+        @param keepalive_timeout: (float) seconds to keep idle connections open
+        @param timeout: (float) default total timeout of a request in seconds
+        """
+        await Http.close()
+        Http._options = {**Http._options, **{key: value for key, value in options.items() if value is not None}}
+        connector = aiohttp.TCPConnector(
+            limit=Http._options['limit'],
+            limit_per_host=Http._options['limit_per_host'],
+            use_dns_cache=True,
+            ttl_dns_cache=Http._options['dns_cache_ttl'],
+            keepalive_timeout=Http._options['keepalive_timeout'],
+        )
+        Http._session = aiohttp.ClientSession(
+            connector=connector,
+            # the session is shared by every client, so upstream cookies must not be kept in it
+            cookie_jar=aiohttp.DummyCookieJar(),
+            timeout=aiohttp.ClientTimeout(total=Http._options['timeout']),
+        )
+
+    @staticmethod
+    async def close():
+        """
+        closes the shared session and its connections
+        """
+        if Http._session is not None:
+            session, Http._session = Http._session, None
+            await session.close()
+
+    @staticmethod
+    async def session() -> aiohttp.ClientSession:
+        """
+        gets the shared session, creating it with the current options if needed
+        """
+        if Http._session is None or Http._session.closed:
+            await Http.start()
+        return Http._session
+
+    @staticmethod
+    def timeout(seconds) -> aiohttp.ClientTimeout:
+        """
+        gets a request timeout, falling back to the default timeout
+
+        @param seconds: total seconds a request may take
+        """
+        return aiohttp.ClientTimeout(total=float(seconds or Http._options['timeout']))
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+
+_default_options = {
+    'size': 10000,
+    'workers': 4,
+    'put_timeout': 0.05,
+}
+logger = logging.getLogger(__name__)
+
+
+class Background:
+    """
+    bounded in-process queue for fire and forget side effects of a request
+
+    jobs are coroutine functions run by a few worker tasks of the event loop.
+    nothing is persisted, so jobs that have to survive a restart or run later
+    belong to celery. when the queue is full a caller waits up to put_timeout
+    for room and the job is dropped after that, so a slow database slows the
+    requests down a little instead of growing memory without bound.
+    once stop has begun new jobs are dropped, so shutdown can not start the
+    queue again
+    """
+    _queue = None
+    _stopped = False
+    _workers = []
+    _options = dict(_default_options)
+    _stats = {'done': 0, 'failed': 0, 'dropped': 0}
+
+    @staticmethod
+    def start(**options):
+        """
+        creates the queue and its workers, call once per worker process
+
+        @param options: size, workers and put_timeout overriding the defaults
+        """
+        Background._options = dict(_default_options, **{key: value for key, value in options.items()
+                                                         if value is not None})
+        Background._stopped = False
+        Background._queue = asyncio.Queue(Background._options['size'])
+        Background._workers = [asyncio.ensure_future(Background._work(Background._queue))
+                               for _ in range(Background._options['workers'])]
+
+    @staticmethod
+    async def stop(timeout: float = 5):
+        """
+        runs the queued jobs for at most timeout seconds and stops the workers
+
+        @param timeout: (float) seconds to wait for queued jobs
+        """
+        Background._stopped = True
+        queue, workers = Background._queue, Background._workers
+        Background._queue, Background._workers = None, []
+        if queue is None:
+            return
+        try:
+            await asyncio.wait_for(queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    @staticmethod
+    async def _work(queue: asyncio.Queue):
+        while True:
+            func, args, kwargs = await queue.get()
+            try:
+                await func(*args, **kwargs)
+                Background._stats['done'] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                Background._stats['failed'] += 1
+                logger.exception('background job %s failed', getattr(func, '__qualname__', func))
+            finally:
+                queue.task_done()
+
+    @staticmethod
+    async def put(func, *args, **kwargs) -> bool:
+        """
+        queues a job, starting the queue with default options when needed
+
+        @param func: coroutine function to run
+        @param args: positional args of func
+        @param kwargs: keyword args of func
+        @returns: if the job was queued, False when it was dropped
+        """
+        if Background._stopped:
+            Background._stats['dropped'] += 1
+            return False
+        if Background._queue is None:
+            Background.start(**Background._options)
+        item = (func, args, kwargs)
+        try:
+            Background._queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            pass
+        try:
+            await asyncio.wait_for(Background._queue.put(item), Background._options['put_timeout'])
+            return True
+        except asyncio.TimeoutError:
+            Background._stats['dropped'] += 1
+            return False
+
+    @staticmethod
+    def stats() -> dict:
+        """
+        gets depth and job counters of the queue
+        """
+        return dict(Background._stats, depth=Background._queue.qsize() if Background._queue is not None else 0)
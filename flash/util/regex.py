@@ -1,9 +1,18 @@
+import asyncio
+import time
 import pydash
 import re
 from motor.motor_asyncio import AsyncIOMotorCollection
 
+from flash.util.env import ROUTE_TABLE_TTL
+from flash.util.router import Router
+
 
 class Regex:
+    _routes = Router()
+    _loaded_at = None
+    _lock = None
+
     @staticmethod
     def best_match(entities: list):
         best = {
@@ -26,3 +35,140 @@ class Regex:
                 match and matches.append(pydash.merge(
                     ctx, {'regex_groups': match.groups()}))
         return matches
+
+    @staticmethod
+    def compile_route(service: object):
+        """
+        compiles the path of a service
+
+        @param service: (dict) service document
+        @returns: compiled pattern or None if service has no usable path
+        """
+        if not pydash.has(service, 'path'):
+            return None
+        try:
+            return re.compile(service['path'])
+        except re.error:
+            return None
+
+    @staticmethod
+    def set_route(service: object):
+        """
+        adds or replaces a service in the route table
+
+        @param service: (dict) service document
+        """
+        if pydash.is_empty(service) or '_id' not in service:
+            return
+        pattern = Regex.compile_route(service)
+        if pattern is None:
+            Regex._routes.remove(str(service['_id']))
+        else:
+            Regex._routes.add(str(service['_id']), pattern, service)
+
+    @staticmethod
+    def update_route(_id: str, ctx: object):
+        """
+        patches a service already held in the route table
+
+        @param _id: (str) id of service
+        @param ctx: (dict) fields that were updated
+        """
+        service = Regex._routes.get(str(_id))
+        if service is not None:
+            # updated fields are replaced whole, a patched list must not keep entries it dropped
+            Regex.set_route({**service, **ctx})
+
+    @staticmethod
+    def remove_route(_id: str):
+        """
+        removes a service from the route table
+
+        @param _id: (str) id of service
+        """
+        Regex._routes.remove(str(_id))
+
+    @staticmethod
+    def invalidate():
+        """
+        forces the route table to be rebuilt on next lookup
+        """
+        Regex._loaded_at = None
+
+    @staticmethod
+    async def load_routes(db: AsyncIOMotorCollection):
+        """
+        rebuilds the route table from the service collection
+
+        @param db: mongo collection instance
+        """
+        routes = Router()
+        async for ctx in db.find({}):
+            pattern = Regex.compile_route(ctx)
+            if pattern is not None:
+                routes.add(str(ctx['_id']), pattern, ctx)
+        Regex._routes = routes
+        Regex._loaded_at = time.monotonic()
+
+    @staticmethod
+    async def _ensure_routes(db: AsyncIOMotorCollection):
+        """
+        loads the route table if it is missing or older than ROUTE_TABLE_TTL
+
+        @param db: mongo collection instance
+        """
+        if Regex._loaded_at is not None and time.monotonic() - Regex._loaded_at < ROUTE_TABLE_TTL:
+            return
+        if Regex._lock is None:
+            Regex._lock = asyncio.Lock()
+        async with Regex._lock:
+            if Regex._loaded_at is None or time.monotonic() - Regex._loaded_at >= ROUTE_TABLE_TTL:
+                await Regex.load_routes(db)
+
+    @staticmethod
+    def match_routes(path: str):
+        """
+        finds the service whose path has the most regex groups matching path
+
+        same result as best_match(get_matched_paths(...)) without touching mongo
+
+        @param path: (str) request path
+        @returns: matched service with regex_groups or None
+        """
+        match = Regex._routes.match(path)
+        if match is None:
+            return None
+        return pydash.merge({}, match[0], {'regex_groups': match[1]})
+
+    @staticmethod
+    def match_routes_linear(path: str):
+        """
+        linear scan over every compiled route, kept as a reference for match_routes
+
+        @param path: (str) request path
+        @returns: matched service with regex_groups or None
+        """
+        best = None
+        best_groups = 0
+        for pattern, service in Regex._routes.values():
+            # a pattern with fewer groups can never beat the current best
+            if pattern.groups > best_groups:
+                match = pattern.match(path)
+                if match:
+                    best = (service, match.groups())
+                    best_groups = pattern.groups
+        if best is None:
+            return None
+        return pydash.merge({}, best[0], {'regex_groups': best[1]})
+
+    @staticmethod
+    async def match(path: str, db: AsyncIOMotorCollection):
+        """
+        matches a path against the in memory route table
+
+        @param path: (str) request path
+        @param db: mongo collection instance used to (re)build the table
+        @returns: matched service with regex_groups or None
+        """
+        await Regex._ensure_routes(db)
+        return Regex.match_routes(path)
@@ -0,0 +1,239 @@
+import re
+
+# constructs that depend on absolute group numbers/names or global flags and
+# therefore can not be merged into a shared alternation
+_uncombinable = re.compile(r'\\[1-9]|\\g<|\(\?P|\(\?<(?![=!])|\(\?\(|^\(\?[aiLmsux-]+\)')
+_special_chars = '.^$*+?{}[]()|'
+_repeat_chars = '*?{'
+
+
+class _Node:
+    __slots__ = ('children', 'bucket')
+
+    def __init__(self):
+        self.children = {}
+        self.bucket = None
+
+
+class _Bucket:
+    __slots__ = ('entries', 'combined', 'markers', 'standalone', 'dirty')
+
+    def __init__(self):
+        self.entries = {}
+        self.combined = None
+        self.markers = []
+        self.standalone = []
+        self.dirty = True
+
+
+class Router:
+    """
+    matches a path against many regex routes
+
+    routes are grouped in a trie by their literal prefix, and the routes sharing
+    a prefix are merged into one alternation ordered by group count, so a lookup
+    only evaluates the buckets whose prefix is a prefix of the path. the winner is
+    the matching route with the most regex groups, earliest added on ties
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._entries = {}
+        self._order = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def literal_prefix(pattern: str) -> str:
+        """
+        gets the literal text every match of pattern has to start with
+
+        @param pattern: (str) regex pattern
+        @returns: literal prefix, empty if none can be determined
+        """
+        if '|' in pattern:
+            return ''
+        prefix = []
+        i = 1 if pattern.startswith('^') else 0
+        while i < len(pattern):
+            char = pattern[i]
+            if char == '\\':
+                if i + 1 >= len(pattern) or pattern[i + 1].isalnum():
+                    break
+                char, step = pattern[i + 1], 2
+            elif char in _special_chars:
+                break
+            else:
+                step = 1
+            following = pattern[i + step:i + step + 1]
+            if following and following in _repeat_chars:
+                break
+            prefix.append(char)
+            i += step
+            if following == '+':
+                break
+        return ''.join(prefix)
+
+    @staticmethod
+    def strip_groups(pattern: str) -> str:
+        """
+        turns the capturing groups of pattern into non capturing groups
+
+        @param pattern: (str) regex pattern
+        """
+        stripped = []
+        escaped = False
+        class_start = None
+        for i, char in enumerate(pattern):
+            stripped.append(char)
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif class_start is not None:
+                # a ] right after [ or [^ is a literal
+                if char == ']' and pattern[class_start:i] not in ('[', '[^'):
+                    class_start = None
+            elif char == '[':
+                class_start = i
+            elif char == '(' and pattern[i + 1:i + 2] != '?':
+                stripped.append('?:')
+        return ''.join(stripped)
+
+    @staticmethod
+    def is_combinable(pattern: str) -> bool:
+        """
+        checks if pattern can be merged into a shared alternation
+
+        @param pattern: (str) regex pattern
+        """
+        return _uncombinable.search(pattern) is None
+
+    def _bucket(self, prefix: str, create: bool):
+        node = self._root
+        for char in prefix:
+            child = node.children.get(char)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[char] = _Node()
+            node = child
+        if node.bucket is None and create:
+            node.bucket = _Bucket()
+        return node.bucket
+
+    def add(self, key: str, pattern: re.Pattern, payload: object):
+        """
+        adds or replaces a route
+
+        @param key: (str) unique id of route
+        @param pattern: (Pattern) compiled route pattern
+        @param payload: (object) value returned when the route wins
+        """
+        existing = self._entries.get(key)
+        if existing is not None:
+            order = existing[1]
+            self._unindex(existing)
+        else:
+            order = self._order
+            self._order += 1
+        # routes without groups can never win, so they are not indexed
+        if pattern.groups == 0:
+            self._entries.pop(key, None)
+            return
+        prefix = Router.literal_prefix(pattern.pattern)
+        entry = (pattern, order, payload, prefix, key)
+        self._entries[key] = entry
+        bucket = self._bucket(prefix, True)
+        bucket.entries[key] = entry
+        bucket.dirty = True
+
+    def _unindex(self, entry: tuple):
+        bucket = self._bucket(entry[3], False)
+        if bucket is not None:
+            bucket.entries.pop(entry[4], None)
+            bucket.dirty = True
+
+    def remove(self, key: str):
+        """
+        removes a route
+
+        @param key: (str) unique id of route
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._unindex(entry)
+
+    def get(self, key: str):
+        """
+        gets the payload of a route
+
+        @param key: (str) unique id of route
+        """
+        entry = self._entries.get(key)
+        return entry[2] if entry is not None else None
+
+    def values(self):
+        """
+        iterates over (pattern, payload) of every indexed route
+        """
+        for entry in self._entries.values():
+            yield entry[0], entry[2]
+
+    @staticmethod
+    def _compile(bucket: _Bucket):
+        ranked = sorted(bucket.entries.values(), key=lambda entry: (-entry[0].groups, entry[1]))
+        alternatives = []
+        # markers[i] is the entry whose alternative ends with the empty group i + 1.
+        # the route groups themselves are stripped: sre saves every group mark on
+        # each branch it tries, which makes wide alternations of capturing groups
+        # quadratic. groups of the winner are recovered with its own pattern
+        bucket.markers = [None]
+        bucket.standalone = []
+        for entry in ranked:
+            if Router.is_combinable(entry[0].pattern) and entry[0].flags == re.UNICODE:
+                bucket.markers.append(entry)
+                alternatives.append(f'(?:{Router.strip_groups(entry[0].pattern)})()')
+            else:
+                bucket.standalone.append(entry)
+        bucket.combined = re.compile('|'.join(alternatives)) if alternatives else None
+        bucket.dirty = False
+
+    @staticmethod
+    def _match_bucket(bucket: _Bucket, path: str, best):
+        if bucket.dirty:
+            Router._compile(bucket)
+        if bucket.combined is not None:
+            match = bucket.combined.match(path)
+            if match:
+                entry = bucket.markers[match.lastindex]
+                if best is None or (-entry[0].groups, entry[1]) < (-best[0].groups, best[1]):
+                    best = entry
+        for entry in bucket.standalone:
+            if best is not None and (-entry[0].groups, entry[1]) >= (-best[0].groups, best[1]):
+                continue
+            if entry[0].match(path):
+                best = entry
+        return best
+
+    def match(self, path: str):
+        """
+        finds the route with the most regex groups matching path
+
+        @param path: (str) path to match
+        @returns: (payload, regex groups) or None
+        """
+        best = None
+        node = self._root
+        if node.bucket is not None and node.bucket.entries:
+            best = Router._match_bucket(node.bucket, path, best)
+        for char in path:
+            node = node.children.get(char)
+            if node is None:
+                break
+            if node.bucket is not None and node.bucket.entries:
+                best = Router._match_bucket(node.bucket, path, best)
+        if best is None:
+            return None
+        return best[2], best[0].match(path).groups()
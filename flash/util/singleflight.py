@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+
+class SingleFlight:
+    """
+    lets concurrent callers asking for the same key share the result of the
+    first one instead of each doing the work
+
+    a flight led with a timeout lands with None once it is over, so a leader
+    that never lands it can not keep followers waiting on the key for good
+    """
+
+    def __init__(self):
+        self._flights = {}
+
+    def join(self, key) -> asyncio.Future:
+        """
+        gets the flight in progress for a key
+
+        @param key: key of flight
+        @returns: future of the flight or None if the caller should lead one
+        """
+        entry = self._flights.get(key)
+        if entry is None:
+            return None
+        flight, deadline, _ = entry
+        if deadline is not None and time.monotonic() >= deadline:
+            self.land(key, flight, None)
+            return None
+        return flight
+
+    def lead(self, key, timeout: float = None) -> asyncio.Future:
+        """
+        starts a flight for a key, it has to be landed by the caller
+
+        @param key: key of flight
+        @param timeout: (float) seconds after which the flight lands with None
+        """
+        loop = asyncio.get_event_loop()
+        flight = loop.create_future()
+        deadline = handle = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+            handle = loop.call_later(timeout, self.land, key, flight, None)
+        self._flights[key] = (flight, deadline, handle)
+        return flight
+
+    def land(self, key, flight: asyncio.Future, result=None):
+        """
+        ends a flight and hands its result to every caller waiting on it
+
+        @param key: key of flight
+        @param flight: (Future) flight returned by lead
+        @param result: shared result, None makes followers do the work themselves
+        """
+        entry = self._flights.get(key)
+        if entry is not None and entry[0] is flight:
+            self._flights.pop(key)
+            if entry[2] is not None:
+                entry[2].cancel()
+        if not flight.done():
+            flight.set_result(result)
+
+    @staticmethod
+    async def wait(flight: asyncio.Future, timeout: float):
+        """
+        waits for the result of a flight
+
+        @param flight: (Future) flight to wait for
+        @param timeout: (float) seconds to wait
+        @returns: result of flight or None when it took too long
+        """
+        try:
+            return await asyncio.wait_for(asyncio.shield(flight), timeout)
+        except asyncio.TimeoutError:
+            return None
@@ -11,19 +11,28 @@ from flash.models.circuit_breaker import CircuitBreaker
 from flash.models.endpoint_cacher import EndpointCacher
 from flash.models.event import Event
 from flash.models.insights import Insights
-from flash.models.rate_limiter import RateLimiter
 from flash.models.service import Service
+from flash.proxy.warmup import Warmup
 from flash.util import Api
 
 tasks = Celery('api.util.tasks', broker=REDIS, backend=REDIS)
 
 tasks.conf.beat_schedule = {
-    'raven.api.rate_limiter.clear_empty_entries': {
-        'task': 'raven.api.task.async',
-        'schedule': crontab(),
+    'gateway.api.endpoint_cacher.warmup': {
+        'task': 'gateway.api.task.async',
+        'schedule': crontab(minute='*/5'),
         'args': [{
-            'func': 'RateLimiter.clear_empty_entries',
-            'args': ['redis'],
+            'func': 'Warmup.run_all',
+            'args': ['mongo:service', 'redis'],
+            'kwargs': {}
+        }]
+    },
+    'gateway.api.insights.enforce_retention': {
+        'task': 'gateway.api.task.async',
+        'schedule': crontab(minute=0),
+        'args': [{
+            'func': 'Insights.enforce_retention',
+            'args': ['mongo:service', 'mongo:insights'],
             'kwargs': {}
         }]
     }
@@ -79,12 +88,10 @@ class TaskProvider(Task):
         'EndpointCacher.set_cache': EndpointCacher.set_cache,
         'Event.handle_event': Event.handle_event,
         'Insights.create': Insights.create,
-        'RateLimiter.clear_empty_entries': RateLimiter.clear_empty_entries,
-        'RateLimiter.create_entry': RateLimiter.create_entry,
-        'RateLimiter.increment_entry_count': RateLimiter.increment_entry_count,
-        'RateLimiter.update_entry': RateLimiter.update_entry,
+        'Insights.enforce_retention': Insights.enforce_retention,
         'Service.advance_target': Service.advance_target,
-        'Service.update': Service.update
+        'Service.update': Service.update,
+        'Warmup.run_all': Warmup.run_all
     }
 
     @property
@@ -96,9 +103,7 @@ class TaskProvider(Task):
     @property
     def redis(self):
         if self._redis_instance is None:
-            self._redis_instance = self.loop.run_until_complete(
-                aioredis.from_url(REDIS)
-            )
+            self._redis_instance = aioredis.from_url(REDIS, decode_responses=True)
         return self._redis_instance
 
     @property
@@ -25,3 +25,18 @@ class Token:
         """
         payload = jwt.decode(token, key=JWT_SECRET, algorithms=JWT_ALGORITHM)
         return payload
+
+    @staticmethod
+    def claims(token: str) -> object:
+        """
+        reads the payload of a jwt token after verifying its signature
+
+        @return: provided tokens payload, empty if it is not signed with the configured secret
+        """
+        if not JWT_SECRET:
+            return {}
+        try:
+            claims = jwt.decode(token, key=JWT_SECRET, algorithms=[JWT_ALGORITHM])
+            return claims if isinstance(claims, dict) else {}
+        except jwt.InvalidTokenError:
+            return {}
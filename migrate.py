@@ -0,0 +1,48 @@
+import argparse
+import asyncio
+
+import aioredis
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from flash.config.config import Settings
+from flash.models.endpoint_cacher import EndpointCacher
+from flash.models.insights import Insights, collection_name as insights_collection
+from flash.models.rate_limiter import RateLimiter
+from flash.util.env import REDIS
+
+
+async def reverse_indexes():
+    """
+    builds the reverse index sets of the rate limiter and endpoint cacher
+    from the index hashes written before they existed
+    """
+    # the same client settings as the app, the indexes are read decoded
+    redis = aioredis.from_url(Settings().REDIS_URL or REDIS, decode_responses=True)
+    try:
+        await RateLimiter.rebuild_indexes(redis)
+        await EndpointCacher.rebuild_indexes(redis)
+    finally:
+        await redis.close()
+
+
+async def insights_fields():
+    """
+    renames the fields of insights written before they were stored with short names
+    """
+    settings = Settings()
+    client = AsyncIOMotorClient(settings.DATABASE_URL)
+    try:
+        await Insights.compact_fields(client.get_default_database(settings.DATABASE_NAME)[insights_collection])
+    finally:
+        client.close()
+
+
+migrations = {
+    'reverse_indexes': reverse_indexes,
+    'insights_fields': insights_fields,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='runs a data migration')
+    parser.add_argument('migration', choices=migrations.keys())
+    asyncio.run(migrations[parser.parse_args().migration]())